@@ -0,0 +1,85 @@
+"""
+A minimal runner for the benchmarks, for when asv isn't available:
+
+    python3 -m benchmarks [--max-size NUM] [PATTERN]
+
+Runs every benchmark (whose name contains PATTERN) once for each set of
+parameters and prints its wall time, peak memory or tracked value. Peak memory is measured
+with tracemalloc, so it only counts allocations made through Python
+(including NumPy arrays), unlike asv's peak RSS.
+"""
+
+import argparse
+import importlib
+import inspect
+import itertools
+import pkgutil
+import time
+import tracemalloc
+from pathlib import Path
+
+parser = argparse.ArgumentParser(
+    prog="python3 -m benchmarks",
+    description="Run the hic2structure benchmarks without asv"
+)
+parser.add_argument(
+    "--max-size",
+    type=int, default=100000, metavar="NUM", dest="max_size",
+    help="Skip parameter sets with a bead count larger than this. (Defaults to 100000)"
+)
+parser.add_argument(
+    "pattern",
+    nargs="?", default="", help="Only run benchmarks whose name contains this"
+)
+args = parser.parse_args()
+
+def measure(kind, func, params):
+    if kind == 'track':
+        return f"{func(*params):10} {getattr(func, 'unit', '')}"
+
+    if kind == 'time':
+        start = time.perf_counter()
+        func(*params)
+        return f"{time.perf_counter() - start:10.4f} s"
+
+    tracemalloc.start()
+    func(*params)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return f"{peak / 2**20:10.2f} MB"
+
+package = Path(__file__).parent
+for info in pkgutil.iter_modules([str(package)]):
+    if not info.name.startswith('bench_'):
+        continue
+    module = importlib.import_module(f'benchmarks.{info.name}')
+
+    for (class_name, cls) in inspect.getmembers(module, inspect.isclass):
+        if cls.__module__ != module.__name__:
+            continue
+
+        names = getattr(cls, 'param_names', [])
+        for params in itertools.product( *getattr(cls, 'params', []) ):
+            if 'beads' in names and params[ names.index('beads') ] > args.max_size:
+                continue
+
+            for (method_name, method) in inspect.getmembers(cls, inspect.isfunction):
+                kind = method_name.split('_')[0]
+                if kind not in ('time', 'peakmem', 'track'):
+                    continue
+                label = f"{info.name}.{class_name}.{method_name}{params}"
+                if args.pattern not in label:
+                    continue
+
+                bench = cls()
+                try:
+                    if hasattr(bench, 'setup'):
+                        bench.setup(*params)
+                except NotImplementedError:
+                    continue
+                try:
+                    result = measure(kind, getattr(bench, method_name), params)
+                finally:
+                    if hasattr(bench, 'teardown'):
+                        bench.teardown(*params)
+                print(f"{result}  {label}", flush=True)
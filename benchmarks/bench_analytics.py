@@ -0,0 +1,34 @@
+"""
+Benchmarks for structure analytics
+"""
+
+import tempfile
+from pathlib import Path
+
+from hic2structure.analytics import analyze_file
+
+from .fixtures import SIZES, make_dumpfile
+from .bench_lammps import MAX_DUMP_ROWS
+
+class AnalyzeDump:
+    params = [ SIZES ]
+    param_names = [ 'beads' ]
+    timeout = 600
+
+    FRAMES = 10
+
+    def setup(self, beads):
+        if beads * self.FRAMES > MAX_DUMP_ROWS:
+            raise NotImplementedError("Dump too large")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / 'sim.dump'
+        make_dumpfile(self.path, beads, self.FRAMES)
+
+    def teardown(self, beads):
+        self.tmpdir.cleanup()
+
+    def time_analyze_file(self, beads):
+        analyze_file(self.path)
+
+    def peakmem_analyze_file(self, beads):
+        analyze_file(self.path)
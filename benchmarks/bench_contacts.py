@@ -0,0 +1,90 @@
+"""
+Benchmarks for finding and comparing contacts
+"""
+
+from hic2structure.contacts import (
+    find_contacts, compare_contacts, select_contacts, ContactAccumulator
+)
+from hic2structure.contactmap import ContactMap
+
+from .fixtures import SIZES, make_timestep, make_contact_records, make_contact_set
+
+class FindContacts:
+    params = [ SIZES ]
+    param_names = [ 'beads' ]
+    timeout = 300
+
+    def setup(self, beads):
+        self.data = make_timestep(beads)
+        self.settings = { 'distance_threshold': 1.5 }
+
+    def time_find_contacts(self, beads):
+        find_contacts(self.data, self.settings)
+
+    def peakmem_find_contacts(self, beads):
+        find_contacts(self.data, self.settings)
+
+class AccumulateContacts:
+    params = [ SIZES ]
+    param_names = [ 'beads' ]
+    timeout = 300
+
+    def setup(self, beads):
+        self.frames = [ make_timestep(beads) for _ in range(5) ]
+
+    def time_accumulate_contacts(self, beads):
+        ContactAccumulator(1.5).add_all(self.frames).to_contact_map()
+
+    def peakmem_accumulate_contacts(self, beads):
+        ContactAccumulator(1.5).add_all(self.frames).to_contact_map()
+
+class CompareContacts:
+    params = [ SIZES ]
+    param_names = [ 'beads' ]
+    timeout = 300
+
+    def setup(self, beads):
+        self.experimental = make_contact_records(beads)
+        self.simulated = make_contact_set(beads, per_bead=5)
+
+    def time_compare_contacts(self, beads):
+        compare_contacts(self.simulated, self.experimental)
+
+    def peakmem_compare_contacts(self, beads):
+        compare_contacts(self.simulated, self.experimental)
+
+class ContactMapOperations:
+    params = [ SIZES ]
+    param_names = [ 'beads' ]
+    timeout = 300
+
+    def setup(self, beads):
+        self.experimental = ContactMap.from_records( make_contact_records(beads) )
+        self.simulated = ContactMap.from_set( make_contact_set(beads, per_bead=5) )
+
+    def time_intersection(self, beads):
+        ContactMap.from_set(self.simulated.to_set()) & self.experimental
+
+    def time_degree(self, beads):
+        ContactMap.from_set(self.simulated.to_set()).degree
+
+class SelectContacts:
+    params = [ SIZES, [ 'min_separation', 'stratum_quantile', 'max_degree', 'max_contacts' ] ]
+    param_names = [ 'beads', 'strategy' ]
+    timeout = 300
+
+    # A setting for each strategy, keeping roughly half the contacts
+    SETTINGS = {
+        'min_separation': 3,
+        'stratum_quantile': 0.5,
+        'max_degree': 10,
+        'max_contacts': None, # Half the records, set in setup
+    }
+
+    def setup(self, beads, strategy):
+        self.records = make_contact_records(beads)
+        value = self.SETTINGS[strategy]
+        self.settings = { strategy: len(self.records) // 2 if value is None else value }
+
+    def time_select_contacts(self, beads, strategy):
+        select_contacts(self.records, self.settings)
@@ -0,0 +1,40 @@
+"""
+Benchmarks for reading Hi-C files
+"""
+
+import tempfile
+from pathlib import Path
+
+from hic2structure.hic import HICMetadata, records_to_table
+
+from .fixtures import SIZES, make_hic_header, make_straw_records
+
+class HICMetadataParsing:
+    params = [ [25, 250, 2500], [8, 9] ]
+    param_names = [ 'chromosomes', 'version' ]
+
+    def setup(self, chromosomes, version):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / 'test.hic'
+        make_hic_header(self.path, num_chromosomes=chromosomes, version=version)
+
+    def teardown(self, chromosomes, version):
+        self.tmpdir.cleanup()
+
+    def time_metadata(self, chromosomes, version):
+        with open(self.path, 'rb') as f:
+            HICMetadata(f)
+
+class RecordConversion:
+    params = [ SIZES ]
+    param_names = [ 'beads' ]
+    timeout = 300
+
+    def setup(self, beads):
+        self.records = make_straw_records(beads, per_bead=2)
+
+    def time_records_to_table(self, beads):
+        records_to_table(self.records, 200000)
+
+    def peakmem_records_to_table(self, beads):
+        records_to_table(self.records, 200000)
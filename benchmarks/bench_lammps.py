@@ -0,0 +1,138 @@
+"""
+Benchmarks for generating LAMMPS input and reading its output
+"""
+
+import tempfile
+from pathlib import Path
+
+from hic2structure.lammps import (
+    random_walk, initial_conformation, seed_streams,
+    write_input_deck, read_dumpfile, iter_dumpfile, convert_dumpfile,
+    write_compact_dump, CompactDump, run_lammps
+)
+from hic2structure.contacts import find_contacts
+from hic2structure.contactmap import ContactMap
+
+from .fixtures import (
+    SIZES, make_contact_set, make_contact_records, make_dumpfile,
+    install_fake_lammps
+)
+
+# Skip dumps bigger than this many lines of atoms
+MAX_DUMP_ROWS = 2000000
+
+class RandomWalk:
+    params = [ SIZES ]
+    param_names = [ 'beads' ]
+    timeout = 600
+
+    def time_random_walk(self, beads):
+        random_walk(beads, seed_streams(0)[0])
+
+    def peakmem_random_walk(self, beads):
+        random_walk(beads, seed_streams(0)[0])
+
+class InputDeck:
+    params = [ SIZES ]
+    param_names = [ 'beads' ]
+    timeout = 600
+
+    def setup(self, beads):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.contacts = make_contact_set(beads, per_bead=2)
+        self.coords = initial_conformation( int(self.contacts.max()), seed_streams(0)[0] )
+        self.settings = { 'bond_coeff': 55, 'timesteps': 1000, 'seed': 0 }
+
+    def teardown(self, beads):
+        self.tmpdir.cleanup()
+
+    def time_write_input_deck(self, beads):
+        write_input_deck( Path(self.tmpdir.name), self.settings, self.contacts, self.coords )
+
+class WeightedInputDeck:
+    '''
+    Input decks with count-weighted contact bonds, for a low threshold
+    (i.e. many contacts per bead)
+    '''
+    params = [ SIZES, [0, 8] ]
+    param_names = [ 'beads', 'bins' ]
+    timeout = 600
+
+    def setup(self, beads, bins):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.contacts = ContactMap.from_records( make_contact_records(beads, per_bead=10) )
+        self.coords = initial_conformation( self.contacts.num_beads, seed_streams(0)[0] )
+        self.settings = { 'bond_coeff': 55, 'timesteps': 1000, 'seed': 0, 'bond_bins': bins }
+
+    def teardown(self, beads, bins):
+        self.tmpdir.cleanup()
+
+    def time_write_input_deck(self, beads, bins):
+        write_input_deck( Path(self.tmpdir.name), self.settings, self.contacts, self.coords )
+
+class DumpParsing:
+    params = [ SIZES, [2, 10] ]
+    param_names = [ 'beads', 'frames' ]
+    timeout = 600
+
+    def setup(self, beads, frames):
+        if beads * frames > MAX_DUMP_ROWS:
+            raise NotImplementedError("Dump too large")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / 'sim.dump'
+        make_dumpfile(self.path, beads, frames)
+
+    def teardown(self, beads, frames):
+        self.tmpdir.cleanup()
+
+    def time_read_dumpfile(self, beads, frames):
+        read_dumpfile(self.path)
+
+    def peakmem_read_dumpfile(self, beads, frames):
+        read_dumpfile(self.path)
+
+    def peakmem_iter_dumpfile(self, beads, frames):
+        for _ in iter_dumpfile(self.path):
+            pass
+
+    def time_write_compact_dump(self, beads, frames):
+        write_compact_dump(self.path, Path(self.tmpdir.name) / 'sim.h2c')
+
+    def peakmem_compact_find_contacts(self, beads, frames):
+        compact = Path(self.tmpdir.name) / 'compact.h2c'
+        if not compact.exists():
+            write_compact_dump(self.path, compact)
+        dump = CompactDump(compact)
+        for timestep in dump:
+            find_contacts(dump[timestep], { 'distance_threshold': 1.5 })
+
+    def time_convert_dumpfile(self, beads, frames):
+        convert_dumpfile(self.path, Path(self.tmpdir.name) / 'sim.h2t')
+
+    def time_convert_dumpfile_int16_delta(self, beads, frames):
+        convert_dumpfile(
+            self.path, Path(self.tmpdir.name) / 'sim.h2t',
+            precision='int16', delta=True
+        )
+
+class RunLAMMPS:
+    """
+    The whole of run_lammps, with a stand-in for the LAMMPS executable
+    (so this measures only the Python side)
+    """
+    params = [ SIZES[:3] ]
+    param_names = [ 'beads' ]
+    timeout = 600
+
+    def setup(self, beads):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.lammps = str( install_fake_lammps(Path(self.tmpdir.name)) )
+        self.contacts = make_contact_set(beads, per_bead=2)
+        self.coords = initial_conformation( int(self.contacts.max()), seed_streams(0)[0] )
+        self.settings = { 'bond_coeff': 55, 'timesteps': 1000, 'seed': 0 }
+
+    def teardown(self, beads):
+        self.tmpdir.cleanup()
+
+    def time_run_lammps(self, beads):
+        run_lammps(self.contacts, self.settings, self.lammps, initial_coords=self.coords)
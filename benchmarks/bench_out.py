@@ -0,0 +1,78 @@
+"""
+Benchmarks for writing output files
+"""
+
+import tempfile
+from pathlib import Path
+
+from hic2structure.out import (
+    STRUCTURE_FORMATS, TEXT_COMPRESSIONS, write_structure,
+    write_contact_records, write_contact_set
+)
+
+from .fixtures import SIZES, make_timestep, make_contact_records, make_contact_set
+
+class StructureOutput:
+    params = [ SIZES, list(STRUCTURE_FORMATS.keys()) ]
+    param_names = [ 'beads', 'format' ]
+    timeout = 300
+
+    def setup(self, beads, format):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / f'structure{STRUCTURE_FORMATS[format]}'
+        self.data = make_timestep(beads)
+
+    def teardown(self, beads, format):
+        self.tmpdir.cleanup()
+
+    def time_write_structure(self, beads, format):
+        write_structure(self.path, self.data)
+
+class ContactMapOutput:
+    params = [ SIZES, ['tsv', 'npz'] ]
+    param_names = [ 'beads', 'format' ]
+    timeout = 300
+
+    def setup(self, beads, format):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / f'contacts.{format}'
+        self.records = make_contact_records(beads)
+        self.contacts = make_contact_set(beads)
+
+    def teardown(self, beads, format):
+        self.tmpdir.cleanup()
+
+    def time_write_contact_records(self, beads, format):
+        write_contact_records(self.path, self.records)
+
+    def peakmem_write_contact_records(self, beads, format):
+        write_contact_records(self.path, self.records)
+
+    def time_write_contact_set(self, beads, format):
+        write_contact_set(self.path, self.contacts)
+
+class CompressedTextOutput:
+    params = [ SIZES, list(TEXT_COMPRESSIONS.keys()) ]
+    param_names = [ 'beads', 'compression' ]
+    timeout = 300
+
+    def setup(self, beads, compression):
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise NotImplementedError("zstandard isn't installed")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        self.ext = TEXT_COMPRESSIONS[compression]
+        self.data = make_timestep(beads)
+        self.records = make_contact_records(beads)
+
+    def teardown(self, beads, compression):
+        self.tmpdir.cleanup()
+
+    def time_write_structure(self, beads, compression):
+        write_structure(self.dir / f'structure.csv{self.ext}', self.data)
+
+    def time_write_contact_records(self, beads, compression):
+        write_contact_records(self.dir / f'contacts.tsv{self.ext}', self.records)
@@ -0,0 +1,99 @@
+"""
+Benchmarks for the startup time of the command-line interface.
+
+Each benchmark starts a new interpreter, since that's what a job launcher
+calling the CLI pays for every time.
+"""
+
+import subprocess as sub
+import sys
+import tempfile
+from pathlib import Path
+
+from .fixtures import make_hic_header
+
+#
+# Modules that are slow to import, and should only be imported
+# when they're needed
+#
+HEAVY_MODULES = [ 'numpy', 'scipy', 'hicstraw' ]
+
+def _python(*args) -> str:
+    proc = sub.run(
+        [ sys.executable, *args ],
+        stdout=sub.PIPE, stderr=sub.DEVNULL, text=True
+    )
+    return proc.stdout
+
+def _count_heavy_modules(code: str) -> int:
+    """
+    Run 'code' in a new interpreter, and count how many of the
+    HEAVY_MODULES it imported
+    """
+    output = _python('-c', (
+        f"import sys\n{code}\n"
+        f"print(sum( m in sys.modules for m in {HEAVY_MODULES!r} ))"
+    ))
+    return int(output.strip().splitlines()[-1])
+
+class CLIStartup:
+    timeout = 120
+
+    def setup(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / 'test.hic'
+        make_hic_header(self.path)
+        self.metadata_code = (
+            "from pathlib import Path\n"
+            "from hic2structure.hic import HIC\n"
+            f"HIC(Path({str(self.path)!r}))"
+        )
+
+    def teardown(self):
+        self.tmpdir.cleanup()
+
+    def time_interpreter(self):
+        # Baseline: an interpreter that does nothing
+        _python('-c', 'pass')
+
+    def time_help(self):
+        _python('-m', 'hic2structure', '--help')
+
+    def time_sweep_help(self):
+        _python('-m', 'hic2structure', 'sweep', '--help')
+
+    def time_metadata(self):
+        _python('-c', self.metadata_code)
+
+    def time_inspect(self):
+        _python('-m', 'hic2structure', 'inspect', '--json', str(self.path))
+
+    def track_heavy_imports_help(self):
+        return _count_heavy_modules(
+            "from hic2structure.__main__ import build_parser\n"
+            "build_parser().format_help()"
+        )
+    track_heavy_imports_help.unit = 'modules'
+
+    def track_heavy_imports_metadata(self):
+        return _count_heavy_modules(self.metadata_code)
+    track_heavy_imports_metadata.unit = 'modules'
+
+class InspectCatalogue:
+    params = [ [10, 100, 500] ]
+    param_names = [ 'files' ]
+    timeout = 300
+
+    def setup(self, files):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i in range(files):
+            path = Path(self.tmpdir.name) / f'{i}.hic'
+            make_hic_header(path, num_chromosomes=25)
+            self.paths.append( str(path) )
+
+    def teardown(self, files):
+        self.tmpdir.cleanup()
+
+    def time_inspect(self, files):
+        _python('-m', 'hic2structure', 'inspect', '--json', *self.paths)
@@ -0,0 +1,197 @@
+"""
+Synthetic inputs for the benchmarks.
+
+Everything here is generated from a fixed seed, so runs are comparable.
+Nothing needs a real .hic file or a real LAMMPS installation.
+"""
+
+import os
+import stat
+import struct
+import sys
+import textwrap
+from pathlib import Path
+
+import numpy as np
+
+SEED = 12345
+
+# Sizes (in beads) that benchmarks are run over
+SIZES = [ 1000, 10000, 100000, 1000000 ]
+
+def rng() -> np.random.Generator:
+    return np.random.default_rng(SEED)
+
+########################
+# HI-C
+########################
+
+def _cstr(s: str) -> bytes:
+    return s.encode('utf-8') + b'\0'
+
+def make_hic_header(
+    path: Path, num_chromosomes: int=25, num_attributes: int=10,
+    resolutions=(2500000, 1000000, 500000, 250000, 100000, 50000, 25000, 10000, 5000),
+    version: int=8
+):
+    """
+    Write the header of a .hic file: everything HICMetadata reads,
+    but no contact data.
+    """
+    length = struct.Struct('<q' if version > 8 else '<i')
+
+    data = b'HIC\0' + struct.pack('<i', version) + struct.pack('<q', 0)
+    data += _cstr('synthetic')
+    if version > 8:
+        data += struct.pack('<q', 0) + struct.pack('<q', 0)
+
+    data += struct.pack('<i', num_attributes)
+    for i in range(num_attributes):
+        data += _cstr(f'attribute{i}') + _cstr('x' * 1000)
+
+    data += struct.pack('<i', num_chromosomes)
+    for i in range(num_chromosomes):
+        data += _cstr(f'chr{i+1}') + length.pack(1000000 * (i % 250 + 1))
+
+    data += struct.pack('<i', len(resolutions))
+    for res in resolutions:
+        data += struct.pack('<i', res)
+    data += struct.pack('<i', 0)
+
+    with open(path, 'wb') as f:
+        f.write(data)
+
+class StrawRecord:
+    """
+    Stand-in for the contact records returned by hic-straw
+    """
+    __slots__ = [ 'binX', 'binY', 'counts' ]
+
+    def __init__(self, binX, binY, counts):
+        self.binX = binX
+        self.binY = binY
+        self.counts = counts
+
+def make_straw_records(num_beads: int, resolution: int=200000, per_bead: int=10) -> list:
+    """
+    Generate a list of hic-straw-like records, with 'per_bead' contacts
+    near the diagonal for each bead
+    """
+    contacts = make_contact_records(num_beads, per_bead)
+    return [
+        StrawRecord( int(x-1) * resolution, int(y-1) * resolution, float(c) )
+        for (x, y, c) in contacts
+    ]
+
+def make_contact_records(num_beads: int, per_bead: int=10) -> np.ndarray:
+    """
+    Generate ContactRecords with 'per_bead' contacts for each bead, with
+    genomic separations (and counts) following a rough power-law.
+    """
+    r = rng()
+    x = np.repeat( np.arange(1, num_beads+1), per_bead )
+    separation = np.minimum( r.zipf(1.5, len(x)), num_beads-1 )
+    y = x + separation
+    keep = y <= num_beads
+    (x, y) = ( x[keep], y[keep] )
+    counts = r.pareto(1.0, len(x)) + 1.0
+    return np.column_stack( (x, y, counts) ).astype(np.float64)
+
+def make_contact_set(num_beads: int, per_bead: int=10) -> np.ndarray:
+    return make_contact_records(num_beads, per_bead)[:,:2].astype(np.int64)
+
+########################
+# LAMMPS
+########################
+
+def make_timestep(num_beads: int) -> np.ndarray:
+    """
+    Generate a LAMMPSTimestep for a chain of beads (a random walk with
+    unit-length steps)
+    """
+    r = rng()
+    data = np.zeros( (num_beads, 7) )
+    data[:,0] = np.arange(1, num_beads+1)
+    data[:,1:4] = np.cumsum( r.normal(0, 0.6, (num_beads, 3)), axis=0 )
+    return data
+
+def make_dumpfile(path: Path, num_beads: int, num_frames: int=10):
+    """
+    Write a LAMMPS dump file (in the format written by the input deck)
+    with 'num_frames' frames of a slowly moving chain
+    """
+    r = rng()
+    data = make_timestep(num_beads)
+    with open(path, 'w') as f:
+        for frame in range(num_frames):
+            f.write(textwrap.dedent(f'''\
+                ITEM: TIMESTEP
+                {frame * 1000}
+                ITEM: NUMBER OF ATOMS
+                {num_beads}
+                ITEM: BOX BOUNDS pp pp pp
+                -200 200
+                -200 200
+                -200 200
+                ITEM: ATOMS id x y z ix iy iz
+                '''
+            ))
+            np.savetxt(f, data, fmt="%d %.5f %.5f %.5f %d %d %d")
+            data[:,1:4] += r.normal(0, 0.05, (num_beads, 3))
+
+#
+# A stand-in for the LAMMPS executable. It reads the input deck and writes
+# a log and a dump with the initial coordinates, at the first and last
+# timesteps, without simulating anything.
+#
+FAKE_LAMMPS = '''\
+import re
+import sys
+
+args = sys.argv[1:]
+if '-h' in args:
+    print('Fake LAMMPS (hic2structure benchmarks)')
+    sys.exit(0)
+
+with open(args[args.index('-in') + 1]) as f:
+    script = f.read()
+
+datafile = re.search(r'^read_data\\s+(\\S+)', script, re.MULTILINE).group(1)
+timesteps = int( re.findall(r'^run\\s+(\\d+)', script, re.MULTILINE)[-1] )
+
+atoms = []
+with open(datafile) as f:
+    lines = iter(f)
+    for line in lines:
+        if line.strip() == 'Atoms':
+            break
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            if atoms:
+                break
+            continue
+        atoms.append( '%s %s %s %s 0 0 0\\n' % (fields[0], fields[3], fields[4], fields[5]) )
+
+with open('sim.log', 'w') as f:
+    f.write('LAMMPS (fake)\\nLoop time of 0 on 1 procs for %d steps\\n' % timesteps)
+
+with open('sim.dump', 'w') as f:
+    for step in sorted({ 0, timesteps }):
+        f.write('ITEM: TIMESTEP\\n%d\\nITEM: NUMBER OF ATOMS\\n%d\\n' % (step, len(atoms)))
+        f.write('ITEM: BOX BOUNDS pp pp pp\\n-200 200\\n-200 200\\n-200 200\\n')
+        f.write('ITEM: ATOMS id x y z ix iy iz\\n')
+        f.writelines(atoms)
+'''
+
+def install_fake_lammps(dir: Path) -> Path:
+    """
+    Write an executable stand-in for LAMMPS (see FAKE_LAMMPS) into 'dir'
+    and return its path
+    """
+    path = Path(dir) / 'lmp'
+    with open(path, 'w') as f:
+        f.write(f'#!{sys.executable}\n')
+        f.write(FAKE_LAMMPS)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path.resolve()
@@ -1,13 +1,24 @@
 
 import argparse
+import logging
+from contextlib import ExitStack
 from pathlib import Path
 import sys
+import typing as T
 
-from .types import Settings
-from .hic import HIC, HICError
-from .lammps import LAMMPSError, run_lammps
-from .contacts import contact_records_to_set
-from .out import write_structure
+# Only lightweight modules are imported here, so that startup (and --help)
+# stays fast. NumPy, SciPy, hic-straw and the modules that need them are
+# imported once they're actually used.
+from .formats import (
+    STRUCTURE_FORMATS, PRECISIONS, NORMALIZATIONS, MATRIX_TYPES, BOND_MAPPINGS,
+    TEXT_COMPRESSIONS
+)
+from .metrics import MetricsCollector, StageTable, collecting
+
+if T.TYPE_CHECKING:
+    from .types import Settings
+    from .hic import HIC
+    from .contactmap import ContactMap
 
 ########################
 # GLOBALS
@@ -19,16 +30,64 @@ verbose=False
 # HELPER FUNCTIONS
 ########################
 
-def settings_from_args(args: argparse.Namespace) -> Settings:
+def settings_from_args(args: argparse.Namespace) -> 'Settings':
     return {
         'chromosome': args.chromosome,
+        'chromosomes': args.chromosomes,
         'resolution': args.resolution,
         'count_threshold': args.count,
+        'normalization': args.normalization,
+        'matrix_type': args.matrix_type,
+        'min_separation': args.min_separation,
+        'stratum_quantile': args.stratum_quantile,
+        'max_degree': args.max_degree,
+        'max_contacts': args.max_contacts,
         'distance_threshold': 0, # Unused in the main script 
         'bond_coeff': args.bond_coeff,
-        'timesteps': args.timesteps
+        'timesteps': args.timesteps,
+        'seed': args.seed,
+        'bond_bins': args.bond_bins,
+        'bond_mapping': args.bond_mapping
     }
 
+def warm_start_inputs(
+    hic: 'HIC', previous_dir: Path, inputs: 'ContactMap',
+    settings: 'Settings', timesteps: int=None
+) -> T.Tuple['ContactMap', 'Settings', dict]:
+    '''
+    Prepare a warm start from the output directory of a previous run on
+    the same Hi-C file: its contacts are read again with its settings (from
+    'settings.json'), and its structure is relaxed with the new contacts
+    (see prepare_warm_start).
+    '''
+    import json
+    from .contactmap import ContactMap
+    from .lammps import prepare_warm_start
+    from .out import read_structure
+
+    with open(previous_dir/'settings.json', 'r') as f:
+        previous_settings = json.load(f)
+
+    structures = [
+        previous_dir/f'structure{ext}{compressed}'
+        for ext in STRUCTURE_FORMATS.values()
+        for compressed in TEXT_COMPRESSIONS.values()
+        if (previous_dir/f'structure{ext}{compressed}').exists()
+    ]
+    if not structures:
+        raise ValueError(f"No structure file in '{previous_dir}'")
+
+    previous = read_structure(structures[0])
+    old_inputs = ContactMap.from_records( hic.get_contact_records(previous_settings) )
+    return prepare_warm_start(previous, old_inputs, inputs, settings, timesteps)
+
+def new_seed() -> int:
+    '''
+    Pick a random seed, for runs where one wasn't given
+    '''
+    import secrets
+    return secrets.randbits(63)
+
 def log_info(message):
     '''
     Log a message to stderr (if verbose is True)
@@ -50,92 +109,863 @@ def log_error(message):
 
     print(f"{prefix} {message}")
 
+class LogInfoHandler(logging.Handler):
+    '''
+    Forwards log messages from the hic2structure modules to log_info
+    '''
+    def emit(self, record: logging.LogRecord):
+        log_info( self.format(record) )
+
+logging.getLogger('hic2structure').addHandler( LogInfoHandler() )
+logging.getLogger('hic2structure').setLevel(logging.INFO)
+
 ########################
-# PARSE ARGUMENTS
+# SHARED OPTIONS
 ########################
 
-parser = argparse.ArgumentParser(
-    prog="python3 -m hic2structure",
-    description="hic2structure: Uses LAMMPS to generate structures from Hi-C data."
-)
-parser.add_argument(
-    "--resolution", 
-    type=int, default=200000, metavar="NUM", dest="resolution",
-    help="Bin resolution. (Defaults to 200000)"
-)
-parser.add_argument(
-    "--count-threshold",
-    type=float, default=2.0, metavar="NUM", dest="count",
-    help="Threshold for reading contacts from Hi-C file. "\
-        "Records with a count lower than this are exluced. (Defaults to 2.0)"
-)
-parser.add_argument(
-    "-o", "--output",
-    type=str, default="./out", metavar="PATH", dest="output",
-    help="Output directory. (Defaults to './out')"
-)
-parser.add_argument(
-    "--lammps",
-    type=str, default="lmp", metavar="NAME", dest="lammps",
-    help="Name of LAMMPS executable to use. (Defaults to 'lmp')"
-)
-parser.add_argument(
-    "--chromosome",
-    type=str, default="X", metavar="NAME", dest="chromosome",
-    help="Chromosome to use. (Defaults to 'X')"
-)
-parser.add_argument(
-    "--bond-coeff",
-    type=int, default=55, metavar="NUM", dest="bond_coeff",
-    help="FENE bond coefficient. This affects the maximum allowed length of"\
-        " bonds in the LAMMPS simulation. If LAMMPS gives errors about bad"\
-        " bad FENE bonds, try increasing this value. (Defaults to 55)"
-)
-parser.add_argument(
-    "--timesteps",
-    type=int, default=1000000, metavar="NUM", dest="timesteps",
-    help="Number of timesteps to run in LAMMPS"
-)
-parser.add_argument(
-    "-v", "--verbose",
-    help="Enable verbose output",
-    action="store_true", default=False
-)
+def _sweepable(axes: bool, default, help: str, default_text: str=None) -> dict:
+    '''
+    Keyword arguments for an option that a sweep can vary. With 'axes', the
+    option takes several values (and gives a list).
+    '''
+    default_text = f"(Defaults to {default_text or default})"
+    if axes:
+        return {
+            'nargs': '+', 'default': [default],
+            'help': f"{help}. Give several values to sweep over them. {default_text}"
+        }
+    return { 'default': default, 'help': f"{help}. {default_text}" }
 
-parser.add_argument(
-    "file",
-    help="Input .hic file", type=str
-)
+def contact_options(axes: bool=False) -> argparse.ArgumentParser:
+    '''
+    Parent parser with the options for reading and selecting contact
+    records, shared by the main command, sweep and batch. With 'axes', the
+    options a sweep can vary take several values.
+    '''
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--resolution",
+        type=int, default=200000, metavar="NUM", dest="resolution",
+        help="Bin resolution. (Defaults to 200000)"
+    )
+    parser.add_argument(
+        "--count-threshold",
+        type=float, metavar="NUM", dest="count",
+        **_sweepable(axes, 2.0,
+            "Threshold for reading contacts from Hi-C file. Records with a"\
+            " count lower than this are excluded")
+    )
+    parser.add_argument(
+        "--normalization",
+        type=str, choices=NORMALIZATIONS, dest="normalization",
+        **_sweepable(axes, "KR",
+            "Normalization of the contact counts. Not every file has every"\
+            " normalization for every chromosome", "'KR'")
+    )
+    parser.add_argument(
+        "--matrix-type",
+        type=str, default="observed", choices=MATRIX_TYPES, dest="matrix_type",
+        help="Type of values to read: observed counts, observed over expected"\
+            " ('oe') or expected counts. The count threshold applies to these"\
+            " values. (Defaults to 'observed')"
+    )
+    parser.add_argument(
+        "--min-separation",
+        type=int, default=None, metavar="NUM", dest="min_separation",
+        help="Drop contacts between beads fewer than this many beads apart"
+    )
+    parser.add_argument(
+        "--stratum-quantile",
+        type=float, default=None, metavar="Q", dest="stratum_quantile",
+        help="Keep only contacts at or above this quantile of the counts at"\
+            " their genomic separation, e.g. 0.9 keeps the strongest 10%% of"\
+            " each diagonal"
+    )
+    parser.add_argument(
+        "--max-degree",
+        type=int, default=None, metavar="NUM", dest="max_degree",
+        help="Keep at most this many contacts (the strongest) for each bead"
+    )
+    parser.add_argument(
+        "--max-contacts",
+        type=int, default=None, metavar="NUM", dest="max_contacts",
+        help="Keep at most this many contacts (the strongest) in total. This"\
+            " bounds the number of bonds, and so the cost of the simulation"
+    )
+    return parser
+
+def simulation_options(axes: bool=False) -> argparse.ArgumentParser:
+    '''
+    Parent parser with the settings of the simulation itself, shared by
+    the main command, sweep and batch. With 'axes', the options a sweep
+    can vary take several values.
+    '''
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--bond-coeff",
+        type=int, metavar="NUM", dest="bond_coeff",
+        **_sweepable(axes, 55,
+            "FENE bond coefficient. This affects the maximum allowed length of"\
+            " bonds in the LAMMPS simulation. If LAMMPS gives errors about"\
+            " bad FENE bonds, try increasing this value")
+    )
+    parser.add_argument(
+        "--bond-bins",
+        type=int, metavar="NUM", dest="bond_bins",
+        **_sweepable(axes, 0,
+            "Weight contact bonds by their counts: contacts are binned into"\
+            " this many bond types, with stiffer bonds for higher counts. This"\
+            " keeps some signal from weak contacts, so lower count thresholds"\
+            " become useful", "0, giving every contact the same bond")
+    )
+    parser.add_argument(
+        "--bond-mapping",
+        type=str, default="log", choices=BOND_MAPPINGS, dest="bond_mapping",
+        help="How counts are binned with --bond-bins: equal widths in log"\
+            " count or count, or equal numbers of contacts. (Defaults to 'log')"
+    )
+    parser.add_argument(
+        "--timesteps",
+        type=int, metavar="NUM", dest="timesteps",
+        **_sweepable(axes, 1000000, "Number of timesteps to run in LAMMPS")
+    )
+    return parser
 
-args = parser.parse_args()
-verbose = args.verbose
-outdir  = Path(args.output)
-settings = settings_from_args(args)
+def lammps_options() -> argparse.ArgumentParser:
+    '''
+    Parent parser with the options for running LAMMPS, shared by every
+    command that runs simulations
+    '''
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--lammps",
+        type=str, default="lmp", metavar="NAME", dest="lammps",
+        help="Name of LAMMPS executable to use. (Defaults to 'lmp')"
+    )
+    parser.add_argument(
+        "--fene-retries",
+        type=int, default=3, metavar="NUM", dest="fene_retries",
+        help="If LAMMPS fails because of bad FENE bonds, increase the bond"\
+            " coefficient and retry, up to this many times. This also raises the"\
+            " bond coefficient beforehand if the initial conformation needs it."\
+            " Set to 0 to disable. (Defaults to 3)"
+    )
+    return parser
+
+def mpi_options(procs: bool=True) -> argparse.ArgumentParser:
+    '''
+    Parent parser with the options for running LAMMPS with MPI (see
+    lammps_command). Without 'procs', the number of processes is left to
+    another option.
+    '''
+    parser = argparse.ArgumentParser(add_help=False)
+    if procs:
+        parser.add_argument(
+            "--mpi-procs",
+            type=int, default=None, metavar="NUM", dest="mpi_procs",
+            help="Run LAMMPS on this many MPI processes, for large systems. This"\
+                " needs a LAMMPS built with MPI. (Defaults to running LAMMPS directly)"
+        )
+    parser.add_argument(
+        "--mpi-exec",
+        type=str, default="mpirun", metavar="NAME", dest="mpi_exec",
+        help="MPI launcher to run LAMMPS with on several processes. (Defaults to 'mpirun')"
+    )
+    return parser
+
+########################
+# SUBCOMMANDS
+########################
+
+def sweep_command(argv: list) -> int:
+    '''
+    Run a parameter sweep (python3 -m hic2structure sweep ...)
+    '''
+    global verbose
+
+    sweep_parser = argparse.ArgumentParser(
+        prog="python3 -m hic2structure sweep",
+        parents=[ contact_options(axes=True), simulation_options(axes=True), lammps_options() ],
+        description="Run a simulation for every combination of the given"\
+            " count thresholds, bond coefficients and timesteps, and write"\
+            " a table of results with timings and comparison scores."
+    )
+    sweep_parser.add_argument(
+        "--chromosome",
+        type=str, default="X", metavar="NAME", dest="chromosome",
+        help="Chromosome to use. (Defaults to 'X')"
+    )
+    sweep_parser.add_argument(
+        "--distance-threshold",
+        type=float, default=3.3, metavar="NUM", dest="distance",
+        help="Distance below which beads in the simulated structure count as"\
+            " contacts, when scoring against the Hi-C file. (Defaults to 3.3)"
+    )
+    sweep_parser.add_argument(
+        "--seed",
+        type=int, default=None, metavar="NUM", dest="seed",
+        help="Seed for the initial conformation and LAMMPS, shared by every"\
+            " simulation. (Defaults to a random seed, which is recorded in"\
+            " the results)"
+    )
+    sweep_parser.add_argument(
+        "-j", "--workers",
+        type=int, default=1, metavar="NUM", dest="workers",
+        help="Number of simulations to run at once. (Defaults to 1)"
+    )
+    sweep_parser.add_argument(
+        "-o", "--output",
+        type=str, default="./sweep", metavar="PATH", dest="output",
+        help="Output directory. (Defaults to './sweep')"
+    )
+    sweep_parser.add_argument(
+        "-v", "--verbose",
+        help="Enable verbose output",
+        action="store_true", default=False
+    )
+    sweep_parser.add_argument(
+        "file",
+        help="Input .hic file", type=str
+    )
+
+    args = sweep_parser.parse_args(argv)
+    verbose = args.verbose
+
+    from .hic import HIC, HICError
+    from .sweep import settings_grid, run_sweep, write_sweep_results
+
+    outdir = Path(args.output)
+
+    base: 'Settings' = {
+        'chromosome': args.chromosome,
+        'resolution': args.resolution,
+        'count_threshold': args.count[0],
+        'normalization': args.normalization[0],
+        'matrix_type': args.matrix_type,
+        'min_separation': args.min_separation,
+        'stratum_quantile': args.stratum_quantile,
+        'max_degree': args.max_degree,
+        'max_contacts': args.max_contacts,
+        'distance_threshold': args.distance,
+        'bond_coeff': args.bond_coeff[0],
+        'timesteps': args.timesteps[0],
+        'seed': args.seed if args.seed is not None else new_seed(),
+        'bond_bins': args.bond_bins[0],
+        'bond_mapping': args.bond_mapping
+    }
+    grid = settings_grid(
+        base,
+        normalization=args.normalization,
+        count_threshold=args.count,
+        bond_coeff=args.bond_coeff,
+        bond_bins=args.bond_bins,
+        timesteps=args.timesteps
+    )
+
+    def report(result):
+        if result['status'] == 'ok':
+            log_info(
+                f"Point {result['point']} finished in {result['wall_time']:.1f}s"
+                f" (F1: {result['f1']:.3f}, SCC: {result['scc']:.3f})"
+            )
+        else:
+            log_info(f"Point {result['point']} failed: {result['error']}")
+
+    try:
+        hic = HIC( Path(args.file) )
+        log_info(f"Running \033[1m{len(grid)}\033[0m simulations...")
+        results = run_sweep(
+            hic, grid, outdir, args.lammps, args.workers, report,
+            fene_retries=args.fene_retries
+        )
+    except HICError as e:
+        log_error(f"Error reading contact records: {e}")
+        return 1
+
+    results_path = outdir/'sweep.csv'
+    write_sweep_results(results_path, results)
+    log_info(f"Saved sweep results to \033[1m{results_path}\033[0m.")
+
+    failed = sum( r['status'] != 'ok' for r in results )
+    if failed:
+        log_error(f"{failed} of {len(results)} simulations failed")
+        return 1
+    return 0
+
+def format_metadata(path: str, metadata: dict) -> str:
+    '''
+    Format the metadata of a Hi-C file (from HICMetadata.to_dict) as a
+    human-readable table
+    '''
+    lines = [
+        f"{path}",
+        f"  genome:      {metadata['genome']}",
+        f"  version:     {metadata['version']}",
+        f"  resolutions: {', '.join(str(r) for r in metadata['resolutions'])}",
+    ]
+    if metadata['fragment_resolutions']:
+        lines.append(
+            f"  fragment resolutions: "
+            f"{', '.join(str(r) for r in metadata['fragment_resolutions'])}"
+        )
+
+    width = max( [10] + [ len(name) for name in metadata['chromosomes'] ] )
+    lines.append(f"  {'chromosome':<{width}}  {'length':>12}")
+    for (name, length) in metadata['chromosomes'].items():
+        lines.append(f"  {name:<{width}}  {length:>12}")
+
+    if metadata['attributes']:
+        lines.append("  attributes:")
+        for (key, value) in metadata['attributes'].items():
+            # Some attributes (like 'statistics') are long, multi-line blocks
+            value = ' '.join(value.split())
+            if len(value) > 60:
+                value = value[:57] + '...'
+            lines.append(f"    {key}: {value}")
+
+    return '\n'.join(lines)
+
+def inspect_command(argv: list) -> int:
+    '''
+    Print the metadata of Hi-C files (python3 -m hic2structure inspect ...)
+    '''
+    global verbose
+
+    inspect_parser = argparse.ArgumentParser(
+        prog="python3 -m hic2structure inspect",
+        description="Print the chromosomes, resolutions, genome and attributes"\
+            " of Hi-C files. Only the header of each file is read, so this"\
+            " is fast even for large files."
+    )
+    inspect_parser.add_argument(
+        "--json",
+        action="store_true", default=False, dest="json",
+        help="Print the metadata as JSON (a list with an object for each file)"
+    )
+    inspect_parser.add_argument(
+        "-j", "--workers",
+        type=int, default=8, metavar="NUM", dest="workers",
+        help="Number of files to read at once. (Defaults to 8)"
+    )
+    inspect_parser.add_argument(
+        "-v", "--verbose",
+        help="Enable verbose output",
+        action="store_true", default=False
+    )
+    inspect_parser.add_argument(
+        "files",
+        help="Input .hic files", type=str, nargs="+"
+    )
+
+    args = inspect_parser.parse_args(argv)
+    verbose = args.verbose
+
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from .hic import HICError, read_metadata
+
+    def inspect(path):
+        try:
+            return { 'path': path, **read_metadata( Path(path) ).to_dict() }
+        except (OSError, HICError) as e:
+            return { 'path': path, 'error': str(e) }
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        results = list( pool.map(inspect, args.files) )
+
+    if args.json:
+        print( json.dumps(results, indent=4) )
+    else:
+        for result in results:
+            if 'error' not in result:
+                print( format_metadata(result['path'], result) )
+
+    # (With --json, errors are included in the output instead)
+    failed = [ r for r in results if 'error' in r ]
+    if not args.json:
+        for result in failed:
+            log_error(f"{result['path']}: {result['error']}")
+    return 1 if failed else 0
+
+def batch_command(argv: list) -> int:
+    '''
+    Run a batch of simulations from a manifest (python3 -m hic2structure batch ...)
+    '''
+    global verbose
+    import os
+
+    batch_parser = argparse.ArgumentParser(
+        prog="python3 -m hic2structure batch",
+        parents=[ contact_options(), simulation_options(), lammps_options(), mpi_options(procs=False) ],
+        description="Run a simulation for every row of a manifest (a CSV or"\
+            " JSON file with 'file' and 'chromosome' columns, and optionally"\
+            " 'resolution', 'count_threshold', 'normalization', 'matrix_type',"\
+            " 'min_separation', 'stratum_quantile', 'max_degree', 'max_contacts',"\
+            " 'bond_coeff', 'bond_bins', 'bond_mapping', 'timesteps', 'seed'"\
+            " and 'replicas'), which the options give defaults for. The status"\
+            " of each job is recorded in 'batch.db' in the output directory, and"\
+            " running the same batch again only runs the jobs that haven't finished."
+    )
+    batch_parser.add_argument(
+        "--replicas",
+        type=int, default=1, metavar="NUM", dest="replicas",
+        help="Default number of replicas (simulations with different seeds)"\
+            " for each row. (Defaults to 1)"
+    )
+    batch_parser.add_argument(
+        "--cores",
+        type=int, default=os.cpu_count() or 1, metavar="NUM", dest="cores",
+        help="Number of CPU cores to use. (Defaults to all of them)"
+    )
+    batch_parser.add_argument(
+        "--cores-per-job",
+        type=int, default=1, metavar="NUM", dest="cores_per_job",
+        help="Number of CPU cores each simulation uses. Above 1, LAMMPS is run"\
+            " on this many MPI processes (with --mpi-exec), which needs a LAMMPS"\
+            " built with MPI. (Defaults to 1)"
+    )
+    batch_parser.add_argument(
+        "--retry-failed",
+        action="store_true", default=False, dest="retry_failed",
+        help="Also rerun jobs that failed in an earlier run of the batch"
+    )
+    batch_parser.add_argument(
+        "-o", "--output",
+        type=str, default="./batch", metavar="PATH", dest="output",
+        help="Output directory. (Defaults to './batch')"
+    )
+    batch_parser.add_argument(
+        "-v", "--verbose",
+        help="Enable verbose output",
+        action="store_true", default=False
+    )
+    batch_parser.add_argument(
+        "manifest",
+        help="Manifest file (.csv or .json)", type=str
+    )
+
+    args = batch_parser.parse_args(argv)
+    verbose = args.verbose
+    outdir = Path(args.output)
+
+    from .batch import BatchError, BatchDatabase, read_manifest, expand_jobs, run_batch
+
+    defaults: 'Settings' = {
+        'chromosome': '',
+        'resolution': args.resolution,
+        'count_threshold': args.count,
+        'normalization': args.normalization,
+        'matrix_type': args.matrix_type,
+        'min_separation': args.min_separation,
+        'stratum_quantile': args.stratum_quantile,
+        'max_degree': args.max_degree,
+        'max_contacts': args.max_contacts,
+        'distance_threshold': 0, # Unused
+        'bond_coeff': args.bond_coeff,
+        'timesteps': args.timesteps,
+        'seed': None,
+        'bond_bins': args.bond_bins,
+        'bond_mapping': args.bond_mapping
+    }
+    try:
+        jobs = expand_jobs( read_manifest(Path(args.manifest), defaults, args.replicas) )
+    except (OSError, ValueError, BatchError) as e:
+        log_error(f"Error reading manifest: {e}")
+        return 1
+
+    def report(result):
+        if result['status'] == 'done':
+            log_info(f"Job {result['id']} finished in {result['wall_time']:.1f}s")
+        else:
+            log_info(f"Job {result['id']} failed: {result['error']}")
+
+    try:
+        run_batch(
+            jobs, outdir, args.lammps,
+            cores=args.cores, cores_per_job=args.cores_per_job,
+            retry_failed=args.retry_failed, callback=report,
+            fene_retries=args.fene_retries, mpi_exec=args.mpi_exec
+        )
+    except KeyboardInterrupt:
+        log_error("Interrupted. Run the same command again to resume the batch.")
+        return 130
+
+    db = BatchDatabase(outdir/'batch.db')
+    counts = db.counts()
+    db.close()
+    log_info(
+        "Batch status: " + ', '.join( f"{n} {status}" for (status, n) in sorted(counts.items()) )
+    )
+
+    failed = counts.get('failed', 0)
+    if failed:
+        log_error(f"{failed} jobs failed (see {outdir/'batch.db'}). Use --retry-failed to rerun them.")
+        return 1
+    return 0
+
+def serve_command(argv: list) -> int:
+    '''
+    Serve structures over HTTP (python3 -m hic2structure serve ...)
+    '''
+    global verbose
+
+    serve_parser = argparse.ArgumentParser(
+        prog="python3 -m hic2structure serve",
+        parents=[ lammps_options() ],
+        description="Run a local HTTP service that serves contact records and"\
+            " simulated structures for the Hi-C files in a directory, keeping"\
+            " opened files, records and structures cached in memory. See the"\
+            " hic2structure.service module for the endpoints."
+    )
+    serve_parser.add_argument(
+        "--host",
+        type=str, default="127.0.0.1", metavar="HOST", dest="host",
+        help="Address to listen on. (Defaults to 127.0.0.1)"
+    )
+    serve_parser.add_argument(
+        "--port",
+        type=int, default=8000, metavar="NUM", dest="port",
+        help="Port to listen on. (Defaults to 8000)"
+    )
+    serve_parser.add_argument(
+        "-j", "--workers",
+        type=int, default=1, metavar="NUM", dest="workers",
+        help="Number of simulations to run at once. (Defaults to 1)"
+    )
+    serve_parser.add_argument(
+        "--max-queue",
+        type=int, default=64, metavar="NUM", dest="max_queue",
+        help="Maximum number of simulations waiting to run. Requests beyond"\
+            " this are turned away. (Defaults to 64)"
+    )
+    serve_parser.add_argument(
+        "--seed",
+        type=int, default=0, metavar="NUM", dest="seed",
+        help="Seed for requests that don't give one. (Defaults to 0)"
+    )
+    serve_parser.add_argument(
+        "--cache",
+        type=str, default=None, metavar="PATH", dest="cache",
+        help="Directory for caching structures on disk, as well as in memory"
+    )
+    serve_parser.add_argument(
+        "--cache-size",
+        type=int, default=1024, metavar="MB", dest="cache_size",
+        help="Maximum size of the cache directory, in megabytes. (Defaults to 1024)"
+    )
+    serve_parser.add_argument(
+        "-v", "--verbose",
+        help="Enable verbose output",
+        action="store_true", default=False
+    )
+    serve_parser.add_argument(
+        "data_dir",
+        help="Directory of .hic files to serve", type=str
+    )
+
+    args = serve_parser.parse_args(argv)
+    verbose = args.verbose
+
+    from .service import run_service
+    result_cache = None
+    if args.cache is not None:
+        from .cache import ResultCache
+        result_cache = ResultCache( Path(args.cache), args.cache_size * 1024 * 1024 )
+
+    try:
+        run_service(
+            Path(args.data_dir), args.host, args.port,
+            lammps_exec=args.lammps, workers=args.workers, max_queue=args.max_queue,
+            default_seed=args.seed, result_cache=result_cache,
+            fene_retries=args.fene_retries
+        )
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        log_error(f"Couldn't start the service: {e}")
+        return 1
+    return 0
+
+commands = {
+    'sweep': sweep_command,
+    'inspect': inspect_command,
+    'batch': batch_command,
+    'serve': serve_command
+}
+
+########################
+# PARSE ARGUMENTS
+########################
+
+def build_parser() -> argparse.ArgumentParser:
+    '''
+    Create the argument parser for the main command
+    '''
+    parser = argparse.ArgumentParser(
+        prog="python3 -m hic2structure",
+        parents=[ contact_options(), simulation_options(), lammps_options(), mpi_options() ],
+        description="hic2structure: Uses LAMMPS to generate structures from Hi-C data.",
+        epilog="Other commands: 'python3 -m hic2structure sweep --help',"\
+        " 'python3 -m hic2structure batch --help',"\
+        " 'python3 -m hic2structure inspect --help',"\
+        " 'python3 -m hic2structure serve --help'"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        type=str, default="./out", metavar="PATH", dest="output",
+        help="Output directory. (Defaults to './out')"
+    )
+    parser.add_argument(
+        "--chromosome",
+        type=str, default="X", metavar="NAME", dest="chromosome",
+        help="Chromosome to use. (Defaults to 'X')"
+    )
+    parser.add_argument(
+        "--chromosomes",
+        type=str, nargs="+", default=None, metavar="NAME", dest="chromosomes",
+        help="Simulate several chromosomes (e.g. a whole genome) together"\
+            " instead of --chromosome, with a chain for each and the contacts"\
+            " between them as well as within them. Only observed records can"\
+            " be read between chromosomes. The initial conformation is always"\
+            " relaxed first (as with --pre-relax)"
+    )
+    parser.add_argument(
+        "--pre-relax",
+        action="store_true", default=False, dest="pre_relax",
+        help="Relax the initial conformation with an energy minimization"\
+            " before running the simulation"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int, default=None, metavar="NUM", dest="seed",
+        help="Seed for the initial conformation and LAMMPS. Runs with the same"\
+            " seed and settings give the same structure. (Defaults to a random"\
+            " seed, which is recorded in 'settings.json' in the output directory)"
+    )
+    parser.add_argument(
+        "--warm-start",
+        type=str, default=None, metavar="PATH", dest="warm_start",
+        help="Output directory of a previous run on the same Hi-C file. Its"\
+            " final structure is relaxed with the new contacts, for a number"\
+            " of timesteps based on how many contacts changed, instead of"\
+            " running a full simulation from a random walk"
+    )
+    parser.add_argument(
+        "--relax-timesteps",
+        type=int, default=None, metavar="NUM", dest="relax_timesteps",
+        help="Number of timesteps to relax for with --warm-start, instead"\
+            " of choosing one from the number of changed contacts"
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str, default="csv", choices=list(STRUCTURE_FORMATS.keys()), dest="output_format",
+        help="Format of the output structure file. (Defaults to 'csv')"
+    )
+    parser.add_argument(
+        "--output-compression",
+        type=str, default="none", choices=list(TEXT_COMPRESSIONS.keys()), dest="output_compression",
+        help="Compress a csv output structure file ('structure.csv.gz' or"\
+            " 'structure.csv.zst'). zstd needs the 'zstandard' package."\
+            " (Defaults to 'none')"
+    )
+    parser.add_argument(
+        "--save-trajectory",
+        action="store_true", default=False, dest="save_trajectory",
+        help="Save every timestep of the simulation to a compressed trajectory"\
+            " file ('trajectory.h2t') in the output directory"
+    )
+    parser.add_argument(
+        "--trajectory-precision",
+        type=str, default="float32", choices=PRECISIONS, dest="trajectory_precision",
+        help="Precision of coordinates in the trajectory file. 'int16' quantizes"\
+            " coordinates for a much smaller file. (Defaults to 'float32')"
+    )
+    parser.add_argument(
+        "--trajectory-delta",
+        action="store_true", default=False, dest="trajectory_delta",
+        help="Store trajectory frames as differences from the previous frame"
+    )
+    parser.add_argument(
+        "--cache",
+        type=str, default=None, metavar="PATH", dest="cache",
+        help="Directory for caching simulation results. If the same simulation"\
+            " has been run before, its result is reused instead of running LAMMPS"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int, default=1024, metavar="MB", dest="cache_size",
+        help="Maximum size of the cache directory, in megabytes. The least"\
+            " recently used results are removed first. (Defaults to 1024)"
+    )
+    parser.add_argument(
+        "--stage-table",
+        action="store_true", default=False, dest="stage_table",
+        help="Print the time, memory and I/O used by each stage to stderr as"\
+            " it finishes. (These are always saved to 'metrics.json' in the"\
+            " output directory)"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true", default=False, dest="profile",
+        help="Profile each stage with cProfile and tracemalloc, saving the"\
+            " results to a 'profile' directory in the output directory. This"\
+            " slows the run down considerably"
+    )
+    parser.add_argument(
+        "-v", "--verbose",
+        help="Enable verbose output",
+        action="store_true", default=False
+    )
+
+    parser.add_argument(
+        "file",
+        help="Input .hic file", type=str
+    )
+    return parser
 
 ########################
 # MAIN
 ########################
 
-try:
-    hic = HIC( Path(args.file) )
-    inputs = contact_records_to_set( hic.get_contact_records(settings) )
-    log_info(f"Loaded \033[1m{len(inputs)}\033[0m contact records from Hi-C file.")
-except HICError as e:
-    log_error(f"Error reading contact records: {e}")
-    exit(1)
-
-outdir.mkdir(parents=True, exist_ok=True)
-
-try:
-    log_info(f"Running LAMMPS (this might take a while)...")
-    lammps_data = run_lammps(inputs, settings, args.lammps, copy_log_to=outdir/'sim.log')
-    log_info(f"LAMMPS finished.")
-except LAMMPSError as e:
-    log_error(e)
-    exit(1)
-
-last_timestep = lammps_data[ sorted(lammps_data.keys())[-1] ]
-
-structure_path = outdir/'structure.csv'
-write_structure( structure_path, last_timestep )
-log_info(f"Saved structure data to \033[1m{structure_path}\033[0m.")
+def run(args: argparse.Namespace, metrics: MetricsCollector) -> int:
+    '''
+    Run a simulation with the parsed arguments of the main command,
+    recording stage metrics with 'metrics'. Returns the exit status.
+    '''
+    global verbose
+    from .hic import HIC, HICError
+    from .lammps import LAMMPSError, run_lammps
+    from .contactmap import ContactMap
+    from .out import write_structure, write_settings
+
+    verbose = args.verbose
+    outdir  = Path(args.output)
+    settings = settings_from_args(args)
+    if settings['seed'] is None:
+        settings['seed'] = new_seed()
+
+    def save_metrics():
+        outdir.mkdir(parents=True, exist_ok=True)
+        metrics.write( outdir/'metrics.json', argv=args.argv, settings=settings )
+
+    if args.output_compression != 'none' and args.output_format != 'csv':
+        log_error("--output-compression can only be used with the 'csv' output format")
+        return 1
+    if args.chromosomes is not None and args.warm_start is not None:
+        log_error("--warm-start can't be used with --chromosomes")
+        return 1
+
+    lengths = None
+    try:
+        hic = HIC( Path(args.file) )
+        if args.chromosomes is not None:
+            (records, settings['chromosomes'], lengths) = hic.get_genome_contact_records(settings)
+            inputs = ContactMap.from_records(records)
+            log_info(
+                f"Loaded \033[1m{len(inputs)}\033[0m contact records for"
+                f" {len(lengths)} chromosomes ({sum(lengths)} beads) from Hi-C file."
+            )
+        else:
+            inputs = ContactMap.from_records( hic.get_contact_records(settings) )
+            log_info(f"Loaded \033[1m{len(inputs)}\033[0m contact records from Hi-C file.")
+    except HICError as e:
+        log_error(f"Error reading contact records: {e}")
+        return 1
+
+    lammps_options = {
+        'trajectory_to': (outdir/'trajectory.h2t') if args.save_trajectory else None,
+        'trajectory_options': {
+            'precision': args.trajectory_precision,
+            'delta': args.trajectory_delta
+        },
+        'fene_retries': args.fene_retries,
+        # Chains in a multi-chain initial conformation can overlap once
+        # they're wrapped into the box, so it's always relaxed first
+        'pre_relax': args.pre_relax or lengths is not None,
+        'lengths': lengths,
+        'mpi_procs': args.mpi_procs,
+        'mpi_exec': args.mpi_exec
+    }
+
+    if args.warm_start is not None:
+        try:
+            (inputs, settings, warm_options) = warm_start_inputs(
+                hic, Path(args.warm_start), inputs, settings, args.relax_timesteps
+            )
+        except (OSError, ValueError, HICError) as e:
+            log_error(f"Error reading the previous run for --warm-start: {e}")
+            return 1
+        lammps_options['initial_coords'] = warm_options['initial_coords']
+        lammps_options['pre_relax'] = args.pre_relax or warm_options['pre_relax']
+
+    outdir.mkdir(parents=True, exist_ok=True)
+    write_settings(outdir/'settings.json', settings)
+
+    try:
+        if args.cache is not None:
+            from .cache import ResultCache, run_lammps_cached
+            cache = ResultCache( Path(args.cache), args.cache_size * 1024 * 1024 )
+            log_info(f"Running LAMMPS (or using a cached result)...")
+            (lammps_data, hit) = run_lammps_cached(
+                cache, inputs, settings, args.lammps,
+                copy_log_to=outdir/'sim.log', **lammps_options
+            )
+            log_info("Cache hit: reused a previous result." if hit else "LAMMPS finished.")
+        else:
+            log_info(f"Running LAMMPS (this might take a while)...")
+            lammps_data = run_lammps(
+                inputs, settings, args.lammps,
+                copy_log_to=outdir/'sim.log', **lammps_options
+            )
+            log_info(f"LAMMPS finished.")
+    except LAMMPSError as e:
+        log_error(e)
+        save_metrics()
+        return 1
+
+    last_timestep = lammps_data[ sorted(lammps_data.keys())[-1] ]
+
+    structure_path = outdir/(
+        f'structure{STRUCTURE_FORMATS[args.output_format]}'
+        f'{TEXT_COMPRESSIONS[args.output_compression]}'
+    )
+    try:
+        write_structure( structure_path, last_timestep, args.output_format, args.output_compression )
+    except ValueError as e:
+        log_error(f"Error writing structure: {e}")
+        save_metrics()
+        return 1
+    log_info(f"Saved structure data to \033[1m{structure_path}\033[0m.")
+
+    save_metrics()
+    log_info(f"Saved stage metrics to \033[1m{outdir/'metrics.json'}\033[0m.")
+    if args.profile:
+        log_info(f"Saved profiles to \033[1m{outdir/'profile'}\033[0m.")
+    return 0
+
+def main(argv: T.List[str]=None) -> int:
+    '''
+    Run the command-line interface with the given arguments (defaulting
+    to sys.argv). Returns the exit status.
+    '''
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) > 0 and argv[0] in commands:
+        return commands[argv[0]](argv[1:])
+
+    args = build_parser().parse_args(argv)
+    args.argv = list(argv)
+
+    with ExitStack() as stack:
+        metrics = stack.enter_context( collecting(MetricsCollector()) )
+        if args.stage_table:
+            stack.enter_context( collecting(StageTable()) )
+        if args.profile:
+            from .profiling import Profiler
+            stack.enter_context( collecting(Profiler(Path(args.output)/'profile')) )
+
+        return run(args, metrics)
+
+if __name__ == '__main__':
+    sys.exit( main() )
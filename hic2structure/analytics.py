@@ -0,0 +1,221 @@
+"""
+Module for analysing simulated structures.
+
+StructureAnalytics computes statistics over the frames of a simulation one
+frame at a time, so a trajectory never needs to be read into memory and no
+distance matrices are built:
+
+    analytics = StructureAnalytics()
+    for (timestep, data) in iter_frames( Path('out/lammps/out.dump') ):
+        analytics.add(data, timestep)
+    stats = analytics.results()
+
+The statistics are:
+    radius_of_gyration  Per frame, of the whole structure
+    end_to_end          Per frame and chain, the distance between the chain's
+                        first and last beads
+    mean_distance       Mean spatial distance between beads of the same chain
+                        at each genomic separation (in beads) in
+                        'separations', over all frames
+    msd                 Per bead, the mean squared displacement from the
+                        first frame, over the later frames
+
+The beads form a single chain, unless the chain lengths are given (as for a
+whole-genome simulation, see lammps.write_input_deck). Coordinates are
+unwrapped (see lammps.unwrap_coordinates) before anything is measured.
+"""
+
+import typing as T
+from pathlib import Path
+
+import numpy as np
+
+from .types import LAMMPSTimestep, StructureStatistics
+from .lammps import iter_frames, unwrap_coordinates
+
+class AnalyticsError(Exception):
+    pass
+
+#
+# Default number of separations sampled per decade (separations are spaced
+# logarithmically, since P(s) is usually looked at on a log-log plot)
+#
+SEPARATIONS_PER_DECADE = 10
+
+#
+# Default target number of bead pairs sampled at each separation, per frame.
+# Beads are strided so that long chains don't need every pair measured.
+#
+SAMPLES_PER_SEPARATION = 10000
+
+########################
+# SINGLE STRUCTURES
+########################
+
+def radius_of_gyration(coords: np.ndarray) -> float:
+    """
+    The radius of gyration of an (n, 3) array of (unwrapped) coordinates
+    """
+    centered = coords - coords.mean(axis=0)
+    return float( np.sqrt( np.einsum('ij,ij->', centered, centered) / len(coords) ) )
+
+def chain_bounds(num_beads: int, lengths: T.Sequence[int]=None) -> np.ndarray:
+    """
+    The (start, end) bead indices (from 0, end exclusive) of each chain,
+    for chains of the given lengths (or a single chain of all the beads)
+    """
+    if lengths is None:
+        lengths = [num_beads]
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if np.any(lengths < 1) or lengths.sum() != num_beads:
+        raise AnalyticsError(
+            f"Chain lengths must be positive and add up to the {num_beads} beads"
+        )
+    ends = np.cumsum(lengths)
+    return np.column_stack( (ends - lengths, ends) )
+
+def end_to_end_distance(coords: np.ndarray, lengths: T.Sequence[int]=None) -> np.ndarray:
+    """
+    The distance between the first and last beads of each chain, for an
+    (n, 3) array of (unwrapped) coordinates in chains of the given lengths
+    (or a single chain)
+    """
+    bounds = chain_bounds(len(coords), lengths)
+    return np.linalg.norm( coords[bounds[:,1] - 1] - coords[bounds[:,0]], axis=1 )
+
+def log_separations(num_beads: int, per_decade: int=SEPARATIONS_PER_DECADE) -> np.ndarray:
+    """
+    Logarithmically spaced genomic separations (in beads) from 1 to
+    num_beads - 1, with about 'per_decade' per factor of ten
+    """
+    if num_beads < 2:
+        return np.zeros(0, dtype=np.int64)
+    decades = np.log10(num_beads - 1)
+    count = max( 2, int(np.ceil(decades * per_decade)) + 1 )
+    return np.unique( np.geomspace(1, num_beads - 1, count).round().astype(np.int64) )
+
+########################
+# STREAMING
+########################
+
+class StructureAnalytics:
+    """
+    Accumulates statistics over the frames of a simulation, one frame at a
+    time (see the module docstring). Memory use is one frame plus O(beads)
+    accumulators.
+
+    'separations' are the genomic separations that mean distances are
+    measured at (log_separations for the longest chain, by default). Only
+    pairs of beads on the same chain are measured, and at each separation,
+    only every 'stride'-th pair of each chain, where 'stride' is chosen to
+    sample about 'samples' pairs per frame (all pairs if 'samples' is None).
+    'lengths' gives the length of each chain (see chain_bounds), and 'box'
+    is the simulation box, for unwrapping (see unwrap_coordinates).
+    """
+
+    def __init__(
+        self, separations: np.ndarray=None, samples: int=SAMPLES_PER_SEPARATION,
+        box: np.ndarray=None, lengths: T.Sequence[int]=None
+    ):
+        self.separations = None if separations is None else np.asarray(separations, dtype=np.int64)
+        self.samples = samples
+        self.box = box
+        self.lengths = None if lengths is None else [ int(l) for l in lengths ]
+
+        self.timesteps: T.List[int] = []
+        self.radius_of_gyration: T.List[float] = []
+        self.end_to_end: T.List[np.ndarray] = []
+
+        self._reference = None
+        self._bounds = None
+        self._distance_sums = None
+        self._distance_counts = None
+        self._msd_sums = None
+
+    @property
+    def frames(self) -> int:
+        return len(self.timesteps)
+
+    def _start(self, coords: np.ndarray):
+        num_beads = len(coords)
+        self._bounds = chain_bounds(num_beads, self.lengths)
+        longest = int( (self._bounds[:,1] - self._bounds[:,0]).max() )
+        if self.separations is None:
+            self.separations = log_separations(longest)
+        if np.any(self.separations < 1) or np.any(self.separations >= longest):
+            raise AnalyticsError(
+                f"Separations must be between 1 and {longest - 1} "
+                f"for a longest chain of {longest} beads"
+            )
+
+        self._reference = coords
+        self._distance_sums = np.zeros(len(self.separations))
+        self._distance_counts = np.zeros(len(self.separations), dtype=np.int64)
+        self._msd_sums = np.zeros(num_beads)
+
+    def _stride(self, pairs: int) -> int:
+        if self.samples is None:
+            return 1
+        return max( 1, pairs // self.samples )
+
+    def add(self, data: LAMMPSTimestep, timestep: int=None):
+        """
+        Add a frame (a LAMMPSTimestep or the result of read_structure).
+        Frames are assumed to be in order, and all have the same beads.
+        """
+        coords = unwrap_coordinates(data, self.box)
+        if self._reference is None:
+            self._start(coords)
+        elif len(coords) != len(self._reference):
+            raise AnalyticsError(
+                f"Frame has {len(coords)} beads, but the first frame had {len(self._reference)}"
+            )
+
+        self.timesteps.append( self.frames if timestep is None else timestep )
+        self.radius_of_gyration.append( radius_of_gyration(coords) )
+        self.end_to_end.append( end_to_end_distance(coords, self.lengths) )
+
+        lengths = self._bounds[:,1] - self._bounds[:,0]
+        for (i, s) in enumerate(self.separations):
+            stride = self._stride( int(np.maximum(lengths - s, 0).sum()) )
+            for (start, end) in self._bounds[lengths > s]:
+                steps = coords[start+s:end:stride] - coords[start:end-s:stride]
+                self._distance_sums[i] += np.sqrt( np.einsum('ij,ij->i', steps, steps) ).sum()
+                self._distance_counts[i] += len(steps)
+
+        displacement = coords - self._reference
+        self._msd_sums += np.einsum('ij,ij->i', displacement, displacement)
+
+    def add_all(self, frames: T.Iterable[T.Tuple[int, LAMMPSTimestep]]) -> 'StructureAnalytics':
+        """
+        Add every (timestep, data) pair from an iterable (e.g. iter_frames).
+        Returns this object.
+        """
+        for (timestep, data) in frames:
+            self.add(data, timestep)
+        return self
+
+    def results(self) -> StructureStatistics:
+        """
+        The statistics for the frames added so far
+        """
+        if self._reference is None:
+            raise AnalyticsError("No frames have been added")
+
+        return {
+            'timesteps': np.array(self.timesteps, dtype=np.int64),
+            'radius_of_gyration': np.array(self.radius_of_gyration),
+            'end_to_end': np.array(self.end_to_end).reshape( (self.frames, -1) ),
+            'separations': self.separations.copy(),
+            'mean_distance': self._distance_sums / np.maximum(self._distance_counts, 1),
+            # The first frame is the reference, so has no displacement
+            'msd': self._msd_sums / max(self.frames - 1, 1),
+        }
+
+def analyze_file(path: Path, **kwargs) -> StructureStatistics:
+    """
+    Compute statistics over every frame in a file (a LAMMPS dump, trajectory
+    file or structure file, see iter_frames). Keyword arguments (such as the
+    chain 'lengths') are passed to StructureAnalytics.
+    """
+    return StructureAnalytics(**kwargs).add_all( iter_frames(path) ).results()
@@ -0,0 +1,419 @@
+"""
+Module for running batches of simulations over many Hi-C files.
+
+A batch is described by a manifest: a CSV or JSON file with a row for each
+Hi-C file and chromosome to simulate (see read_manifest). Each row is
+expanded into one job per replica, and the jobs are run on a pool of
+workers sized to a budget of CPU cores.
+
+The status of every job is kept in an SQLite database in the output
+directory (see BatchDatabase). If a batch is interrupted, running it again
+with the same manifest and output directory skips the jobs that already
+finished.
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import typing as T
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+
+from .types import Settings, ContactRecords
+from .hic import HIC, HICError
+from .lammps import LAMMPSError, run_lammps, replica_seeds
+from .contactmap import ContactMap
+from .contacts import SELECTION_SETTINGS
+from .out import write_structure, write_settings
+
+log = logging.getLogger(__name__)
+
+#
+# Columns of a manifest. Only 'file' and 'chromosome' are required, the
+# others default to the values given to read_manifest. 'replicas' is the
+# number of independent simulations (with different seeds) to run.
+#
+MANIFEST_COLUMNS = {
+    'file': str,
+    'chromosome': str,
+    'resolution': int,
+    'count_threshold': float,
+    'normalization': str,
+    'matrix_type': str,
+    'min_separation': int,
+    'stratum_quantile': float,
+    'max_degree': int,
+    'max_contacts': int,
+    'bond_coeff': int,
+    'bond_bins': int,
+    'bond_mapping': str,
+    'timesteps': int,
+    'seed': int,
+    'replicas': int,
+}
+
+# Job statuses
+PENDING = 'pending'
+RUNNING = 'running'
+DONE    = 'done'
+FAILED  = 'failed'
+
+class BatchError(Exception):
+    pass
+
+class BatchJob(T.TypedDict):
+    '''
+    A single simulation in a batch
+    '''
+    id: str
+    file: str
+    replica: int
+    settings: Settings
+
+class BatchResult(T.TypedDict):
+    '''
+    The outcome of a job
+    '''
+    id: str
+    status: str # DONE or FAILED
+    error: str
+    wall_time: float
+
+########################
+# MANIFESTS
+########################
+
+def read_manifest(path: Path, defaults: Settings, replicas: int=1) -> T.List[T.Tuple[str, Settings, int]]:
+    """
+    Read a batch manifest (a .json file with a list of objects, or a .csv
+    file with a header row) with the columns in MANIFEST_COLUMNS. Missing
+    or empty values are taken from 'defaults' (and 'replicas').
+    Relative file paths are relative to the manifest.
+
+    Returns a (file, settings, replicas) tuple for each row.
+    """
+    path = Path(path)
+    if path.suffix == '.json':
+        with open(path, 'r') as f:
+            rows = json.load(f)
+        if not isinstance(rows, list):
+            raise BatchError(f"Manifest '{path}' must contain a list of objects")
+    else:
+        with open(path, 'r', newline='') as f:
+            rows = list( csv.DictReader(f) )
+
+    entries = []
+    for (number, row) in enumerate(rows, start=1):
+        unknown = set(row.keys()) - set(MANIFEST_COLUMNS.keys())
+        if unknown:
+            raise BatchError(f"Unknown columns in manifest '{path}': {sorted(unknown)}")
+
+        values = {}
+        for (name, kind) in MANIFEST_COLUMNS.items():
+            value = row.get(name)
+            if value is None or value == '':
+                continue
+            try:
+                values[name] = kind(value)
+            except ValueError:
+                raise BatchError(f"Row {number} of '{path}': invalid {name} '{value}'")
+
+        for name in [ 'file', 'chromosome' ]:
+            if name not in values:
+                raise BatchError(f"Row {number} of '{path}' has no {name}")
+
+        file = Path(values.pop('file'))
+        if not file.is_absolute():
+            file = path.parent / file
+        count = values.pop('replicas', replicas)
+
+        entries.append(( str(file.resolve()), Settings(**{ **defaults, **values }), count ))
+
+    return entries
+
+def _job_id(file: str, settings: Settings, replica: int) -> str:
+    """
+    A stable identifier for a job, from its manifest entry's file and
+    settings (including the seed, if one was given) and its replica
+    number. Jobs from a manifest are matched up with the database by
+    their ids when a batch is resumed.
+    """
+    digest = hashlib.sha256(
+        json.dumps( [file, settings], sort_keys=True ).encode('utf-8')
+    ).hexdigest()[:10]
+    return f"{Path(file).stem}-{settings['chromosome']}-{digest}-r{replica}"
+
+def expand_jobs(entries: T.List[T.Tuple[str, Settings, int]]) -> T.List[BatchJob]:
+    """
+    Expand manifest entries (from read_manifest) into one job per replica.
+    Each replica gets its own seed, derived from the entry's seed (see
+    replica_seeds). For entries without a seed, the replicas get random
+    seeds (which are recorded in the database, when the jobs are added).
+    """
+    jobs = []
+    for (file, settings, replicas) in entries:
+        seeds = replica_seeds( settings.get('seed'), replicas )
+        for (replica, seed) in enumerate(seeds):
+            jobs.append(BatchJob(
+                id=_job_id(file, settings, replica),
+                file=file,
+                replica=replica,
+                settings=Settings(**{ **settings, 'seed': seed })
+            ))
+    return jobs
+
+########################
+# STATUS DATABASE
+########################
+
+class BatchDatabase:
+    """
+    An SQLite database with the status of every job in a batch.
+    It can be used from multiple threads.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect( str(self.path), check_same_thread=False )
+        with self._lock, self._db:
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    file TEXT NOT NULL,
+                    replica INTEGER NOT NULL,
+                    settings TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT NOT NULL DEFAULT '',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    wall_time REAL,
+                    updated REAL
+                )
+            ''')
+
+    def close(self):
+        self._db.close()
+
+    def add(self, jobs: T.List[BatchJob]) -> T.List[BatchJob]:
+        """
+        Add jobs that aren't in the database yet. Returns every given job,
+        with the settings stored in the database (so a job that was already
+        added keeps the seed it was first given).
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO jobs (id, file, replica, settings, status, updated)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    ( j['id'], j['file'], j['replica'], json.dumps(j['settings']), PENDING, time.time() )
+                    for j in jobs
+                ]
+            )
+            stored = dict( self._db.execute('SELECT id, settings FROM jobs') )
+
+        return [
+            BatchJob( **{ **j, 'settings': Settings(**json.loads(stored[j['id']])) } )
+            for j in jobs
+        ]
+
+    def status(self, id: str) -> T.Optional[str]:
+        with self._lock:
+            row = self._db.execute('SELECT status FROM jobs WHERE id = ?', (id,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_running(self, id: str):
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, updated = ? WHERE id = ?',
+                ( RUNNING, time.time(), id )
+            )
+
+    def set_result(self, result: BatchResult):
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE jobs SET status = ?, error = ?, wall_time = ?, updated = ? WHERE id = ?',
+                ( result['status'], result['error'], result['wall_time'], time.time(), result['id'] )
+            )
+
+    def counts(self) -> T.Dict[str, int]:
+        """
+        The number of jobs with each status
+        """
+        with self._lock:
+            return dict( self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status') )
+
+########################
+# RUNNING
+########################
+
+class _RecordStore:
+    """
+    Contact records shared between the jobs that use them. Records for
+    each (file, chromosome, resolution, threshold, normalization, matrix
+    type, selection) are extracted once, by the first job that needs them, and dropped
+    after the last one finishes. Each file is opened once, so records with
+    different normalizations are computed from the same decoded records
+    (see HIC.get_contact_records), and closed after its last job finishes.
+    """
+
+    def __init__(self, jobs: T.List[BatchJob]):
+        self._lock = threading.Lock()
+        self._futures: T.Dict[tuple, Future] = {}
+        self._users: T.Dict[tuple, int] = {}
+        self._files: T.Dict[str, HIC] = {}
+        self._file_users: T.Dict[str, int] = {}
+        for job in jobs:
+            key = self.key(job)
+            self._users[key] = self._users.get(key, 0) + 1
+            self._file_users[job['file']] = self._file_users.get(job['file'], 0) + 1
+
+    @staticmethod
+    def key(job: BatchJob) -> tuple:
+        s = job['settings']
+        return (
+            job['file'], s['chromosome'], s['resolution'], s['count_threshold'],
+            s.get('normalization', 'KR'), s.get('matrix_type', 'observed'),
+            *( s.get(name) for name in SELECTION_SETTINGS )
+        )
+
+    def _hic(self, file: str) -> HIC:
+        with self._lock:
+            if file not in self._files:
+                self._files[file] = HIC( Path(file) )
+            return self._files[file]
+
+    def get(self, job: BatchJob) -> ContactRecords:
+        key = self.key(job)
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+
+        if owner:
+            try:
+                future.set_result( self._hic(job['file']).get_contact_records(job['settings']) )
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def release(self, job: BatchJob):
+        key = self.key(job)
+        with self._lock:
+            self._users[key] -= 1
+            if self._users[key] == 0:
+                self._futures.pop(key, None)
+            self._file_users[job['file']] -= 1
+            if self._file_users[job['file']] == 0:
+                self._files.pop(job['file'], None)
+
+def _run_job(
+    job: BatchJob, store: _RecordStore, db: BatchDatabase, outdir: Path,
+    lammps_exec: str, options: dict, stop: threading.Event
+) -> T.Optional[BatchResult]:
+    """
+    Run a single job, writing its output to a directory named by
+    its id inside 'outdir'. If 'stop' is set (because the batch was
+    interrupted), LAMMPS is stopped and no result is recorded, so the
+    job is run again when the batch is resumed. Returns None in that case.
+    """
+    if stop.is_set():
+        return None
+    db.set_running(job['id'])
+    result = BatchResult(id=job['id'], status=FAILED, error='', wall_time=0.0)
+
+    start = time.perf_counter()
+    try:
+        jobdir = outdir/job['id']
+        jobdir.mkdir(parents=True, exist_ok=True)
+        write_settings(jobdir/'settings.json', job['settings'])
+
+        records = store.get(job)
+        data = run_lammps(
+            ContactMap.from_records(records), job['settings'], lammps_exec,
+            copy_log_to=jobdir/'sim.log', cancel=stop, **options
+        )
+        write_structure( jobdir/'structure.csv', data[ sorted(data.keys())[-1] ] )
+        result['status'] = DONE
+    except (HICError, LAMMPSError, OSError, ValueError, RuntimeError) as e:
+        result['error'] = str(e)
+    finally:
+        store.release(job)
+
+    result['wall_time'] = time.perf_counter() - start
+    if stop.is_set():
+        return None
+    db.set_result(result)
+    return result
+
+def run_batch(
+    jobs: T.List[BatchJob], outdir: Path, lammps_exec: str='lmp',
+    cores: int=1, cores_per_job: int=1, retry_failed: bool=False,
+    callback: T.Callable[[BatchResult], None]=None, **options
+) -> T.List[BatchResult]:
+    """
+    Run every job that hasn't finished yet, with as many running at once
+    as fit in a budget of 'cores'. Each job runs LAMMPS on 'cores_per_job'
+    MPI processes (as run_lammps's 'mpi_procs', so LAMMPS must be built
+    with MPI if it's more than 1). Each job's structure, log and settings
+    are written to a directory named by its id in 'outdir/jobs', and its
+    status is recorded in 'outdir/batch.db'. Jobs that failed in an earlier
+    run are skipped, unless 'retry_failed' is set. Other options are passed
+    to run_lammps.
+
+    If the batch is interrupted (e.g. by Ctrl-C), the running simulations
+    are stopped and the workers are waited for before the exception is
+    raised again. Interrupted jobs aren't recorded as failed, so they're
+    run again when the batch is resumed.
+
+    If set, 'callback' is called with each result as it finishes.
+    Returns the results of the jobs that were run.
+    """
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    db = BatchDatabase(outdir/'batch.db')
+    try:
+        jobs = db.add(jobs)
+        skip = { DONE, FAILED } if not retry_failed else { DONE }
+        todo = [ j for j in jobs if db.status(j['id']) not in skip ]
+        log.info(f"Running {len(todo)} of {len(jobs)} jobs (skipping the rest, which already ran)")
+
+        store = _RecordStore(todo)
+        cores_per_job = max(1, cores_per_job)
+        workers = max(1, cores // cores_per_job)
+        if cores_per_job > 1:
+            options = { **options, 'mpi_procs': cores_per_job }
+
+        def report(future: Future):
+            if not future.cancelled() and future.exception() is None \
+                    and future.result() is not None:
+                callback( future.result() )
+
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = []
+            for job in todo:
+                future = pool.submit(
+                    _run_job, job, store, db, outdir/'jobs', lammps_exec, options, stop
+                )
+                if callback is not None:
+                    future.add_done_callback(report)
+                futures.append(future)
+            results = [ f.result() for f in futures ]
+        except BaseException:
+            # Don't start any more jobs, and stop the running simulations.
+            # They're left marked as running, so they're run again on
+            # resume. The workers have to finish before the database is
+            # closed.
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        pool.shutdown()
+        return results
+    finally:
+        db.close()
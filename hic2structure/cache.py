@@ -0,0 +1,231 @@
+"""
+Module for caching the results of LAMMPS simulations on local disk.
+
+Results are keyed by a hash of everything that goes into a simulation: the
+contact set, the LAMMPS settings (including the seed), any other options
+passed to run_lammps and the version of LAMMPS. Each entry stores the final
+timestep and the LAMMPS log. When the cache grows beyond its size limit,
+the least recently used entries are removed.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess as sub
+import tempfile as temp
+import typing as T
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from .types import LAMMPSSettings, LAMMPSTimestep, LAMMPSTimeseries, ContactSet
+from .contactmap import ContactMap, unpack_pairs
+from .lammps import run_lammps
+from .metrics import stage
+
+@functools.lru_cache(maxsize=None)
+def lammps_version(lammps_exec: str='lmp') -> str:
+    """
+    Get the version string of a LAMMPS executable (the first line of its
+    help output). Returns 'unknown' if it can't be determined.
+    """
+    try:
+        proc = sub.run(
+            [lammps_exec, '-h'],
+            stdout=sub.PIPE, stderr=sub.DEVNULL, text=True, timeout=60
+        )
+    except (OSError, sub.SubprocessError):
+        return 'unknown'
+
+    for line in proc.stdout.splitlines():
+        if line.strip():
+            return line.strip()
+    return 'unknown'
+
+def cache_key(
+    records: T.Union[ContactSet, ContactMap], settings: LAMMPSSettings,
+    lammps_version: str, **options
+) -> str:
+    """
+    Compute the cache key for a simulation. 'options' are any other
+    arguments to run_lammps that affect the result. The settings must
+    have a seed, since a simulation without one isn't repeatable.
+    """
+    if settings.get('seed') is None:
+        raise ValueError("Simulations without a seed can't be cached")
+
+    if not isinstance(records, ContactMap):
+        records = ContactMap.from_set(records)
+
+    h = hashlib.sha256()
+    # The contact set, independent of the order of its records
+    h.update( records.keys.astype('<i8').tobytes() )
+    h.update( str(records.num_beads).encode('utf-8') )
+
+    # Counts only affect the result when contact bonds are weighted by them
+    if (settings.get('bond_bins') or 0) > 1 and records.counts is not None:
+        (x, y) = unpack_pairs(records.keys)
+        counts = np.asarray( records.csr[x-1, y-1] ).ravel()
+        h.update( counts.astype('<f8').tobytes() )
+
+    # Only the fields used by LAMMPS affect the result
+    lammps_settings = { k: settings.get(k) for k in LAMMPSSettings.__annotations__ }
+
+    # (A cancellation event doesn't affect the result)
+    options = { k: v for (k, v) in options.items() if k != 'cancel' }
+    for (name, value) in options.items():
+        if isinstance(value, np.ndarray):
+            options[name] = hashlib.sha256( np.ascontiguousarray(value).tobytes() ).hexdigest()
+
+    h.update( json.dumps(
+        {
+            'settings': lammps_settings,
+            'options': options,
+            'lammps': lammps_version
+        },
+        sort_keys=True, default=str
+    ).encode('utf-8') )
+    return h.hexdigest()
+
+class ResultCache:
+    """
+    A size-bounded cache of simulation results in a local directory.
+    Each entry is a subdirectory, named by its key, with:
+        timestep.npy  The final LAMMPSTimestep
+        sim.log       The LAMMPS log
+        meta.json     The timestep number (and the time the entry was last used)
+    """
+
+    def __init__(self, dir: Path, max_bytes: int=1<<30):
+        self.dir = Path(dir)
+        self.max_bytes = max_bytes
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key: str) -> Path:
+        return self.dir / key
+
+    def get(self, key: str) -> T.Optional[T.Tuple[int, LAMMPSTimestep, Path]]:
+        """
+        Look up an entry. Returns a tuple of (timestep, data, log path) or
+        None if the key isn't in the cache.
+        """
+        entry = self._entry(key)
+        try:
+            with open(entry/'meta.json', 'r') as f:
+                meta = json.load(f)
+            data = np.load(entry/'timestep.npy')
+            # Mark the entry as recently used
+            os.utime(entry/'meta.json')
+        except (OSError, ValueError):
+            return None
+        return ( meta['timestep'], LAMMPSTimestep(data), entry/'sim.log' )
+
+    def put(self, key: str, timestep: int, data: LAMMPSTimestep, log_path: Path=None):
+        """
+        Add an entry to the cache, then evict old entries if the cache is
+        over its size limit.
+        """
+        # Write into a temporary directory first, so other processes never
+        # see a partially-written entry
+        staging = Path( temp.mkdtemp(dir=self.dir, prefix='.tmp-') )
+        try:
+            np.save(staging/'timestep.npy', data)
+            if log_path is not None and log_path.exists():
+                shutil.copy2(log_path, staging/'sim.log')
+            with open(staging/'meta.json', 'w') as f:
+                json.dump({ 'timestep': int(timestep) }, f)
+
+            entry = self._entry(key)
+            if entry.exists():
+                # Move the old entry out of the way first, since
+                # directories can't be replaced atomically
+                trash = self.dir / f'.old-{uuid.uuid4().hex}'
+                os.replace(entry, trash)
+                shutil.rmtree(trash, ignore_errors=True)
+            os.replace(staging, entry)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict()
+
+    def entries(self) -> T.List[T.Tuple[float, int, Path]]:
+        """
+        List the entries in the cache as (last used time, size in bytes, path)
+        tuples, from least to most recently used
+        """
+        entries = []
+        for entry in self.dir.iterdir():
+            if entry.name.startswith('.'):
+                continue
+            try:
+                used = (entry/'meta.json').stat().st_mtime
+                size = sum( f.stat().st_size for f in entry.iterdir() )
+            except OSError:
+                continue
+            entries.append( (used, size, entry) )
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache
+        is within its size limit
+        """
+        entries = self.entries()
+        total = sum( size for (_, size, _) in entries )
+        for (_, size, entry) in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """
+        Remove every entry in the cache
+        """
+        for (_, _, entry) in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+def run_lammps_cached(
+    cache: ResultCache,
+    records: T.Union[ContactSet, ContactMap], settings: LAMMPSSettings,
+    lammps_exec: str='lmp', copy_log_to: Path=None, **options
+) -> T.Tuple[LAMMPSTimeseries, bool]:
+    """
+    Like run_lammps, but return the result from the cache if the same
+    simulation has been run before. Only the final timestep is cached, so
+    on a cache hit the result contains just that timestep.
+
+    Returns a tuple of (result, hit), where 'hit' is True if the result
+    came from the cache. Runs that save a trajectory bypass the cache, as
+    do runs without a seed (which should give a new structure every time).
+    """
+    if options.get('trajectory_to') is not None or settings.get('seed') is None:
+        data = run_lammps(records, settings, lammps_exec, copy_log_to, **options)
+        return ( data, False )
+
+    with stage('cache.get') as info:
+        key = cache_key( records, settings, lammps_version(lammps_exec), **options )
+        cached = cache.get(key)
+        info['hit'] = cached is not None
+    if cached is not None:
+        (timestep, data, log_path) = cached
+        if copy_log_to is not None and log_path.exists():
+            shutil.copy2(log_path, copy_log_to)
+        return ( { timestep: data }, True )
+
+    with temp.TemporaryDirectory() as tmpdir:
+        log_path = Path(tmpdir)/'sim.log'
+        try:
+            data = run_lammps(records, settings, lammps_exec, log_path, **options)
+        finally:
+            if copy_log_to is not None and log_path.exists():
+                shutil.copy2(log_path, copy_log_to)
+
+        last = sorted(data.keys())[-1]
+        with stage('cache.put'):
+            cache.put(key, last, data[last], log_path)
+
+    return ( data, False )
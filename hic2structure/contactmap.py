@@ -0,0 +1,225 @@
+"""
+Module for a compact, sparse representation of contact maps
+
+(scipy.sparse is only imported when one of the sparse matrix
+properties is used, since it's slow to import)
+"""
+
+from functools import cached_property
+
+import numpy as np
+
+from .types import ContactRecords, ContactSet
+
+def pack_pairs(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Pack pairs of (non-negative, 32-bit) bin numbers into single 64-bit keys.
+    Sorting the keys sorts the pairs by x, then y.
+    """
+    return ( np.asarray(x, dtype=np.int64) << 32 ) | np.asarray(y, dtype=np.int64)
+
+def unpack_pairs(keys: np.ndarray):
+    """
+    Inverse of pack_pairs. Returns a tuple of (x, y) arrays
+    """
+    return ( keys >> 32, keys & 0xFFFFFFFF )
+
+class ContactMap:
+    """
+    A contact map, stored as int32 bin (bead) numbers with optional float32
+    counts. Bin numbers are 1-based, as in ContactRecords and ContactSets,
+    so bead 'i' is at row/column 'i-1' of the sparse matrices.
+
+    Contacts are treated as unordered pairs: (x,y) and (y,x) are the same
+    contact. A ContactMap without counts is "binary", like a ContactSet.
+    """
+
+    def __init__(self, x, y, counts=None, num_beads: int=None, count_dtype=np.float32):
+        self.x = np.asarray(x, dtype=np.int32)
+        self.y = np.asarray(y, dtype=np.int32)
+        self.counts = None if counts is None \
+            else np.asarray(counts, dtype=count_dtype)
+
+        if len(self.x) != len(self.y) or \
+            (self.counts is not None and len(self.counts) != len(self.x)):
+            raise ValueError("Contact map columns must have the same length")
+
+        if num_beads is None:
+            num_beads = int( max(self.x.max(), self.y.max()) ) if len(self.x) else 0
+        self._num_beads = num_beads
+
+    ########################
+    # CONVERSIONS
+    ########################
+
+    @classmethod
+    def from_records(cls, records: ContactRecords, count_dtype=np.float32) -> 'ContactMap':
+        """
+        Create a contact map from ContactRecords. Counts are stored as
+        float32 by default, which is exact for integer counts below 2^24.
+        Pass count_dtype=np.float64 to keep normalized values exactly.
+        """
+        return cls(records[:,0], records[:,1], records[:,2], count_dtype=count_dtype)
+
+    @classmethod
+    def from_set(cls, contacts: ContactSet) -> 'ContactMap':
+        """
+        Create a binary contact map from a ContactSet
+        """
+        contacts = np.asarray(contacts).reshape( (-1, 2) )
+        return cls(contacts[:,0], contacts[:,1])
+
+    def to_records(self) -> ContactRecords:
+        """
+        Convert to ContactRecords, in the original order. Binary maps are
+        given a count of 1 for every contact.
+        """
+        counts = np.ones(len(self.x)) if self.counts is None else self.counts
+        return ContactRecords( np.column_stack((self.x, self.y, counts)).astype(np.float64) )
+
+    def to_set(self) -> ContactSet:
+        """
+        Convert to a ContactSet, in the original order.
+        """
+        return ContactSet( np.column_stack((self.x, self.y)).astype(np.int64) )
+
+    ########################
+    # PROPERTIES
+    ########################
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def num_beads(self) -> int:
+        """
+        The number of beads in the map (i.e. the largest bin number, unless
+        set explicitly)
+        """
+        return self._num_beads
+
+    @cached_property
+    def keys(self) -> np.ndarray:
+        """
+        Sorted, unique, packed keys (see pack_pairs) for each contact,
+        with the smaller bin number first.
+        """
+        return np.unique( pack_pairs(
+            np.minimum(self.x, self.y), np.maximum(self.x, self.y)
+        ))
+
+    @cached_property
+    def coo(self) -> 'scipy.sparse.coo_matrix':
+        """
+        The contact map as a COO matrix, in the original order and orientation
+        """
+        import scipy.sparse as sparse
+        values = np.ones(len(self.x), dtype=np.int8) if self.counts is None else self.counts
+        return sparse.coo_matrix(
+            ( values, (self.x - 1, self.y - 1) ),
+            shape=(self.num_beads, self.num_beads)
+        )
+
+    @cached_property
+    def csr(self) -> 'scipy.sparse.csr_matrix':
+        """
+        The contact map as an upper-triangular CSR matrix. If a pair appears
+        more than once, its counts are summed.
+        """
+        import scipy.sparse as sparse
+        values = np.ones(len(self.x), dtype=np.int8) if self.counts is None else self.counts
+        return sparse.csr_matrix(
+            (
+                values,
+                ( np.minimum(self.x, self.y) - 1, np.maximum(self.x, self.y) - 1 )
+            ),
+            shape=(self.num_beads, self.num_beads)
+        )
+
+    @cached_property
+    def symmetric(self) -> 'scipy.sparse.csr_matrix':
+        """
+        A symmetric CSR view of the contact map, with both "sides" included
+        """
+        import scipy.sparse as sparse
+        upper = self.csr
+        return ( upper + sparse.triu(upper, k=1).T ).tocsr()
+
+    @cached_property
+    def degree(self) -> np.ndarray:
+        """
+        The number of distinct contacts for each bead (bead 'i' is at index 'i-1')
+        """
+        (x, y) = unpack_pairs(self.keys)
+        off_diagonal = x != y
+        return np.bincount(
+            np.concatenate( (x, y[off_diagonal]) ) - 1,
+            minlength=self.num_beads
+        ).astype(np.int32)
+
+    ########################
+    # SET OPERATIONS
+    ########################
+
+    def _subset(self, keys: np.ndarray, num_beads: int) -> 'ContactMap':
+        """
+        Create a new contact map from a subset of this one's keys
+        """
+        (x, y) = unpack_pairs(keys)
+        counts = None
+        if self.counts is not None:
+            summed = self.csr
+            counts = np.asarray( summed[x-1, y-1] ).ravel()
+        return ContactMap(x, y, counts, num_beads=num_beads, count_dtype=self.counts_dtype)
+
+    @property
+    def counts_dtype(self):
+        return np.float32 if self.counts is None else self.counts.dtype
+
+    def intersection(self, other: 'ContactMap') -> 'ContactMap':
+        """
+        Contacts present in both maps (with this map's counts)
+        """
+        keys = np.intersect1d(self.keys, other.keys, assume_unique=True)
+        return self._subset( keys, max(self.num_beads, other.num_beads) )
+
+    def difference(self, other: 'ContactMap') -> 'ContactMap':
+        """
+        Contacts present in this map, but not the other one (with this map's counts)
+        """
+        keys = np.setdiff1d(self.keys, other.keys, assume_unique=True)
+        return self._subset( keys, self.num_beads )
+
+    def union(self, other: 'ContactMap') -> 'ContactMap':
+        """
+        Contacts present in either map. Where a contact is in both, this
+        map's counts are used.
+        """
+        num_beads = max(self.num_beads, other.num_beads)
+        ours = self._subset(self.keys, num_beads)
+        theirs = other._subset(
+            np.setdiff1d(other.keys, self.keys, assume_unique=True), num_beads
+        )
+
+        counts = None
+        if ours.counts is not None or theirs.counts is not None:
+            counts = np.concatenate((
+                np.ones(len(ours)) if ours.counts is None else ours.counts,
+                np.ones(len(theirs)) if theirs.counts is None else theirs.counts
+            ))
+        keys = np.concatenate(( self.keys, theirs.keys ))
+        order = np.argsort(keys, kind='stable')
+        (x, y) = unpack_pairs(keys[order])
+        return ContactMap(
+            x, y, None if counts is None else counts[order],
+            num_beads=num_beads, count_dtype=self.counts_dtype
+        )
+
+    def __and__(self, other: 'ContactMap') -> 'ContactMap':
+        return self.intersection(other)
+
+    def __or__(self, other: 'ContactMap') -> 'ContactMap':
+        return self.union(other)
+
+    def __sub__(self, other: 'ContactMap') -> 'ContactMap':
+        return self.difference(other)
@@ -2,10 +2,19 @@
 Module for dealing with Contact Maps
 """
 
+import itertools
+import typing as T
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
 import numpy as np
-from scipy.spatial.distance import pdist, squareform
 
-from .types import LAMMPSTimestep, ContactRecordSettings, ContactRecords, ContactSet
+from .types import (
+    LAMMPSTimestep, LAMMPSTimeseries, AnyTimestep, timestep_columns,
+    ContactRecordSettings, ContactRecords, ContactSet, ContactComparison
+)
+from .contactmap import ContactMap, pack_pairs, unpack_pairs
 
 def contact_records_to_set(contacts: ContactRecords) -> ContactSet:
     """
@@ -15,35 +24,552 @@ def contact_records_to_set(contacts: ContactRecords) -> ContactSet:
     """
     return ContactSet( contacts[:,:2].astype(np.int64) )
 
-def find_contacts(data: LAMMPSTimestep, settings: ContactRecordSettings) -> ContactSet:
+def filter_contact_records(contacts: ContactRecords, count_threshold: float) -> ContactRecords:
+    """
+    Return only the contact records with a count greater than the given
+    threshold (the same filter used when reading records from a Hi-C file)
+    """
+    return ContactRecords( contacts[ contacts[:,2] > count_threshold ] )
+
+def diff_contact_sets(
+    old: T.Union[ContactSet, ContactMap], new: T.Union[ContactSet, ContactMap]
+) -> T.Tuple[ContactSet, ContactSet]:
     """
-    Get contacts from a LAMMPS output dump
+    Compare two sets of contacts (as unordered pairs). Returns an
+    (added, removed) tuple: the contacts only in 'new', and the contacts
+    only in 'old', each with the smaller bead first.
     """
-    coords = data[:,1:4]
-    IDs = data[:,0]
+    if not isinstance(old, ContactMap):
+        old = ContactMap.from_set(old)
+    if not isinstance(new, ContactMap):
+        new = ContactMap.from_set(new)
 
-    distances = np.triu( squareform(pdist(coords)) )
-    contact_IDarrays = np.where(
-        ( distances < settings['distance_threshold'] ) & ( distances > 0 )\
+    def to_set(keys: np.ndarray) -> ContactSet:
+        return ContactSet( np.column_stack( unpack_pairs(keys) ).astype(np.int64) )
+
+    return (
+        to_set( np.setdiff1d(new.keys, old.keys, assume_unique=True) ),
+        to_set( np.setdiff1d(old.keys, new.keys, assume_unique=True) )
     )
 
-    C = np.ma.size( contact_IDarrays[0] )
-    contact_IDs = np.hstack(
-        (
-            np.reshape( np.take(IDs,contact_IDarrays[0]), (C,1) ),
-            np.reshape( np.take(IDs,contact_IDarrays[1]), (C,1) )
-        )
+########################
+# SELECTION
+########################
+
+#
+# Settings used by select_contacts. Any of them can be left out (or None)
+#   min_separation:   Drop contacts between beads fewer than this many
+#                     beads apart along the chain
+#   stratum_quantile: Keep only the contacts at or above this quantile of
+#                     the counts at their separation (e.g. 0.9 keeps the
+#                     strongest 10% of each diagonal of the contact map)
+#   max_degree:       Keep at most this many contacts for each bead
+#   max_contacts:     Keep at most this many contacts in total
+#
+SELECTION_SETTINGS = [ 'min_separation', 'stratum_quantile', 'max_degree', 'max_contacts' ]
+
+def _sort_within_groups(groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Indices that sort by (non-negative, integer) group, then by value
+    within each group. This packs both into a single integer key, which
+    sorts much faster than np.lexsort for large arrays.
+    """
+    rank = np.empty(len(values), dtype=np.int64)
+    rank[ np.argsort(values) ] = np.arange(len(values))
+    return np.argsort( groups.astype(np.int64) * len(values) + rank )
+
+def _group_positions(groups: np.ndarray) -> np.ndarray:
+    """
+    For a sorted array of group ids, the position of each
+    element within its group (starting from 0)
+    """
+    positions = np.arange(len(groups))
+    group_start = np.ones(len(groups), dtype=bool)
+    group_start[1:] = groups[1:] != groups[:-1]
+    return positions - np.maximum.accumulate( np.where(group_start, positions, 0) )
+
+def stratum_quantile_mask(contacts: ContactRecords, quantile: float) -> np.ndarray:
+    """
+    Mask of the contacts whose counts are at or above the given quantile
+    of the counts at the same separation (using the 'lower' quantile, so
+    the cut is always an actual count)
+    """
+    separation = np.abs( contacts[:,1] - contacts[:,0] ).astype(np.int64)
+    counts = contacts[:,2]
+    order = _sort_within_groups(separation, counts)
+
+    # Size and start of each stratum, in sorted order
+    (strata, start, size) = np.unique(separation[order], return_index=True, return_counts=True)
+    cut = counts[order][ start + np.floor( quantile * (size - 1) ).astype(np.int64) ]
+
+    return counts >= cut[ np.searchsorted(strata, separation) ]
+
+def degree_cap_mask(contacts: ContactRecords, max_degree: int) -> np.ndarray:
+    """
+    Mask of the contacts that are among the 'max_degree' strongest contacts
+    of both of their beads. This guarantees no bead keeps more than
+    'max_degree' contacts (a bead can end up with fewer, where some of its
+    strongest contacts are dropped by the bead at the other end).
+    """
+    n = len(contacts)
+    beads = np.concatenate( (contacts[:,0], contacts[:,1]) ).astype(np.int64)
+    counts = np.concatenate( (contacts[:,2], contacts[:,2]) )
+
+    # Rank each bead's contacts from strongest to weakest
+    order = _sort_within_groups(beads, -counts)
+    rank = np.empty(2*n, dtype=np.int64)
+    rank[order] = _group_positions( beads[order] )
+
+    return (rank[:n] < max_degree) & (rank[n:] < max_degree)
+
+def top_k_mask(contacts: ContactRecords, k: int) -> np.ndarray:
+    """
+    Mask of the 'k' contacts with the highest counts (ties go
+    to the earlier records)
+    """
+    counts = contacts[:,2]
+    if k >= len(counts):
+        return np.ones(len(counts), dtype=bool)
+    if k <= 0:
+        return np.zeros(len(counts), dtype=bool)
+
+    # The k-th highest count, then everything above it and
+    # as many records tied with it as fit
+    cut = np.partition(counts, len(counts) - k)[len(counts) - k]
+    mask = counts > cut
+    ties = np.flatnonzero(counts == cut)[ :k - np.count_nonzero(mask) ]
+    mask[ties] = True
+    return mask
+
+def select_contacts(contacts: ContactRecords, settings: ContactRecordSettings) -> ContactRecords:
+    """
+    Select a subset of contact records, to bound the number of contact
+    bonds in a simulation. Each setting in SELECTION_SETTINGS that's given
+    is applied in that order: minimum separation, stratum quantile, degree
+    cap, then the total limit. Records stay in their original order.
+    """
+    min_separation = settings.get('min_separation')
+    if min_separation:
+        separation = np.abs( contacts[:,1] - contacts[:,0] )
+        contacts = contacts[ separation >= min_separation ]
+
+    quantile = settings.get('stratum_quantile')
+    if quantile:
+        if not 0 <= quantile <= 1:
+            raise ValueError(f"Stratum quantile must be between 0 and 1, not {quantile}")
+        contacts = contacts[ stratum_quantile_mask(contacts, quantile) ]
+
+    max_degree = settings.get('max_degree')
+    if max_degree is not None:
+        contacts = contacts[ degree_cap_mask(contacts, max_degree) ]
+
+    max_contacts = settings.get('max_contacts')
+    if max_contacts is not None:
+        contacts = contacts[ top_k_mask(contacts, max_contacts) ]
+
+    return ContactRecords(contacts)
+
+def _contact_pairs(data: AnyTimestep, threshold: float) -> np.ndarray:
+    """
+    Find the pairs of rows of 'data' whose beads are closer than 'threshold'
+    (but not at the same position). Returns an unsorted (n, 2) array of row
+    indices, with the smaller index first in each pair.
+    """
+    from scipy.spatial import cKDTree
+
+    (_, coords, _) = timestep_columns(data)
+
+    # Find candidate pairs with a k-d tree, rather than building
+    # the full distance matrix
+    pairs = cKDTree(coords).query_pairs(threshold, output_type='ndarray')
+
+    distances = np.linalg.norm( coords[pairs[:,0]] - coords[pairs[:,1]], axis=1 )
+    return pairs[ (distances < threshold) & (distances > 0) ]
+
+def find_contacts(data: AnyTimestep, settings: ContactRecordSettings) -> ContactSet:
+    """
+    Get contacts from a LAMMPS output dump (a LAMMPSTimestep or
+    CompactTimestep)
+    """
+    (IDs, _, _) = timestep_columns(data)
+    pairs = _contact_pairs(data, settings['distance_threshold'])
+    pairs = pairs[ np.lexsort( (pairs[:,1], pairs[:,0]) ) ]
+
+    contacts = np.column_stack(
+        ( np.take(IDs, pairs[:,0]), np.take(IDs, pairs[:,1]) )
     )
+    return ContactSet( contacts.astype(np.int64) )
+
+########################
+# ENSEMBLES
+########################
+
+#
+# Number of contacts an accumulator collects before counting them
+# (which bounds the memory used between counts)
+#
+ACCUMULATOR_BUFFER = 1 << 22
+
+class ContactAccumulator:
+    """
+    Counts how often each pair of beads is in contact over many structures
+    (e.g. the replicas of a simulation and/or the frames of a trajectory),
+    for an ensemble-averaged contact map.
+
+    Contacts in each structure are found with a k-d tree (as in
+    find_contacts) and counted sparsely, so memory grows with the number of
+    distinct contacts, rather than the square of the number of beads.
+    Accumulators can be merged and pickled, so structures can be split
+    between processes (see accumulate_contacts).
+    """
+
+    def __init__(self, distance_threshold: float):
+        self.distance_threshold = distance_threshold
+        self.structures = 0
+        self.num_beads = 0
+        # Sorted, unique packed keys (see pack_pairs) and their counts
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        # Keys found since they were last counted
+        self._pending: T.List[np.ndarray] = []
+        self._pending_size = 0
+
+    def __len__(self):
+        """
+        The number of distinct contacts seen so far
+        """
+        self._flush()
+        return len(self._keys)
+
+    def __getstate__(self):
+        self._flush()
+        return self.__dict__
+
+    def _count(self, keys: np.ndarray, counts: np.ndarray):
+        keys = np.concatenate( (self._keys, keys) )
+        counts = np.concatenate( (self._counts, counts) )
+        (self._keys, inverse) = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount( inverse.ravel(), weights=counts ).astype(np.int64)
+
+    def _flush(self):
+        if self._pending:
+            keys = np.concatenate(self._pending)
+            self._pending = []
+            self._pending_size = 0
+            self._count( keys, np.ones(len(keys), dtype=np.int64) )
+
+    def add(self, data: AnyTimestep) -> int:
+        """
+        Add the contacts in a structure (a LAMMPSTimestep, CompactTimestep,
+        or anything else with id, x, y, z columns). Returns the number of
+        contacts.
+        """
+        pairs = _contact_pairs(data, self.distance_threshold)
+        ids = timestep_columns(data)[0].astype(np.int64)
+        (a, b) = ( ids[pairs[:,0]], ids[pairs[:,1]] )
+        keys = pack_pairs( np.minimum(a, b), np.maximum(a, b) )
+
+        self._pending.append(keys)
+        self._pending_size += len(keys)
+        if self._pending_size >= ACCUMULATOR_BUFFER:
+            self._flush()
+
+        self.structures += 1
+        if len(ids):
+            self.num_beads = max( self.num_beads, int(ids.max()) )
+        return len(keys)
 
-    contacts = np.hstack(
-        (
-            np.reshape( contact_IDs[:,0], (C,1) ),
-            np.reshape( contact_IDs[:,1], (C,1) ),
-            distances[
-                np.reshape( contact_IDarrays[0], (C,1) ),
-                np.reshape( contact_IDarrays[1], (C,1) )
-            ]
+    def add_all(self, structures: T.Iterable[LAMMPSTimestep]) -> 'ContactAccumulator':
+        """
+        Add every structure from an iterable. Returns this accumulator.
+        """
+        for data in structures:
+            self.add(data)
+        return self
+
+    def merge(self, other: 'ContactAccumulator') -> 'ContactAccumulator':
+        """
+        Add the counts from another accumulator (with the same distance
+        threshold) to this one. Returns this accumulator.
+        """
+        if other.distance_threshold != self.distance_threshold:
+            raise ValueError(
+                "Can't merge contacts found with different distance thresholds"
+                f" ({self.distance_threshold} and {other.distance_threshold})"
+            )
+        self._flush()
+        other._flush()
+        self._count(other._keys, other._counts)
+        self.structures += other.structures
+        self.num_beads = max(self.num_beads, other.num_beads)
+        return self
+
+    def __iadd__(self, other: 'ContactAccumulator') -> 'ContactAccumulator':
+        return self.merge(other)
+
+    def to_contact_map(self, frequencies: bool=True) -> ContactMap:
+        """
+        The accumulated contacts as a ContactMap (with the smaller bead
+        first in each pair). Counts are the fraction of structures with
+        each contact, or the number of structures if 'frequencies' is False.
+        """
+        self._flush()
+        (x, y) = unpack_pairs(self._keys)
+        counts = self._counts / max(self.structures, 1) if frequencies else self._counts
+        return ContactMap(x, y, counts, num_beads=self.num_beads, count_dtype=np.float64)
+
+    def to_records(self) -> ContactRecords:
+        """
+        The accumulated contacts as ContactRecords, with the fraction of
+        structures with each contact as its value
+        """
+        return self.to_contact_map().to_records()
+
+def _accumulate_file(
+    path: Path, distance_threshold: float, skip: int, stride: int
+) -> ContactAccumulator:
+    """
+    Accumulate the contacts in one file (run in a worker process)
+    """
+    from .lammps import iter_frames
+
+    frames = itertools.islice( iter_frames(path), skip, None, stride )
+    return ContactAccumulator(distance_threshold).add_all( data for (_, data) in frames )
+
+def accumulate_contacts(
+    paths: T.Iterable[Path], distance_threshold: float,
+    workers: int=1, skip: int=0, stride: int=1
+) -> ContactAccumulator:
+    """
+    Accumulate the contacts in the structures from a set of files (LAMMPS
+    dumps, trajectory files or structure files, see iter_frames), e.g. the
+    outputs of a batch of replicas. The first 'skip' frames of each file
+    are left out (e.g. before the simulation equilibrated), then every
+    'stride'-th frame is used.
+
+    With 'workers' above 1, files are read by that many processes at once,
+    and their accumulators are merged as they finish.
+    """
+    paths = [ Path(p) for p in paths ]
+    total = ContactAccumulator(distance_threshold)
+
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            total.merge( _accumulate_file(path, distance_threshold, skip, stride) )
+        return total
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_accumulate_file, path, distance_threshold, skip, stride)
+            for path in paths
+        ]
+        for future in as_completed(futures):
+            total.merge( future.result() )
+    return total
+
+########################
+# COMPARISON
+########################
+
+class _Strata:
+    """
+    A contact map, reduced to unique upper-triangular pairs and grouped by
+    genomic separation (i.e. by diagonal). Used for comparing contact maps
+    without building dense matrices.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, values: np.ndarray):
+        low  = np.minimum(x, y).astype(np.int64)
+        high = np.maximum(x, y).astype(np.int64)
+        keep = low != high
+
+        (self.keys, inverse) = np.unique(
+            pack_pairs(low[keep], high[keep]), return_inverse=True
         )
-    ) 
+        # If a pair appears more than once, sum its values
+        self.values = np.bincount( inverse.ravel(), weights=values[keep] )
+        self.num_beads = int(high.max()) if len(high) else 0
+
+def _grouped_ranks(groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Rank values within each group (starting from 1), giving tied values
+    the average of their ranks.
+    """
+    order = np.lexsort( (values, groups) )
+    g = groups[order]
+    v = values[order]
+
+    # Position of each sorted element within its group
+    positions = np.arange(len(g))
+    group_start = np.zeros(len(g), dtype=bool)
+    group_start[:1] = True
+    group_start[1:] = g[1:] != g[:-1]
+    positions = positions - np.maximum.accumulate( np.where(group_start, positions, 0) )
+
+    # Average positions over runs of tied values
+    run_start = group_start.copy()
+    run_start[1:] |= v[1:] != v[:-1]
+    run_ids = np.cumsum(run_start) - 1
+    run_sums = np.bincount(run_ids, weights=positions)
+    run_counts = np.bincount(run_ids)
+    sorted_ranks = ( run_sums / run_counts )[run_ids] + 1
+
+    ranks = np.empty(len(values))
+    ranks[order] = sorted_ranks
+    return ranks
+
+def _correlations(sep, x, y, sizes):
+    """
+    Pearson correlation for each stratum, where 'x' and 'y' are the values
+    of the entries in the stratum 'sep' that are present in either map, and
+    every other entry in the stratum is zero.
+    'sizes' is the total number of entries in each stratum.
+
+    Returns (correlation, variance of x, variance of y) for each stratum.
+    """
+    def total(weights):
+        return np.bincount(sep, weights=weights, minlength=len(sizes))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = total(x) / sizes
+        mean_y = total(y) / sizes
+        var_x  = total(x*x) / sizes - mean_x**2
+        var_y  = total(y*y) / sizes - mean_y**2
+        cov    = total(x*y) / sizes - mean_x*mean_y
+
+        # Treat tiny (floating-point error) variances as zero
+        var_x[ var_x <= 1e-12 * np.maximum(mean_x**2, 1) ] = 0
+        var_y[ var_y <= 1e-12 * np.maximum(mean_y**2, 1) ] = 0
+        r = cov / np.sqrt(var_x * var_y)
+
+    return ( r, var_x, var_y )
+
+def _compare_strata(
+    simulated: _Strata, experimental: _Strata,
+    num_beads: int=None, max_separation: int=None
+) -> ContactComparison:
+    """
+    Compare two contact maps (see compare_contacts)
+    """
+    # Precision/recall
+    matches = len( np.intersect1d(simulated.keys, experimental.keys, assume_unique=True) )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.float64(matches) / len(simulated.keys)
+        recall    = np.float64(matches) / len(experimental.keys)
+        f1        = 2 * precision * recall / (precision + recall)
+
+    # Union of both maps, with zeros where a pair is missing from one of them
+    keys = np.union1d(simulated.keys, experimental.keys)
+    sim_values = np.zeros(len(keys))
+    exp_values = np.zeros(len(keys))
+    sim_values[ np.searchsorted(keys, simulated.keys) ] = simulated.values
+    exp_values[ np.searchsorted(keys, experimental.keys) ] = experimental.values
+
+    if num_beads is None:
+        num_beads = max(simulated.num_beads, experimental.num_beads)
+    if max_separation is None:
+        max_separation = num_beads - 1
+    max_separation = max(0, min(max_separation, num_beads - 1))
+
+    (x, y) = unpack_pairs(keys)
+    sep = (y - x)
+    keep = sep <= max_separation
+    (sep, sim_values, exp_values) = ( sep[keep], sim_values[keep], exp_values[keep] )
+
+    # Number of entries in each stratum (diagonal) of an n*n map
+    sizes = num_beads - np.arange(max_separation + 1)
+
+    # Pearson correlation, per stratum
+    (pearson, _, _) = _correlations(sep, sim_values, exp_values, sizes)
+
+    # Spearman correlation, per stratum. Missing entries are all tied at
+    # zero (i.e. ranked below every contact) so their rank is the average
+    # of the lowest ranks
+    def ranks(values):
+        nonzero = values != 0
+        zeros = sizes - np.bincount(sep[nonzero], minlength=len(sizes))
+        r = np.zeros(len(values))
+        r[nonzero] = _grouped_ranks(sep[nonzero], values[nonzero]) + zeros[ sep[nonzero] ]
+        r[~nonzero] = ( (zeros + 1) / 2 )[ sep[~nonzero] ]
+        return ( r, (zeros + 1) / 2 )
+
+    (sim_ranks, sim_zero_rank) = ranks(sim_values)
+    (exp_ranks, exp_zero_rank) = ranks(exp_values)
+    # Shift the ranks so entries absent from both maps (which are tied at
+    # the zero rank) are zero. This doesn't change the correlations.
+    (spearman, rank_var_sim, rank_var_exp) = _correlations(
+        sep,
+        sim_ranks - sim_zero_rank[sep], exp_ranks - exp_zero_rank[sep],
+        sizes
+    )
+
+    # Stratum-adjusted correlation coefficient (as in HiCRep, without
+    # smoothing). Each stratum's correlation is weighted by its size and
+    # the spread of its (normalized) ranks
+    with np.errstate(invalid='ignore'):
+        weights = sizes * np.sqrt( rank_var_sim * rank_var_exp ) / sizes**2
+    valid = np.isfinite(pearson) & (weights > 0)
+    valid[0] = False # The diagonal itself isn't compared
+    scc = np.sum( (weights * pearson)[valid] ) / np.sum( weights[valid] ) \
+        if valid.any() else np.nan
+
+    separations = np.arange(1, max_separation + 1)
+    return {
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1': float(f1),
+        'separations': separations,
+        'pearson': pearson[1:],
+        'spearman': spearman[1:],
+        'scc': float(scc)
+    }
+
+def _experimental_strata(experimental: ContactRecords) -> _Strata:
+    return _Strata( experimental[:,0], experimental[:,1], experimental[:,2] )
+
+def _simulated_strata(simulated: ContactSet) -> _Strata:
+    simulated = np.asarray(simulated).reshape( (-1, 2) )
+    return _Strata( simulated[:,0], simulated[:,1], np.ones(len(simulated)) )
+
+def compare_contacts(
+    simulated: ContactSet, experimental: ContactRecords,
+    max_separation: int=None, num_beads: int=None
+) -> ContactComparison:
+    """
+    Score a simulated contact map (e.g. from find_contacts) against an
+    experimental one (e.g. from HIC.get_contact_records).
+
+    Precision and recall treat every experimental record as a contact.
+    The correlations compare the binary simulated map with the experimental
+    counts, over every pair of beads (not just the pairs in either map)
+    separately for each separation up to 'max_separation'. Counts are
+    assumed to be non-negative.
+
+    'num_beads' is the size of the maps, which defaults to the largest bead
+    number in either one.
+    """
+    return _compare_strata(
+        _simulated_strata(simulated), _experimental_strata(experimental),
+        num_beads, max_separation
+    )
+
+def compare_trajectory(
+    timeseries: T.Union[LAMMPSTimeseries, T.Iterable[T.Tuple[int, LAMMPSTimestep]]],
+    experimental: ContactRecords, settings: ContactRecordSettings,
+    max_separation: int=None, num_beads: int=None
+) -> T.Iterator[T.Tuple[int, ContactComparison]]:
+    """
+    Score every timestep of a simulation against an experimental contact map
+    (see compare_contacts), yielding (timestep, comparison) pairs.
+
+    'timeseries' can be a LAMMPSTimeseries (such as a dict from read_dumpfile
+    or a TrajectoryReader) or an iterable of (timestep, data) pairs (such as
+    from iter_dumpfile). Frames are processed one at a time, so only one
+    needs to be in memory at once.
+    """
+    exp = _experimental_strata(experimental)
+    items = timeseries.items() if isinstance(timeseries, Mapping) else timeseries
 
-    return contact_records_to_set( ContactRecords(contacts) )
+    for (timestep, data) in items:
+        sim = _simulated_strata( find_contacts(data, settings) )
+        yield ( timestep, _compare_strata(sim, exp, num_beads, max_separation) )
@@ -0,0 +1,80 @@
+"""
+Names of the file formats and encodings supported by the other modules.
+
+These are kept separate (and free of heavy imports) so the command-line
+interface can list them without loading NumPy.
+"""
+
+#
+# Formats supported for structure files, mapped to their file extensions.
+#   csv: Plain text with a header row (id, x, y, z)
+#   npy: NumPy array of float32 coordinates, one row per bead (sorted by id,
+#        which must be 1 to n)
+#   raw: Headerless float32 coordinates (sorted by id, which must be 1 to n),
+#        suitable for np.memmap
+#   npz: Compressed NumPy archive with 'ids' and 'coords' arrays
+#
+STRUCTURE_FORMATS = {
+    'csv': '.csv',
+    'npy': '.npy',
+    'raw': '.f32',
+    'npz': '.npz',
+}
+
+#
+# Formats supported for contact map files, mapped to their file extensions.
+#   tsv: Plain text, one row per (symmetrized) contact
+#   npz: A scipy.sparse CSR matrix (see scipy.sparse.save_npz). Bead 'i'
+#        is at row/column 'i-1'
+#
+CONTACT_FORMATS = {
+    'tsv': '.tsv',
+    'npz': '.npz',
+}
+
+#
+# Available precisions for coordinates stored in trajectory files
+#
+PRECISIONS = [ 'float32', 'int16' ]
+
+#
+# Normalizations of Hi-C contact counts. Which ones are available depends
+# on the file (and can vary between chromosomes and resolutions)
+#   NONE:    Raw counts
+#   VC:      Vanilla coverage
+#   VC_SQRT: Square root of vanilla coverage
+#   KR:      Knight-Ruiz matrix balancing
+#   SCALE:   Matrix scaling (as used by newer versions of Juicer)
+#
+NORMALIZATIONS = [ 'NONE', 'VC', 'VC_SQRT', 'KR', 'SCALE' ]
+
+#
+# Types of values that can be read from a Hi-C file
+#   observed: Contact counts (normalized)
+#   oe:       Observed counts over the expected counts for their distance
+#   expected: The expected counts for each record's distance
+#
+MATRIX_TYPES = [ 'observed', 'oe', 'expected' ]
+
+#
+# Ways of binning contact counts into bond types, for count-weighted
+# contact bonds (see contact_bond_types in the lammps module)
+#   log:      Bins of equal width in log(count)
+#   linear:   Bins of equal width in count
+#   quantile: Bins with (roughly) equal numbers of contacts
+#
+BOND_MAPPINGS = [ 'log', 'linear', 'quantile' ]
+
+#
+# Compressions for text (csv and tsv) output files, mapped to the extension
+# they add to the file name
+#   none: Plain text
+#   gzip: gzip (written as a series of independently compressed members,
+#         which gzip readers read as a single stream)
+#   zstd: Zstandard (needs the optional 'zstandard' package)
+#
+TEXT_COMPRESSIONS = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
@@ -1,11 +1,15 @@
 from io import BufferedReader
 from pathlib import Path
 import struct
+import threading
+import typing as T
 
 import numpy as np
-from hicstraw import straw
 
 from .types import ContactRecordSettings, ContactRecords
+from .metrics import stage
+from .formats import NORMALIZATIONS, MATRIX_TYPES
+from .contacts import select_contacts
 
 """
 Module for dealing with Hi-C data files
@@ -20,7 +24,7 @@ def _readcstr(f):
         b = f.read(1)
         if b is None or b == b"\0":
             return buf.decode("utf-8")
-        elif b == "":
+        elif b == b"":
             raise EOFError("Buffer unexpectedly empty while trying to read null-terminated string")
         else:
             buf += b
@@ -28,6 +32,25 @@ def _readcstr(f):
 class HICError(Exception):
     pass
 
+def records_to_table(records, resolution: int) -> np.ndarray:
+    """
+    Convert a list of contact records from hic-straw into a numpy table,
+    with each row indexed by [binX, binY, counts]. Bin positions are
+    converted into units of resolution (i.e. particle numbers, from 1)
+    """
+    table = np.zeros((len(records), 3))
+    table[:, 0] = np.fromiter( (c.binX for c in records), dtype=np.float64, count=len(records) )
+    table[:, 1] = np.fromiter( (c.binY for c in records), dtype=np.float64, count=len(records) )
+    table[:, 2] = np.fromiter( (c.counts for c in records), dtype=np.float64, count=len(records) )
+
+    # Convert coordinates to units of resolution. i.e. particle numbers
+    table[:, 0] //= resolution
+    table[:, 1] //= resolution
+    table[:, 0] += 1
+    table[:, 1] += 1
+
+    return table
+
 class HICMetadata:
     """
     Represents the Metadata of a Hi-C File
@@ -61,12 +84,7 @@ class HICMetadata:
         self.master_index = struct.unpack('<q',f.read(8))[0]
 
         # Read Genome
-        genome = ""
-        c=f.read(1).decode("utf-8") 
-        while (c != '\0'):
-            genome += c
-            c=f.read(1).decode("utf-8") 
-        self.genome_id=genome
+        self.genome_id = _readcstr(f)
 
         # Read NVI
         if (self.version > 8):
@@ -111,6 +129,112 @@ class HICMetadata:
             res = struct.unpack('<i',f.read(4))[0]
             self.fragment_resolutions.append(res)
 
+    def to_dict(self) -> dict:
+        """
+        The metadata as a JSON-serializable dict
+        """
+        return {
+            'version': self.version,
+            'genome': self.genome_id,
+            'chromosomes': dict(self.chromosomes),
+            'resolutions': list(self.basepair_resolutions),
+            'fragment_resolutions': list(self.fragment_resolutions),
+            'attributes': dict(self.attributes),
+        }
+
+def read_metadata(file: Path) -> HICMetadata:
+    """
+    Read the metadata from the header of a Hi-C file. Only the header
+    is read, none of the contact data.
+    """
+    with stage('hic.metadata'), open(file, 'rb') as f:
+        try:
+            return HICMetadata(f)
+        except (struct.error, EOFError, UnicodeDecodeError) as e:
+            raise HICError(f"Couldn't read metadata (the file may be truncated or corrupt): {e}")
+
+class HICFooter:
+    """
+    Represents the index at the end of a Hi-C file (the "footer"), which
+    lists the contact matrices in the file, and the normalization vectors
+    and expected values available for them.
+    """
+
+    def __init__(self, f: BufferedReader, metadata: HICMetadata):
+        """
+        Load the footer index from the given filehandle, following the
+        layout read by hic-straw's readFooter. The vectors themselves
+        are skipped over, only their index entries are kept.
+        """
+        v9 = metadata.version > 8
+        f.seek(metadata.master_index)
+        f.read(8 if v9 else 4) # Size of the footer, in bytes
+
+        # Matrices, keyed by 'chr1index_chr2index'
+        nEntries = struct.unpack('<i',f.read(4))[0]
+        self.matrices = set()
+        for _ in range(0, nEntries):
+            self.matrices.add( _readcstr(f) )
+            f.read(12) # Position and size
+
+        value_size = 4 if v9 else 8
+
+        def skip_expected():
+            nValues = struct.unpack('<q' if v9 else '<i', f.read(8 if v9 else 4))[0]
+            f.seek(nValues * value_size, 1)
+            nFactors = struct.unpack('<i',f.read(4))[0]
+            f.seek(nFactors * (4 + value_size), 1)
+
+        # Expected values, as (normalization, unit, resolution). The
+        # unnormalized ones come first, then the normalized ones
+        self.expected = set()
+        nExpected = struct.unpack('<i',f.read(4))[0]
+        for _ in range(0, nExpected):
+            unit = _readcstr(f)
+            res = struct.unpack('<i',f.read(4))[0]
+            skip_expected()
+            self.expected.add( ('NONE', unit, res) )
+
+        nExpected = struct.unpack('<i',f.read(4))[0]
+        for _ in range(0, nExpected):
+            norm = _readcstr(f)
+            unit = _readcstr(f)
+            res = struct.unpack('<i',f.read(4))[0]
+            skip_expected()
+            self.expected.add( (norm, unit, res) )
+
+        # Normalization vectors, as (normalization, chromosome index, unit, resolution)
+        self.normalizations = set()
+        nEntries = struct.unpack('<i',f.read(4))[0]
+        for _ in range(0, nEntries):
+            norm = _readcstr(f)
+            chr_index = struct.unpack('<i',f.read(4))[0]
+            unit = _readcstr(f)
+            res = struct.unpack('<i',f.read(4))[0]
+            f.read(16 if v9 else 12) # Position and size
+            self.normalizations.add( (norm, chr_index, unit, res) )
+
+    def available_normalizations(self, chr_index: int, resolution: int, unit: str='BP') -> T.List[str]:
+        """
+        The normalizations with vectors for the given chromosome
+        (by index) at the given resolution
+        """
+        return [ 'NONE' ] + sorted(
+            norm for (norm, c, u, r) in self.normalizations
+            if c == chr_index and u == unit and r == resolution
+        )
+
+def read_footer(file: Path, metadata: HICMetadata) -> HICFooter:
+    """
+    Read the footer index of a Hi-C file, whose header has
+    already been read into 'metadata'
+    """
+    with open(file, 'rb') as f:
+        try:
+            return HICFooter(f, metadata)
+        except (struct.error, EOFError, UnicodeDecodeError) as e:
+            raise HICError(f"Couldn't read the footer (the file may be truncated or corrupt): {e}")
+
 class HIC:
     """
     Represents a Hi-C File
@@ -127,21 +251,49 @@ class HIC:
 
         self.path = file.resolve()
 
-        with open(file, 'rb') as f:
-            self.metadata = HICMetadata(f)
+        self.metadata = read_metadata(file)
 
-    def get_contact_records(self, settings: ContactRecordSettings) -> ContactRecords:
-        '''
-        Use hic-straw to load a series of Contact Records from the
-        Hi-C file according to the given settings.
-        '''
-        chr = settings['chromosome']
-        res = settings['resolution']
-        thr = settings['count_threshold']
+        # Read when first needed (see _table)
+        self._footer: T.Optional[HICFooter] = None
+        self._straw = None
+        # Unfiltered tables of records, keyed by (matrix type,
+        # normalization, chromosome, second chromosome, resolution)
+        self._tables: T.Dict[tuple, np.ndarray] = {}
+        self._lock = threading.Lock()
 
-        # Load records via hic-straw
+    @property
+    def footer(self) -> HICFooter:
+        if self._footer is None:
+            self._footer = read_footer(self.path, self.metadata)
+        return self._footer
+
+    def clear_cache(self):
+        """
+        Drop the contact records kept from earlier calls to
+        get_contact_records
+        """
+        with self._lock:
+            self._tables.clear()
+
+    def _check(self, chr: str, res: int, norm: str, matrix_type: str, chr2: str=None) -> int:
+        """
+        Check that records of the given type can be read for the given
+        chromosome and resolution. Returns the chromosome's index.
+
+        With 'chr2', records between the two (different) chromosomes are
+        checked instead, which can only be read as observed counts.
+        """
+        if chr2 is not None:
+            if matrix_type != 'observed':
+                raise HICError(
+                    f"Only observed records can be read between chromosomes, not '{matrix_type}'"
+                )
+            index = self._check(chr, res, norm, matrix_type)
+            index2 = self._check(chr2, res, norm, matrix_type)
+            if f"{index}_{index2}" not in self.footer.matrices:
+                raise HICError(f"The file has no contact matrix for chromosomes '{chr}' and '{chr2}'")
+            return index
 
-        # Check that chromosome and resolution are valid
         if chr not in self.metadata.chromosomes:
             allowed = list( self.metadata.chromosomes.keys() )
             raise HICError(
@@ -156,43 +308,238 @@ class HIC:
                 f"Available resolutions are: {allowed}"
             )
 
-        # hic-straw exits itself on error, so we try to
+        if matrix_type not in MATRIX_TYPES:
+            raise HICError(
+                f"Unknown matrix type '{matrix_type}'. "
+                f"Available types are: {MATRIX_TYPES}"
+            )
+
+        if norm not in NORMALIZATIONS:
+            raise HICError(
+                f"Unknown normalization '{norm}'. "
+                f"Available normalizations are: {NORMALIZATIONS}"
+            )
+
+        # Chromosomes are indexed in the order they're listed in the header
+        index = list( self.metadata.chromosomes.keys() ).index(chr)
+
+        # hic-straw doesn't check for these itself (a missing normalization
+        # vector can crash it), so they're checked in the footer first
+        if f"{index}_{index}" not in self.footer.matrices:
+            raise HICError(f"The file has no contact matrix for chromosome '{chr}'")
+
+        available = self.footer.available_normalizations(index, res)
+        if norm not in available:
+            raise HICError(
+                f"Normalization '{norm}' is not available for chromosome '{chr}'"
+                f" at resolution {res}. Available normalizations are: {available}"
+            )
+
+        if matrix_type != 'observed' and (norm, 'BP', res) not in self.footer.expected:
+            raise HICError(
+                f"The file has no expected values for normalization '{norm}'"
+                f" at resolution {res}, so the '{matrix_type}' matrix type"
+                " can't be used"
+            )
+
+        return index
+
+    def _zoom_data(self, chr: str, res: int, norm: str, matrix_type: str, chr2: str=None):
+        """
+        Get hic-straw's MatrixZoomData for a chromosome (or between 'chr'
+        and 'chr2'). Creating it reads the block index, normalization vector
+        and expected values for the chromosome, but doesn't decode any
+        records.
+        """
+        # hic-straw is only needed here, so it's imported here
+        # (reading metadata doesn't need it)
+        from hicstraw import HiCFile
+
+        # hic-straw exits itself on some errors, so we try to
         # catch it with a try/except
         try:
-            # Run hic-straw
-            records = straw(
-                'observed',
-                'KR',
-                str(self.path),
-                chr,
-                chr,
-                'BP',
-                res
+            if self._straw is None:
+                self._straw = HiCFile( str(self.path) )
+            return self._straw.getMatrixZoomData(chr, chr2 or chr, matrix_type, norm, 'BP', res)
+        except SystemExit:
+            raise HICError("Failed to load contact records")
+
+    def _table(self, chr: str, res: int, norm: str, matrix_type: str, chr2: str=None) -> np.ndarray:
+        """
+        Get an unfiltered table of records (see records_to_table) of the
+        given type. Tables are kept, so each type is only read once.
+
+        Only the observed, unnormalized records are decoded from the file.
+        Other types are computed from them, using the normalization vector
+        and expected values for the chromosome, in the same way hic-straw
+        computes them.
+
+        With 'chr2' (which must come after 'chr' in the file), the records
+        between the two chromosomes are read, with 'chr' bins as x and
+        'chr2' bins as y.
+        """
+        if chr2 == chr:
+            chr2 = None
+        key = ( matrix_type, norm, chr, chr2 or chr, res )
+        if key in self._tables:
+            return self._tables[key]
+
+        self._check(chr, res, norm, matrix_type, chr2)
+
+        if (matrix_type, norm) == ('observed', 'NONE'):
+            length = self.metadata.chromosomes[chr]
+            length2 = self.metadata.chromosomes[chr2 or chr]
+            zoom_data = self._zoom_data(chr, res, norm, matrix_type, chr2)
+            records = zoom_data.getRecords(0, length, 0, length2)
+            table = records_to_table(records, res)
+        else:
+            observed = self._table(chr, res, 'NONE', 'observed', chr2)
+            zoom_data = self._zoom_data(chr, res, norm, matrix_type, chr2)
+
+            # Bins, from 0
+            x = observed[:,0].astype(np.int64) - 1
+            y = observed[:,1].astype(np.int64) - 1
+            values = observed[:,2].astype(np.float32)
+
+            if norm != 'NONE':
+                vector = self._norm_vector(zoom_data, chr, norm)
+                vector2 = vector if chr2 is None else self._norm_vector(zoom_data, chr2, norm)
+                values = ( values / (vector[x] * vector2[y]) ).astype(np.float32)
+
+            if matrix_type != 'observed':
+                expected = np.asarray( zoom_data.getExpectedValues(), dtype=np.float64 )
+                distance = np.minimum( len(expected)-1, np.abs(y - x) )
+                if matrix_type == 'oe':
+                    values = ( values / expected[distance] ).astype(np.float32)
+                else:
+                    values = expected[distance].astype(np.float32)
+
+            table = np.column_stack( (observed[:,:2], values.astype(np.float64)) )
+            table = table[ np.isfinite(table[:,2]) ]
+
+        self._tables[key] = table
+        return table
+
+    def _norm_vector(self, zoom_data, chr: str, norm: str) -> np.ndarray:
+        """
+        Get the normalization vector for a chromosome through a
+        MatrixZoomData (which reads it for any chromosome in the file)
+        """
+        index = list( self.metadata.chromosomes.keys() ).index(chr)
+        vector = np.asarray( zoom_data.getNormVector(index), dtype=np.float64 )
+        if len(vector) == 0:
+            raise HICError(f"The '{norm}' normalization vector for chromosome '{chr}' is empty")
+        return vector
+
+    @stage('hic.records')
+    def get_contact_records(self, settings: ContactRecordSettings) -> ContactRecords:
+        '''
+        Load a series of Contact Records from the Hi-C file according
+        to the given settings. The 'normalization' and 'matrix_type'
+        settings default to 'KR' and 'observed'. After the count threshold,
+        records are selected with any of the limits in SELECTION_SETTINGS
+        that are set (see select_contacts).
+
+        Records are read with hic-straw the first time they're needed,
+        and kept in memory, so later calls for the same chromosome and
+        resolution (with any threshold, normalization or matrix type)
+        don't read the file again. Use clear_cache to drop them.
+        '''
+        chr = settings['chromosome']
+        res = settings['resolution']
+        norm = settings.get('normalization', 'KR')
+        matrix_type = settings.get('matrix_type', 'observed')
+
+        with self._lock:
+            table = self._table(chr, res, norm, matrix_type)
+
+        if len(table) == 0:
+            raise HICError(
+                f"No contact records found for chromosome '{chr}' at"
+                f" resolution {res} ({matrix_type}, {norm})"
             )
-            if not records:
-                raise ValueError("No contact records found.")
-        except SystemExit as e:
-            raise RuntimeError("Failed to load contact records")
-
-        # Convert to numpy table
-        # each row indexed by [binX, binY, counts]
-        table = np.zeros((len(records), 3))
-        index = 0 
-        for contact in records:
-            table[index][0] = int(contact.binX)
-            table[index][1] = int(contact.binY)
-            table[index][2] = contact.counts
-            index += 1
-
-        # Convert coordinates to units of resolution. i.e. particle numbers
-        table[:, 0] //= res
-        table[:, 1] //= res
-        table[:, 0] += 1
-        table[:, 1] += 1
-
-        # Filter by threshold
-        table = table[ table[:,2] > thr ]
-        # Filter out self-contacts
-        table = table[ table[:,0] != table[:,1] ]
-
-        return ContactRecords(table)
+
+        return _filter_table(table, settings)
+
+    def chain_lengths(self, chromosomes: T.Sequence[str], resolution: int) -> T.List[int]:
+        '''
+        The number of beads (i.e. bins) for each of the given chromosomes
+        at the given resolution
+        '''
+        for chr in chromosomes:
+            if chr not in self.metadata.chromosomes:
+                raise HICError(
+                    f"Chromosome '{chr}' is not available. "
+                    f"Available chromomesomes are: {list(self.metadata.chromosomes.keys())}"
+                )
+        return [ -(-self.metadata.chromosomes[chr] // resolution) for chr in chromosomes ]
+
+    @stage('hic.records')
+    def get_genome_contact_records(
+        self, settings: ContactRecordSettings
+    ) -> T.Tuple[ContactRecords, T.List[str], T.List[int]]:
+        '''
+        Load the records within and between all of the chromosomes in
+        settings['chromosomes'], for a whole-genome simulation with a chain
+        for each chromosome. Returns (records, chromosomes, lengths), where
+        'chromosomes' are the chromosomes in the order they're listed in the
+        file and 'lengths' is the number of beads for each (see
+        chain_lengths).
+
+        Beads are numbered across all of the chains: the beads for each
+        chromosome come after the beads for the chromosomes before it, so
+        bin 'i' of chromosome 'k' is bead sum(lengths[:k]) + i. Records in
+        bins past the end of their chromosome's chain are dropped.
+
+        Only observed records can be read between chromosomes, so the
+        'matrix_type' setting must be 'observed'. Otherwise, the settings
+        work as in get_contact_records (with the threshold and selection
+        applied to all of the records together, and separations between
+        chromosomes measured in bead numbers).
+        '''
+        res = settings['resolution']
+        norm = settings.get('normalization', 'KR')
+        matrix_type = settings.get('matrix_type', 'observed')
+
+        order = list( self.metadata.chromosomes.keys() )
+        chromosomes = sorted(
+            set(settings['chromosomes']),
+            key=lambda chr: order.index(chr) if chr in order else -1
+        )
+        lengths = self.chain_lengths(chromosomes, res)
+        offsets = np.concatenate( ([0], np.cumsum(lengths)[:-1]) )
+
+        tables = []
+        with self._lock:
+            for (i, chr) in enumerate(chromosomes):
+                for j in range(i, len(chromosomes)):
+                    table = self._table(chr, res, norm, matrix_type, chromosomes[j])
+                    # Hi-C files can have a bin starting at the end of a
+                    # chromosome (when its length is a multiple of the
+                    # resolution). Its beads would be past the end of the
+                    # chain, on the next chromosome's, so its records are dropped
+                    table = table[ (table[:,0] <= lengths[i]) & (table[:,1] <= lengths[j]) ]
+                    table[:,0] += offsets[i]
+                    table[:,1] += offsets[j]
+                    tables.append(table)
+
+        table = np.concatenate(tables) if tables else np.zeros( (0, 3) )
+        if len(table) == 0:
+            raise HICError(
+                f"No contact records found for chromosomes {chromosomes} at"
+                f" resolution {res} ({matrix_type}, {norm})"
+            )
+
+        return ( _filter_table(table, settings), chromosomes, lengths )
+
+def _filter_table(table: np.ndarray, settings: ContactRecordSettings) -> ContactRecords:
+    '''
+    Apply the count threshold, drop self-contacts and select records
+    (see select_contacts) from a table of records
+    '''
+    # Filter by threshold
+    table = table[ table[:,2] > settings['count_threshold'] ]
+    # Filter out self-contacts
+    table = table[ table[:,0] != table[:,1] ]
+
+    return select_contacts( ContactRecords(table), settings )
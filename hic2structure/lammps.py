@@ -5,91 +5,216 @@ That is, running it and reading/writing its input
 and ouput files.
 '''
 
+import logging
+import math
 import os
+import re
 import shutil
-import time
+import signal
+import struct
+import threading
 from pathlib import Path
 import subprocess as sub
 import tempfile as temp
-from contextlib import contextmanager
+from collections.abc import Mapping
 
 import textwrap
+import typing as T
 import numpy as np
 
-from .types import LAMMPSSettings, ContactSet, LAMMPSTimeseries, LAMMPSTimestep
+from .types import (
+    LAMMPSSettings, ContactSet, LAMMPSTimeseries, LAMMPSTimestep,
+    CompactTimestep, AnyTimestep, timestep_columns
+)
+from .trajectory import TrajectoryWriter, TrajectoryReader
+from .contactmap import ContactMap
+from .contacts import diff_contact_sets
+from .formats import BOND_MAPPINGS, STRUCTURE_FORMATS
+from .out import read_structure, is_trajectory, iter_trajectory
+from .textio import write_rows
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+class LAMMPSError(Exception):
+    pass
+
+class LAMMPSCancelled(LAMMPSError):
+    '''
+    Raised when a simulation is stopped through run_lammps's 'cancel' event
+    '''
+    pass
 
 ########################
 # HELPER FUNCTIONS
 ########################
 
-# function to check if next site is already occupied
-def check_if_free(lattice_coords, next_coords, index):
-    for i in range(index):
-        if lattice_coords[i][0] == next_coords[0] and lattice_coords[i][1] == next_coords[1] \
-                and lattice_coords[i][2] == next_coords[2]:
-            return False
-    return True
+# Spacing of the lattice used for initial conformations
+LATTICE_SPACING = 3.0
+
+# Dimensions of the (periodic) simulation box, centred on the origin
+BOX_DIMENSIONS = np.array([400.0, 400.0, 400.0])
+
+# Volume of the box per bead, for systems too big for BOX_DIMENSIONS at
+# this density (e.g. whole genomes, see box_dimensions)
+BOX_VOLUME_PER_BEAD = 1000.0
+
+def box_dimensions(num_beads: int) -> np.ndarray:
+    """
+    The dimensions of the simulation box for a system of 'num_beads' beads:
+    BOX_DIMENSIONS, or a cube with BOX_VOLUME_PER_BEAD of volume for each
+    bead if that's bigger. Since this only depends on the number of beads,
+    the box for a structure can always be worked out again from it.
+    """
+    side = ( num_beads * BOX_VOLUME_PER_BEAD ) ** (1/3)
+    return np.maximum( BOX_DIMENSIONS, side )
+
+def seed_streams(seed: T.Optional[int]) -> T.Tuple[np.random.Generator, int]:
+    """
+    Derive independent random streams from a single seed: a Generator for
+    the initial random walk, and the seed for LAMMPS's Langevin thermostat.
+    A seed of None uses fresh entropy from the OS.
+    """
+    (walk, langevin) = np.random.SeedSequence(seed).spawn(2)
+    return (
+        np.random.default_rng(walk),
+        int( np.random.default_rng(langevin).integers(1, 1000000) )
+    )
+
+def replica_seeds(seed: T.Optional[int], count: int) -> T.List[int]:
+    """
+    Derive seeds for 'count' independent replicas of a simulation from a
+    single seed. The same seed always gives the same replica seeds.
+    """
+    children = np.random.SeedSequence(seed).spawn(count)
+    return [ int(child.generate_state(1, np.uint64)[0]) for child in children ]
 
 # function to create random 3D walk on lattice
-def random_walk(n):
+def random_walk(n, rng: np.random.Generator=None):
+    if rng is None:
+        rng = np.random.default_rng()
+
     backtrack = 10
     lattice_coords = np.zeros([n, 3])
     steps = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0],
                       [-1.0, 0.0, 0.0], [0.0, -1.0, 0.0], [0.0, 0.0, -1.0]])
+    occupied = { (0.0, 0.0, 0.0) }
     i = 1
     while i < n:
-        issue = False
-        s = time.time()
-        #if i % 100 == 0:
-            #print(i, s-start, 's')
-        rand = np.random.randint(0, 6)
-        next_coords = lattice_coords[i - 1] + steps[rand]
-        while check_if_free(lattice_coords, next_coords, i) == False:
-            rand = np.random.randint(0, 6)
-            next_coords = lattice_coords[i-1] + steps[rand]
-            e = time.time()
-            if e - s > 0.1:
-                issue = True
-                #print('Stuck! Go back and find a new way... %s' % i)
-                for k in range(1, backtrack + 1):
-                    lattice_coords[i-k] = np.zeros(3)
-                i -= backtrack + 1
-                break
-        if issue == False:
-            lattice_coords[i] = next_coords
-            i += 1
+        candidates = lattice_coords[i - 1] + steps
+        free = [ c for c in candidates if tuple(c) not in occupied ]
+        if not free:
+            # Stuck! Go back and find a new way
+            k = min(backtrack, i - 1)
+            for j in range(i - k, i):
+                occupied.discard( tuple(lattice_coords[j]) )
+                lattice_coords[j] = np.zeros(3)
+            i -= k
+            continue
+
+        next_coords = free[ rng.integers(0, len(free)) ]
+        lattice_coords[i] = next_coords
+        occupied.add( tuple(next_coords) )
+        i += 1
     return lattice_coords
 
 # function to create molecule tags
 def create_molecule_tags(n, lengths):
-    tags = []
-    tag = 1
+    # Each bead's tag is one more than the number of chains ending before it
     cumlength = np.cumsum(lengths)
-    for i in range(1, n+1):
-        if i - 1 in cumlength:
-            tag += 1
-        tags.append(tag)
-
-    return tags
+    return ( 1 + np.searchsorted(cumlength, np.arange(n), side='right') ).tolist()
 
 # function to create bonds
 def create_bonds(n, lengths):
-    bonds = []
-    cumlength = np.cumsum(lengths)
-    for i in range(1, n):
-        if i not in cumlength:
-            bonds.append([i, i+1])
-    return bonds
+    first = np.arange(1, max(n, 1))
+    first = first[ ~np.isin(first, np.cumsum(lengths)) ]
+    return np.column_stack( (first, first + 1) ).tolist()
 
 
 # function to create angles
 def create_angles(n, lengths):
-    angles = []
     cumlength = np.cumsum(lengths)
-    for i in range(1, n-1):
-        if (i not in cumlength) and (i+1 not in cumlength):
-            angles.append([i, i + 1, i + 2])
-    return angles
+    first = np.arange(1, max(n-1, 1))
+    first = first[ ~np.isin(first, cumlength) & ~np.isin(first + 1, cumlength) ]
+    return np.column_stack( (first, first + 1, first + 2) ).tolist()
+
+########################
+# CONTACT BONDS
+########################
+
+# Stiffness (harmonic K) of binary contact bonds
+CONTACT_BOND_STIFFNESS = 1.0
+
+# Stiffness of the weakest and strongest contact bond types, when
+# contacts are binned by their counts
+CONTACT_BOND_STIFFNESS_RANGE = (0.5, 2.0)
+
+# Rest length of contact bonds
+CONTACT_BOND_LENGTH = 2.2
+
+def contact_bond_types(
+    counts: np.ndarray, bins: int, mapping: str='log',
+    stiffness: T.Tuple[float, float]=CONTACT_BOND_STIFFNESS_RANGE
+) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    Bin contacts by their counts, to give stronger contacts stiffer bonds.
+    'mapping' selects how the bins are placed (see BOND_MAPPINGS), and the
+    bins' stiffnesses are spread evenly over the 'stiffness' range, from
+    the lowest counts to the highest.
+
+    Returns a (bin, stiffness) tuple: the bin of each contact (from 0) and
+    the stiffness of each bin.
+    """
+    if mapping not in BOND_MAPPINGS:
+        raise ValueError(f"Unknown bond mapping '{mapping}'. Available mappings are: {BOND_MAPPINGS}")
+    if bins < 1:
+        raise ValueError("There must be at least one bond bin")
+
+    counts = np.asarray(counts, dtype=np.float64)
+    coeffs = np.linspace(stiffness[0], stiffness[1], bins)
+    if len(counts) == 0 or bins == 1:
+        return ( np.zeros(len(counts), dtype=np.int64), coeffs )
+
+    if mapping == 'quantile':
+        edges = np.quantile( counts, np.linspace(0, 1, bins+1) )
+        values = counts
+    else:
+        values = counts
+        if mapping == 'log':
+            # Counts that can't be logged go in the lowest bin
+            positive = counts[counts > 0]
+            floor = positive.min() if len(positive) else 1.0
+            values = np.log( np.maximum(counts, floor) )
+        edges = np.linspace( values.min(), values.max(), bins+1 )
+
+    types = np.digitize( values, edges[1:-1], right=mapping == 'quantile' )
+    return ( types.astype(np.int64), coeffs )
+
+def contact_bonds(
+    records: ContactMap, settings: LAMMPSSettings
+) -> T.Tuple[ContactSet, np.ndarray, T.List[float]]:
+    """
+    Get the contact bonds for a simulation. With settings['bond_bins']
+    above 1, contacts are binned by count (see contact_bond_types), which
+    needs a contact map with counts.
+
+    Returns (contacts, types, stiffness): the pairs of beads to bond, the
+    bond type of each (from 0, not counting the chain bonds) and the
+    stiffness of each type.
+    """
+    bins = settings.get('bond_bins') or 0
+    if bins <= 1:
+        return ( records.to_set(), np.zeros(len(records), dtype=np.int64), [CONTACT_BOND_STIFFNESS] )
+
+    if records.counts is None:
+        raise LAMMPSError(
+            "Count-weighted contact bonds need contact counts. Pass a"
+            " ContactMap made with ContactMap.from_records"
+        )
+    (types, stiffness) = contact_bond_types(
+        records.counts, bins, settings.get('bond_mapping') or 'log'
+    )
+    return ( records.to_set(), types, list(stiffness) )
 
 ########################
 # FILE I/O
@@ -97,14 +222,24 @@ def create_angles(n, lengths):
 
 def write_inputfile(
     path: Path, datafile_name: str,
-    num_segments: int, settings: LAMMPSSettings,
-    records: ContactSet  
+    num_segments: int, settings: LAMMPSSettings, *,
+    contact_stiffness: T.Sequence[float]=(CONTACT_BOND_STIFFNESS,),
+    pre_relax: bool=False, langevin_seed: int=None
 ):
     """
-    Write a LAMMPS input file to the given path
+    Write a LAMMPS input file to the given path. The contact bonds are
+    read from the data file (see write_datafile), and 'contact_stiffness'
+    gives the stiffness of each type of contact bond.
+
+    If 'pre_relax' is True, the initial conformation is relaxed with an
+    energy minimization (with the contact bonds in place) before the
+    simulation starts. 'langevin_seed' seeds the thermostat's random noise
+    (a random seed is used if it isn't given).
     """
     with open(path, 'w') as f:
-        lang = np.random.randint(1,1000000) # random noise term for langevin
+        if langevin_seed is None:
+            langevin_seed = seed_streams(None)[1]
+        lang = langevin_seed # random noise term for langevin
 
         f.write(textwrap.dedent(f'''\
             log sim.log
@@ -127,9 +262,6 @@ def write_inputfile(
 
             group all type 1
 
-            dump   1   all   custom   1000   sim.dump  id  x y z  ix iy iz
-            dump_modify   1   format line "%d %.5f %.5f %.5f %d %d %d"
-
             angle_style   cosine
             angle_coeff   1 0.0
 
@@ -138,9 +270,24 @@ def write_inputfile(
             pair_coeff      * * 1.0 1.0
 
             bond_style hybrid harmonic fene
-            bond_coeff 1 fene 30.0 {settings['bond_coeff']} 1.0 1.0
-            bond_coeff 2 harmonic  1.0 2.2
+            bond_coeff 1 fene {FENE_STIFFNESS} {settings['bond_coeff']} 1.0 1.0
+            '''
+        ))
+
+        for (i, k) in enumerate(contact_stiffness):
+            f.write(f'bond_coeff {i + 2} harmonic  {k} {CONTACT_BOND_LENGTH}\n')
+
+        # Atoms are only found across the box's periodic boundaries within
+        # the communication cutoff, which is just the pair cutoff and skin by
+        # default. A longer FENE bond across a boundary would be measured to
+        # the wrong image of its other atom (and fail as a "Bad FENE bond"
+        # whatever its coefficient), so the cutoff covers their full length.
+        # This is set on every run, since with the default coefficient most
+        # runs fail without it. Where a run passes either way (10,000 beads
+        # with 200 contacts), the extra ghost atoms cost about 4% of its time
+        f.write(textwrap.dedent(f'''\
             special_bonds fene
+            comm_modify cutoff {settings['bond_coeff']}
 
             fix 1 all nve
             fix 2 all langevin   1.0 1.0   1.0   {lang}
@@ -150,12 +297,20 @@ def write_inputfile(
             '''
         ))
 
-        for r in records:
-            f.write(
-                f'create_bonds single/bond 2 {int(r[0])} {int(r[1])} special yes\n'
-            )
+        if pre_relax:
+            f.write(textwrap.dedent('''\
+                minimize 1.0e-4 1.0e-6 1000 10000
+                reset_timestep 0
+                '''
+            ))
 
+        # The dump is only defined now, so a minimization doesn't write
+        # frames (which would share timesteps with the run's frames once
+        # the timestep is reset)
         f.write(textwrap.dedent(f'''\
+            dump   1   all   custom   1000   sim.dump  id  x y z  ix iy iz
+            dump_modify   1   format line "%d %.5f %.5f %.5f %d %d %d"
+
             thermo_style   custom   step  temp  etotal epair  emol  press pxx pyy pzz lx ly lz pe ke ebond evdwl
 
             timestep 0.00001
@@ -165,13 +320,27 @@ def write_inputfile(
 def write_datafile(
     path: Path, num_segments: int,
     lengths: list[int], spacing: float,
-    dimensions
+    dimensions, coords: np.ndarray=None,
+    rng: np.random.Generator=None,
+    contacts: ContactSet=None, contact_types: np.ndarray=None,
+    contact_type_count: int=1
 ):
     """
-    Write a LAMMPS data file to the given path
+    Write a LAMMPS data file to the given path. If 'coords' isn't given,
+    the initial coordinates are a random walk on a lattice with
+    the given spacing (generated with 'rng', if given).
+
+    'contacts' are written as bonds after the chain bonds, with
+    'contact_types' giving the type of each (from 0, out of
+    'contact_type_count' types). They all have the first type if
+    'contact_types' isn't given.
     """
     chains = int(len(lengths))  # number of chains
-    bond_number = int(sum(lengths) - chains) # number of bonds
+    contacts = np.zeros( (0, 2), dtype=np.int64 ) if contacts is None \
+        else np.asarray(contacts, dtype=np.int64).reshape( (-1, 2) )
+    if contact_types is None:
+        contact_types = np.zeros(len(contacts), dtype=np.int64)
+    bond_number = int(sum(lengths) - chains) + len(contacts) # number of bonds
 
     angle_number = 0
     length = 0
@@ -180,7 +349,10 @@ def write_datafile(
             angle_number += int(l - 2)  # number of bond angles
         length = l
 
-    lattice_coords = random_walk(num_segments) * spacing  # coordinates of lattice points
+    if coords is None:
+        lattice_coords = random_walk(num_segments, rng) * spacing  # coordinates of lattice points
+    else:
+        lattice_coords = coords[:num_segments]
     tags = create_molecule_tags(num_segments, lengths)  # molecule tags
     bonds = create_bonds(num_segments, lengths)  # indicates bonds between particles
     angles = create_angles(num_segments, lengths)  # indicates angles between particles
@@ -192,8 +364,7 @@ def write_datafile(
             {num_segments} atoms
             1 atom types
             {bond_number} bonds
-            2 bond types
-            1000 extra bond per atom
+            {1 + contact_type_count} bond types
             {angle_number} angles
             1 angle types
 
@@ -209,29 +380,77 @@ def write_datafile(
             '''
         ))
 
-        for i in range(num_segments):
-            f.write(f'\n{i + 1}\t{tags[i]}\t1\t{lattice_coords[i][0]}\t{lattice_coords[i][1]}\t{lattice_coords[i][2]}\t0\t0\t0')
+        f.write('\n')
+        lattice_coords = np.asarray(lattice_coords, dtype=np.float64)
+        write_rows(
+            f, '%d\t%d\t1\t%r\t%r\t%r\t0\t0\t0',
+            np.arange(1, num_segments + 1), np.asarray(tags, dtype=np.int64),
+            lattice_coords[:,0], lattice_coords[:,1], lattice_coords[:,2]
+        )
         if bond_number > 0:
-            f.write('\n\nBonds\n')
-            for i in range(len(bonds)):
-                f.write(f'\n{i + 1}\t1\t{bonds[i][0]}\t{bonds[i][1]}')
+            f.write('\nBonds\n\n')
+            bonds = np.array(bonds, dtype=np.int64).reshape( (-1, 2) )
+            write_rows(
+                f, '%d\t%d\t%d\t%d',
+                np.arange(1, bond_number + 1),
+                np.concatenate(( np.ones(len(bonds), dtype=np.int64), contact_types + 2 )),
+                np.concatenate(( bonds[:,0], contacts[:,0] )),
+                np.concatenate(( bonds[:,1], contacts[:,1] ))
+            )
         if angle_number > 0:
-            f.write('\n\nAngles\n')
-            for i in range(len(angles)):
-                f.write(f'\n{i + 1}\t1\t{angles[i][0]}\t{angles[i][1]}\t{angles[i][2]}')
+            f.write('\nAngles\n\n')
+            angles = np.array(angles, dtype=np.int64).reshape( (-1, 3) )
+            write_rows(
+                f, '%d\t1\t%d\t%d\t%d',
+                np.arange(1, len(angles) + 1), angles[:,0], angles[:,1], angles[:,2]
+            )
+
+def initial_conformation(n: int, rng: np.random.Generator=None) -> np.ndarray:
+    """
+    Generate initial coordinates for a chain of 'n' beads: a random walk
+    on a lattice, scaled to the lattice spacing used in the input deck.
+    The first 'k' rows of the result are a valid conformation for a chain
+    of 'k' beads, so one conformation can be shared by smaller chains.
 
-def write_input_deck(dir: Path, settings: LAMMPSSettings, records: ContactSet):
+    Pass the walk Generator from seed_streams as 'rng' to get the same
+    conformation a seeded simulation would start from.
+    """
+    return random_walk(n, rng) * LATTICE_SPACING
+
+def write_input_deck(
+    dir: Path, settings: LAMMPSSettings,
+    records: T.Union[ContactSet, ContactMap],
+    coords: np.ndarray=None, pre_relax: bool=False,
+    lengths: T.Sequence[int]=None
+):
     """
     Write a LAMMPS input file and data file into the given
-    directory for a simulation on the given contact records
+    directory for a simulation on the given contact records.
+    Initial coordinates can be given with 'coords' (which must
+    have at least as many rows as there are beads)
+
+    The beads form a single chain, unless 'lengths' gives the length of
+    each of several chains (e.g. one per chromosome, see
+    get_genome_contact_records), with beads numbered across all of them.
+    The box is sized for the number of beads (see box_dimensions).
+
+    The random walk and the Langevin thermostat are seeded from
+    settings['seed'] (see seed_streams).
     """
+    if not isinstance(records, ContactMap):
+        records = ContactMap.from_set(records)
 
     # Defining LAMMPS properties
-    n = int(max(records.max(axis = 0)[0], records.max(axis = 0)[1]))  # total number of particles
-    lengths = [n]  # length of chains
-    spacing = 3.0  # lattice spacing
-    lattice_numbers = np.array([200, 200, 200])
-    dimensions = lattice_numbers * 2  # dimensions of box
+    if lengths is None:
+        n = records.num_beads  # total number of particles
+        lengths = [n]  # length of chains
+    else:
+        lengths = [ int(l) for l in lengths ]
+        n = sum(lengths)
+        if n < records.num_beads:
+            raise LAMMPSError(f"Contacts are for {records.num_beads} beads, but the chains only have {n}")
+    spacing = LATTICE_SPACING  # lattice spacing
+    dimensions = box_dimensions(n)  # dimensions of box
 
     datafile_name=f"random_coil_N{n}.dat"
 
@@ -240,104 +459,663 @@ def write_input_deck(dir: Path, settings: LAMMPSSettings, records: ContactSet):
     datafile  = dir / datafile_name
 
     # Create files
-    write_datafile(datafile, n, lengths, spacing, dimensions)
-    write_inputfile(inputfile, datafile_name, n, settings, records)
+    if coords is not None and len(coords) < n:
+        raise LAMMPSError(f"Initial coordinates are for {len(coords)} beads, but {n} are needed")
+    (walk_rng, langevin_seed) = seed_streams( settings.get('seed') )
+    (contacts, types, stiffness) = contact_bonds(records, settings)
+    write_datafile(
+        datafile, n, lengths, spacing, dimensions, coords, walk_rng,
+        contacts, types, len(stiffness)
+    )
+    write_inputfile(
+        inputfile, datafile_name, n, settings, contact_stiffness=stiffness,
+        pre_relax=pre_relax, langevin_seed=langevin_seed
+    )
 
-def read_dumpfile(path: Path) -> LAMMPSTimeseries:
+def set_bond_coeff(path: Path, bond_coeff: float):
     """
-    Read in a LAMMPS output dump
+    Change the FENE bond coefficient in an existing LAMMPS input file
+    (written by write_inputfile), along with the communication cutoff
+    that covers the bonds' length
     """
-    f = open(path, 'r')
-    lines = list(map(
-        str.strip,
-        f.read().splitlines()
-    ))
-    f.close()
+    with open(path, 'r') as f:
+        text = f.read()
+    text = re.sub(
+        r'^(bond_coeff 1 fene \S+ )\S+', rf'\g<1>{bond_coeff}',
+        text, count=1, flags=re.MULTILINE
+    )
+    text = re.sub(
+        r'^(comm_modify cutoff )\S+', rf'\g<1>{bond_coeff}',
+        text, count=1, flags=re.MULTILINE
+    )
+    with open(path, 'w') as f:
+        f.write(text)
 
-    dump: LAMMPSTimeseries = {}
-    i = 0
-    # finds coordinates using "ITEM:" directives
-    # creates a dict with timestep and coordinates
-    while i < len(lines):
-        timestep_line = lines.index("ITEM: TIMESTEP", i) + 1
-        timestep = int(lines[timestep_line])
-
-        # Get the slice of coordinate lines between the start
-        # of this timestep and the next
-        begin_line = lines.index("ITEM: ATOMS id x y z ix iy iz", i)
-        try:
-            end_line = lines.index("ITEM: TIMESTEP", i+1)
-        except ValueError:
-            end_line = len(lines)
-        coords = lines[begin_line+1:end_line]
-
-        # Parse coordinates
-        data = np.zeros( (len(coords), 7 ))
-        for (j, line) in enumerate(coords):
-            vals = line.split()
-            data[j][0] = int(   vals[0] )
-            data[j][1] = float( vals[1] )
-            data[j][2] = float( vals[2] )
-            data[j][3] = float( vals[3] )
-            data[j][4] = float( vals[4] )
-            data[j][5] = float( vals[5] )
-            data[j][6] = float( vals[6] )
-        
-        dump[timestep] = LAMMPSTimestep(data)
-        i = end_line
+def iter_dumpfile(path: Path) -> T.Iterator[T.Tuple[int, LAMMPSTimestep]]:
+    """
+    Read in a LAMMPS output dump one timestep at a time, yielding
+    (timestep, data) pairs. Only one timestep is held in memory at once.
+    Raises LAMMPSError if the dump ends part of the way through a timestep.
+    """
+    with open(path, 'r') as f:
+        timestep = None
+        num_atoms = None
+
+        def next_line() -> str:
+            line = f.readline()
+            if not line:
+                raise LAMMPSError(f"Truncated dump file '{path}' (timestep {timestep})")
+            return line
 
+        # finds coordinates using "ITEM:" directives
+        for line in f:
+            line = line.strip()
+            if line == "ITEM: TIMESTEP":
+                timestep = int(next_line())
+            elif line == "ITEM: NUMBER OF ATOMS":
+                num_atoms = int(next_line())
+            elif line.startswith("ITEM: ATOMS"):
+                if line != "ITEM: ATOMS id x y z ix iy iz":
+                    raise LAMMPSError(f"Unexpected columns in dump file: '{line}'")
+
+                # Parse the whole block of coordinates at once
+                coords = [ next_line() for _ in range(num_atoms) ]
+                data = np.array( ' '.join(coords).split(), dtype=np.float64 )
+                if len(data) != num_atoms * 7:
+                    raise LAMMPSError(f"Truncated dump file '{path}' (timestep {timestep})")
+                yield ( timestep, LAMMPSTimestep(data.reshape( (num_atoms, 7) )) )
+
+def iter_frames(path: Path) -> T.Iterator[T.Tuple[int, np.ndarray]]:
+    """
+    Read structures from a file one at a time, yielding (timestep, data)
+    pairs. The file can be a LAMMPS dump, a trajectory file (see the
+    trajectory module), a .npy/.npz trajectory (see iter_trajectory) or a
+    structure file (see read_structure, which gives a single frame, with
+    timestep 0 and only the id, x, y, z columns).
+    """
+    path = Path(path)
+    if path.suffix == '.h2t':
+        with TrajectoryReader(path) as reader:
+            for timestep in sorted(reader.keys()):
+                yield ( timestep, reader[timestep] )
+    elif path.suffix in STRUCTURE_FORMATS.values():
+        if is_trajectory(path):
+            yield from iter_trajectory(path)
+        else:
+            yield ( 0, read_structure(path) )
+    else:
+        yield from iter_dumpfile(path)
+
+def read_dumpfile(
+    path: Path, compact: T.Union[bool, Path]=False
+) -> T.Union[LAMMPSTimeseries, 'CompactDump']:
+    """
+    Read in a LAMMPS output dump.
+
+    With 'compact', the dump is converted to a compact dump file (see
+    write_compact_dump) and returned as a memory-mapped CompactDump, so
+    frames are only paged in as they're used. 'compact' can be the path of
+    the compact file, otherwise it's written next to the dump (with
+    COMPACT_SUFFIX added). An existing compact file that's newer than the
+    dump is reused.
+    """
+    if not compact:
+        return dict( iter_dumpfile(path) )
+
+    path = Path(path)
+    compact_path = path.with_name(path.name + COMPACT_SUFFIX) if compact is True else Path(compact)
+    if not compact_path.exists() or compact_path.stat().st_mtime < path.stat().st_mtime:
+        write_compact_dump(path, compact_path)
+    return CompactDump(compact_path)
+
+def convert_dumpfile(
+    dump_path: Path, path: Path, keep_frames: bool=False,
+    keep_last: bool=False, **options
+) -> LAMMPSTimeseries:
+    """
+    Convert a LAMMPS output dump into a compressed trajectory file
+    (see the trajectory module), reading the dump one timestep at a time.
+    Other options are passed to TrajectoryWriter.
+
+    If keep_frames is True, the timesteps are also returned (as with
+    read_dumpfile). If keep_last is True, only the last timestep is
+    returned, so just one frame is held in memory at a time. Otherwise,
+    an empty dict is returned.
+    """
+    dump: LAMMPSTimeseries = {}
+    with TrajectoryWriter(path, **options) as writer:
+        for (timestep, data) in iter_dumpfile(dump_path):
+            writer.append(timestep, data)
+            if keep_frames:
+                dump[timestep] = data
+            elif keep_last:
+                dump = { timestep: data }
     return dump
 
+########################
+# COMPACT DUMPS
+########################
+
+#
+# A compact dump stores the frames of a LAMMPS dump uncompressed, column
+# by column, with compact types, so it can be memory-mapped and each
+# frame's columns used as views without copying or parsing:
+#
+#     8 bytes   Magic string (b'H2SCOMP1')
+#     8 bytes   Number of atoms, n (little-endian uint64)
+#     Frames, each padded to a multiple of 8 bytes:
+#         8 bytes     Timestep (int64)
+#         4n bytes    Atom IDs (int32, sorted)
+#         12n bytes   Coordinates (float32 x, y, z)
+#         6n bytes    Image flags (int16 ix, iy, iz)
+#
+COMPACT_MAGIC = b'H2SCOMP1'
+COMPACT_SUFFIX = '.h2c'
+_COMPACT_HEADER = 16
+
+def _compact_frame_size(num_atoms: int) -> int:
+    return (8 + 22 * num_atoms + 7) // 8 * 8
+
+def write_compact_dump(dump_path: Path, path: Path):
+    """
+    Convert a LAMMPS output dump into a compact dump file (see CompactDump),
+    reading the dump one timestep at a time. Atoms are sorted by id, and
+    every frame must have the same number of atoms. The file is written
+    under a temporary name and moved into place when it's complete.
+    """
+    path = Path(path)
+    partial = path.with_name(path.name + '.partial')
+    num_atoms = None
+
+    with open(partial, 'wb') as f:
+        for (timestep, data) in iter_dumpfile(dump_path):
+            if num_atoms is None:
+                num_atoms = len(data)
+                f.write( COMPACT_MAGIC + struct.pack('<Q', num_atoms) )
+                padding = bytes( _compact_frame_size(num_atoms) - 8 - 22 * num_atoms )
+            elif len(data) != num_atoms:
+                raise LAMMPSError(
+                    f"Timestep {timestep} has {len(data)} atoms, but the first had {num_atoms}"
+                )
+
+            data = data[ np.argsort(data[:,0], kind='stable') ]
+            f.write( struct.pack('<q', timestep) )
+            f.write( data[:,0].astype('<i4').tobytes() )
+            f.write( data[:,1:4].astype('<f4').tobytes() )
+            f.write( data[:,4:7].astype('<i2').tobytes() )
+            f.write( padding )
+
+        if num_atoms is None:
+            f.write( COMPACT_MAGIC + struct.pack('<Q', 0) )
+
+    os.replace(partial, path)
+
+class CompactDump(Mapping):
+    """
+    A compact dump file (see write_compact_dump), memory-mapped. This is a
+    mapping from integer timesteps to CompactTimesteps (like a
+    LAMMPSTimeseries), whose columns are read-only views of the file.
+
+    The 'timesteps', 'ids', 'coords' and 'images' attributes are views of
+    every frame at once, indexed by frame first.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r')
+        if bytes(self._map[:len(COMPACT_MAGIC)]) != COMPACT_MAGIC:
+            raise LAMMPSError(f"'{path}' is not a compact dump file")
+
+        (n,) = struct.unpack( '<Q', bytes(self._map[len(COMPACT_MAGIC):_COMPACT_HEADER]) )
+        size = _compact_frame_size(n)
+        frames = (len(self._map) - _COMPACT_HEADER) // size
+
+        def column(offset: int, dtype: str, shape: tuple, strides: tuple) -> np.ndarray:
+            # (A file without frames has no columns to view)
+            if frames == 0:
+                return np.zeros( (0,) + shape, dtype=dtype )
+            return np.ndarray(
+                (frames,) + shape, dtype=dtype, buffer=self._map,
+                offset=_COMPACT_HEADER + offset, strides=(size,) + strides
+            )
+
+        self.timesteps = column(0, '<i8', (), ())
+        self.ids = column(8, '<i4', (n,), (4,))
+        self.coords = column(8 + 4*n, '<f4', (n, 3), (12, 4))
+        self.images = column(8 + 16*n, '<i2', (n, 3), (6, 2))
+        self._frames = { int(t): i for (i, t) in enumerate(self.timesteps) }
+
+    def frame(self, index: int) -> CompactTimestep:
+        """
+        The frame at the given position in the file (rather than timestep)
+        """
+        return CompactTimestep( self.ids[index], self.coords[index], self.images[index] )
+
+    def __getitem__(self, timestep: int) -> CompactTimestep:
+        return self.frame( self._frames[timestep] )
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+#
+# Matches the summary LAMMPS prints after each run or minimization, e.g.
+# "Loop time of 12.5 on 4 procs for 1000000 steps with 1000 atoms"
+#
+_LOOP_TIME = re.compile(
+    r'^Loop time of (\S+) on (\d+) procs for (\d+) steps with (\d+) atoms'
+)
+
+def read_timing_breakdown(log_path: Path) -> T.List[dict]:
+    """
+    Read the timing summary from a LAMMPS log file. Returns a dict for each
+    run (or minimization) in the log with its 'loop_time', 'procs', 'steps'
+    and 'atoms', and 'sections': the average time spent in each section of
+    the "MPI task timing breakdown" table (Pair, Bond, Neigh, Comm, ...)
+    """
+    runs = []
+    if not log_path.exists():
+        return runs
+
+    with open(log_path, 'r', errors='replace') as f:
+        in_table = False
+        for line in f:
+            match = _LOOP_TIME.match(line)
+            if match:
+                runs.append({
+                    'loop_time': float(match.group(1)),
+                    'procs': int(match.group(2)),
+                    'steps': int(match.group(3)),
+                    'atoms': int(match.group(4)),
+                    'sections': {}
+                })
+                in_table = False
+            elif runs and line.startswith('MPI task timing breakdown'):
+                in_table = True
+            elif in_table:
+                # Rows are: Section | min | avg | max | %varavg | %total
+                cells = [ c.strip() for c in line.split('|') ]
+                if len(cells) < 3:
+                    if line.strip() == '':
+                        in_table = False
+                    continue
+                if cells[0] == 'Section':
+                    continue
+                try:
+                    runs[-1]['sections'][cells[0]] = float(cells[2])
+                except ValueError:
+                    pass
+
+    return runs
+
+########################
+# FENE BONDS
+########################
+
+# Messages LAMMPS prints when a FENE bond is stretched too far
+FENE_ERRORS = [ 'Bad FENE bond', 'FENE bond too long' ]
+
+# Stiffness (K) of the FENE chain bonds
+FENE_STIFFNESS = 30.0
+
+# LAMMPS warns about a FENE bond once it's stretched past this fraction of
+# the bond coefficient (R0), and caps its force there. A bond stretched
+# to twice R0 fails the simulation
+FENE_WARN_FRACTION = math.sqrt(0.9)
+
+# Safety factor on the bond coefficient predicted by predict_bond_coeff.
+# As the chain moves, the contacts keep pulling on it, and chain bonds end
+# up stretched further than the initial pull alone suggests (two to three
+# times as far, in test runs on random walks of 2,000 to 10,000 beads)
+FENE_MARGIN = 3.0
+
+def has_fene_error(log_path: Path) -> bool:
+    """
+    Check whether a LAMMPS log file reports bad FENE bonds
+    """
+    if not log_path.exists():
+        return False
+    with open(log_path, 'r', errors='replace') as f:
+        return any( any(e in line for e in FENE_ERRORS) for line in f )
+
+def predict_bond_coeff(
+    coords: np.ndarray, lengths: T.Sequence[int], bond_coeff: float,
+    contacts: ContactSet=None, contact_stiffness: np.ndarray=None
+) -> float:
+    """
+    Predict the FENE bond coefficient (R0, the maximum length of the chain
+    bonds) needed for a simulation starting from the given coordinates.
+
+    At the start, the contact bonds are at their longest, and the pull of
+    a contact bond (2K times its stretch, for LAMMPS's harmonic bonds) on
+    each of its beads is strongest. A chain bond is stretched by the
+    difference of the pulls on its two beads along it, until the FENE
+    bond's tension matches it. The coefficient is raised so that no chain
+    bond would reach the length LAMMPS warns at (see FENE_WARN_FRACTION),
+    from its initial length or from that stretch (with a margin for the
+    chain moving as it relaxes, see FENE_MARGIN).
+
+    'contacts' are the contact bonds (pairs of beads, from 1) and
+    'contact_stiffness' is the harmonic K of each (see contact_bonds).
+
+    Returns the given bond_coeff if it's large enough, or the smallest
+    integer that is.
+    """
+    n = int(sum(lengths))
+    bonds = np.array( create_bonds(n, lengths), dtype=np.int64 ).reshape( (-1, 2) ) - 1
+    if len(bonds) == 0:
+        return bond_coeff
+    coords = np.asarray(coords[:n], dtype=np.float64)
+
+    vectors = coords[bonds[:,1]] - coords[bonds[:,0]]
+    bond_lengths = np.linalg.norm(vectors, axis=1)
+
+    # Pull of the contact bonds on each bead
+    pull = np.zeros( (n, 3) )
+    if contacts is not None and len(contacts):
+        contacts = np.asarray(contacts, dtype=np.int64).reshape( (-1, 2) ) - 1
+        spans = coords[contacts[:,1]] - coords[contacts[:,0]]
+        contact_lengths = np.linalg.norm(spans, axis=1)
+        scale = 2 * np.asarray(contact_stiffness, dtype=np.float64) \
+            * (contact_lengths - CONTACT_BOND_LENGTH) / np.maximum(contact_lengths, 1e-12)
+        forces = scale[:,None] * spans
+        np.add.at( pull, contacts[:,0], forces )
+        np.add.at( pull, contacts[:,1], -forces )
+
+    # Tension stretching each chain bond. A FENE bond at the warning length
+    # r has a tension of K r / (1 - FENE_WARN_FRACTION^2)
+    tension = np.maximum( 0,
+        np.einsum( 'ij,ij->i', pull[bonds[:,1]] - pull[bonds[:,0]], vectors )
+        / np.maximum(bond_lengths, 1e-12)
+    )
+    stretched = tension * (1 - FENE_WARN_FRACTION**2) / FENE_STIFFNESS
+
+    longest = max( bond_lengths.max(), stretched.max() * FENE_MARGIN )
+    return max( bond_coeff, math.ceil(longest / FENE_WARN_FRACTION) )
+
 ########################
 # RUNNING LAMMPS
 ########################
 
-class LAMMPSError(Exception):
-    pass
+def lammps_command(
+    lammps_exec: str='lmp', mpi_procs: int=None, mpi_exec: str='mpirun'
+) -> T.List[str]:
+    '''
+    The command to run LAMMPS on the input deck in the current directory.
+    With 'mpi_procs' above 1, LAMMPS is launched on that many processes
+    with 'mpi_exec' (which needs a LAMMPS built with MPI).
+    '''
+    command = [ lammps_exec, '-in', 'in.input' ]
+    if mpi_procs is not None and mpi_procs > 1:
+        command = [ mpi_exec, '-np', str(mpi_procs) ] + command
+    return command
 
-# A context-manager to run a block of code
-# in a different directory
-# Thanks, StackOverflow! https://stackoverflow.com/a/24469659/2827258
-@contextmanager
-def cd_context(dir):
-    original=os.getcwd()
-    os.chdir(dir)
-    try:
-        yield
-    finally:
-        os.chdir(original)
+# How often (in seconds) a running LAMMPS process is checked for
+# cancellation (see run_lammps_process)
+CANCEL_POLL_INTERVAL = 0.5
+
+def run_lammps_process(
+    command: T.List[str], cwd: Path, cancel: threading.Event=None
+) -> int:
+    '''
+    Run a LAMMPS command (see lammps_command) in 'cwd' and return its exit
+    status.
+
+    With 'cancel', LAMMPS is started in its own session, so a Ctrl-C in the
+    terminal doesn't reach it (and can't make a simulation look like it
+    failed). Instead, LAMMPS (and any MPI processes it started) is stopped
+    once 'cancel' is set, and LAMMPSCancelled is raised.
+    '''
+    if cancel is None:
+        return sub.run( command, cwd=cwd, stdout=sub.DEVNULL ).returncode
+
+    with sub.Popen( command, cwd=cwd, stdout=sub.DEVNULL, start_new_session=True ) as proc:
+        while True:
+            try:
+                return proc.wait(timeout=CANCEL_POLL_INTERVAL)
+            except sub.TimeoutExpired:
+                if not cancel.is_set():
+                    continue
+
+            # LAMMPS leads its own process group, which includes any
+            # MPI ranks it was launched with
+            for (sig, timeout) in [ (signal.SIGTERM, 10), (signal.SIGKILL, None) ]:
+                try:
+                    os.killpg(proc.pid, sig)
+                except ProcessLookupError:
+                    break
+                try:
+                    proc.wait(timeout=timeout)
+                    break
+                except sub.TimeoutExpired:
+                    pass
+            raise LAMMPSCancelled("The simulation was cancelled")
 
 def run_lammps(
-    records: ContactSet, settings: LAMMPSSettings,
-    lammps_exec:str='lmp', copy_log_to:Path=None
+    records: T.Union[ContactSet, ContactMap], settings: LAMMPSSettings,
+    lammps_exec:str='lmp', copy_log_to:Path=None,
+    trajectory_to:Path=None, trajectory_options:dict=None,
+    initial_coords:np.ndarray=None,
+    fene_retries:int=0, fene_growth:float=1.5, pre_relax:bool=False,
+    lengths:T.Sequence[int]=None, mpi_procs:int=None, mpi_exec:str='mpirun',
+    cancel:threading.Event=None
 ) -> LAMMPSTimeseries:
     '''
     Run a LAMMPS simulation in a temporary directory. You can set the path to
     LAMMPS executable with 'lammps_exec' and optionally copy the log file
     to a given path with 'copy_log_to'
+
+    If 'trajectory_to' is set, every timestep in the LAMMPS dump is saved
+    to a compressed trajectory file at that path instead (see the trajectory
+    module), and only the final timestep is returned. 'trajectory_options'
+    are passed on to the TrajectoryWriter.
+
+    The initial conformation can be set with 'initial_coords' (see
+    initial_conformation). Otherwise, a new random walk is generated.
+
+    This doesn't change the working directory, so separate simulations
+    can be run from multiple threads at once.
+
+    If 'fene_retries' is greater than zero, the FENE bond coefficient is
+    tuned automatically. It's first raised if the initial conformation
+    would break it (see predict_bond_coeff). Then if LAMMPS fails because
+    of bad FENE bonds, the coefficient is multiplied by 'fene_growth' and
+    the simulation is retried in the same directory (up to 'fene_retries'
+    times). With 'pre_relax', the initial conformation is relaxed with an
+    energy minimization before the simulation starts.
+
+    'lengths' gives the lengths of several chains (see write_input_deck),
+    for a whole-genome simulation. Large systems can be run on several
+    processes with 'mpi_procs' (see lammps_command).
+
+    If 'cancel' is given, LAMMPS is stopped when it's set, and
+    LAMMPSCancelled is raised (see run_lammps_process).
     '''
 
     copy_dest = copy_log_to.resolve() if copy_log_to else None
+    trajectory_dest = trajectory_to.resolve() if trajectory_to else None
 
     with temp.TemporaryDirectory() as tmpdir:
         tmp = Path(tmpdir).resolve()
-        write_input_deck(tmp, settings, records)
+        if fene_retries > 0:
+            if not isinstance(records, ContactMap):
+                records = ContactMap.from_set(records)
+            n = records.num_beads if lengths is None else int(sum(lengths))
+            if initial_coords is None:
+                initial_coords = initial_conformation( n, seed_streams(settings.get('seed'))[0] )
 
-        with cd_context(tmpdir):
-            proc = sub.run(
-                [lammps_exec, '-in', 'in.input'],
-                stdout=sub.DEVNULL # we'll copy the log if we want
-                                   # to see output
+            (contacts, types, stiffness) = contact_bonds(records, settings)
+            bond_coeff = predict_bond_coeff(
+                initial_coords[:n], [n] if lengths is None else lengths, settings['bond_coeff'],
+                contacts, np.asarray(stiffness)[types]
             )
-            try:
-                proc.check_returncode()
-            except sub.CalledProcessError as e:
-                raise LAMMPSError(f"LAMMPS exited with error: {e}")
-            finally:
-                log_file = Path('sim.log')
-                if (copy_dest is not None) and ( log_file.exists() ):
-                    shutil.copy2( 'sim.log', copy_dest )
+            if bond_coeff != settings['bond_coeff']:
+                log.info(f"Increasing FENE bond coefficient to {bond_coeff} for the initial conformation")
+                settings = { **settings, 'bond_coeff': bond_coeff }
+
+        with metrics.stage('lammps.deck'):
+            write_input_deck(tmp, settings, records, initial_coords, pre_relax, lengths)
+
+        log_file = tmp/'sim.log'
+        bond_coeff = settings['bond_coeff']
+        attempt = 0
+        try:
+            with metrics.stage('lammps.run') as info:
+                info['attempts'] = 1
+                while True:
+                    # (The log is copied if we want to see output)
+                    command = lammps_command(lammps_exec, mpi_procs, mpi_exec)
+                    returncode = run_lammps_process(command, tmp, cancel)
+                    if returncode == 0:
+                        break
+
+                    if attempt < fene_retries and has_fene_error(log_file):
+                        attempt += 1
+                        info['attempts'] = attempt + 1
+                        bond_coeff = math.ceil(bond_coeff * fene_growth)
+                        log.info(
+                            f"LAMMPS reported bad FENE bonds. Retrying with a bond"
+                            f" coefficient of {bond_coeff} (attempt {attempt} of {fene_retries})"
+                        )
+                        set_bond_coeff(tmp/'in.input', bond_coeff)
+                        continue
 
-            data = read_dumpfile( Path('sim.dump') )
+                    error = sub.CalledProcessError(returncode, command)
+                    raise LAMMPSError(f"LAMMPS exited with error: {error}")
+
+                if metrics.active():
+                    info['lammps_timing'] = read_timing_breakdown(log_file)
+        finally:
+            if (copy_dest is not None) and ( log_file.exists() ):
+                shutil.copy2( log_file, copy_dest )
+
+        with metrics.stage('lammps.dump'):
+            if trajectory_dest is not None:
+                data = convert_dumpfile(
+                    tmp/'sim.dump', trajectory_dest, keep_last=True,
+                    **(trajectory_options or {})
+                )
+            else:
+                data = read_dumpfile( tmp/'sim.dump' )
 
     return data
+
+########################
+# WARM STARTS
+########################
+
+# Length of the relaxation run for a warm start, as a multiple of the
+# full run's length times the fraction of contacts that changed
+WARM_START_SCALE = 2.0
+
+# Shortest relaxation run for a warm start
+MIN_RELAX_TIMESTEPS = 10000
+
+def unwrap_coordinates(data: AnyTimestep, box: np.ndarray=None) -> np.ndarray:
+    """
+    Get the unwrapped coordinates of a structure, sorted by bead id, as an
+    (n, 3) array. For a LAMMPSTimestep (or CompactTimestep), the image flags
+    (ix, iy, iz) give the periodic images. Without image flags (e.g. from
+    read_structure), the chain is unwrapped by taking the shortest
+    (periodic) displacement along each chain bond, which is right as long
+    as no bond is longer than half the box.
+
+    The box defaults to the one a simulation of this many beads
+    was run in (see box_dimensions).
+    """
+    (ids, coords, images) = timestep_columns(data)
+    if box is None:
+        box = box_dimensions( len(ids) )
+    order = np.argsort(ids, kind='stable')
+    coords = coords[order].astype(np.float64)
+
+    if images is not None:
+        return coords + images[order] * box
+
+    steps = np.diff(coords, axis=0)
+    steps -= box * np.round(steps / box)
+    return np.concatenate( (coords[:1], coords[:1] + np.cumsum(steps, axis=0)) )
+
+def relax_timesteps(changed: int, total: int, timesteps: int) -> int:
+    """
+    The number of timesteps to relax a structure for, after 'changed' of
+    its 'total' contacts were added or removed, where a full simulation
+    runs for 'timesteps'. This scales with the fraction of contacts that
+    changed (see WARM_START_SCALE), between MIN_RELAX_TIMESTEPS and
+    'timesteps'.
+    """
+    fraction = changed / max(total, 1)
+    relax = math.ceil( timesteps * WARM_START_SCALE * fraction )
+    return int( min(timesteps, max(MIN_RELAX_TIMESTEPS, relax)) )
+
+def prepare_warm_start(
+    previous: np.ndarray,
+    old_records: T.Union[ContactSet, ContactMap],
+    new_records: T.Union[ContactSet, ContactMap],
+    settings: LAMMPSSettings, timesteps: int=None
+) -> T.Tuple[ContactMap, LAMMPSSettings, dict]:
+    """
+    Prepare a simulation that starts from a previous structure ('previous',
+    a LAMMPSTimestep or the result of read_structure) that was simulated
+    with 'old_records', and relaxes it with 'new_records' bonded instead.
+
+    The relaxation runs for 'timesteps', or a number based on how much the
+    contacts changed if that isn't given (see relax_timesteps). If the new
+    contacts need more beads than the previous structure has, the chain is
+    extended with a random walk from its last bead, and the structure is
+    relaxed with an energy minimization first.
+
+    Returns a (records, settings, options) tuple to pass to run_lammps
+    (or run_lammps_cached) as run_lammps(records, settings, **options).
+    """
+    if not isinstance(old_records, ContactMap):
+        old_records = ContactMap.from_set(old_records)
+    if not isinstance(new_records, ContactMap):
+        new_records = ContactMap.from_set(new_records)
+
+    (added, removed) = diff_contact_sets(old_records, new_records)
+    if timesteps is None:
+        timesteps = relax_timesteps(
+            len(added) + len(removed), len(old_records.keys), settings['timesteps']
+        )
+    log.info(
+        f"Warm start: {len(added)} contacts added and {len(removed)} removed."
+        f" Relaxing for {timesteps} timesteps"
+    )
+
+    coords = unwrap_coordinates(previous)
+    n = max( new_records.num_beads, len(coords) )
+    pre_relax = False
+    if n > len(coords):
+        (walk_rng, _) = seed_streams( settings.get('seed') )
+        walk = initial_conformation( n - len(coords) + 1, walk_rng )
+        coords = np.concatenate( (coords, walk[1:] - walk[0] + coords[-1]) )
+        pre_relax = True
+        log.info(f"Extending the previous structure by {n - len(previous)} beads")
+
+    records = ContactMap(
+        new_records.x, new_records.y, new_records.counts,
+        num_beads=n, count_dtype=new_records.counts_dtype
+    )
+    settings = { **settings, 'timesteps': timesteps }
+    return ( records, settings, { 'initial_coords': coords, 'pre_relax': pre_relax } )
+
+def warm_start(
+    previous: np.ndarray,
+    old_records: T.Union[ContactSet, ContactMap],
+    new_records: T.Union[ContactSet, ContactMap],
+    settings: LAMMPSSettings, lammps_exec: str='lmp',
+    timesteps: int=None, **options
+) -> LAMMPSTimeseries:
+    """
+    Re-simulate a previous structure after its contacts changed, with a
+    short relaxation instead of a full run from a random walk (see
+    prepare_warm_start). Other options are passed to run_lammps.
+    """
+    (records, settings, warm_options) = prepare_warm_start(
+        previous, old_records, new_records, settings, timesteps
+    )
+    warm_options['pre_relax'] = warm_options['pre_relax'] or options.pop('pre_relax', False)
+    return run_lammps( records, settings, lammps_exec, **options, **warm_options )
@@ -0,0 +1,275 @@
+"""
+Module for measuring the stages of the pipeline.
+
+The expensive parts of hic2structure (reading the Hi-C file, writing the
+LAMMPS input deck, running LAMMPS, parsing its dump and writing output
+files) are each wrapped in a named stage:
+
+    with stage('lammps.run') as info:
+        ...
+
+Stages cost almost nothing unless a Collector is active. Collectors are
+notified when each stage starts and stops, and are given a StageMetrics
+record for it:
+
+    with collecting( MetricsCollector() ) as metrics:
+        run_lammps(...)
+    metrics.write(outdir/'metrics.json')
+
+Measurements are for the whole process (and its child processes, such as
+LAMMPS), so they overlap if stages run in several threads at once. I/O
+counts come from /proc/self/io and peak memory from getrusage, so they're
+only available where those are (None otherwise).
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import typing as T
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+class StageMetrics(T.TypedDict):
+    '''
+    Measurements for a single run of a stage
+    '''
+    name: str
+    parent: T.Optional[str] # Name of the enclosing stage, if any
+    depth: int
+    start: float # Seconds since the first stage started
+    wall_time: float
+    cpu_time: float # This process
+    child_cpu_time: float # Child processes (i.e. LAMMPS) that finished during the stage
+    max_rss: T.Optional[int] # Peak memory of this process so far, in bytes
+    rss_growth: T.Optional[int] # How much the stage raised max_rss
+    child_max_rss: T.Optional[int] # Peak memory of the largest child process so far
+    read_bytes: T.Optional[int]
+    write_bytes: T.Optional[int]
+    info: dict # Anything else recorded by the stage
+
+########################
+# MEASUREMENTS
+########################
+
+def _io_counters() -> T.Tuple[T.Optional[int], T.Optional[int]]:
+    """
+    Bytes read and written by this process so far (including cached I/O)
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            fields = dict( line.split(':', 1) for line in f if ':' in line )
+        return ( int(fields['rchar']), int(fields['wchar']) )
+    except (OSError, KeyError, ValueError):
+        return ( None, None )
+
+def _max_rss(who) -> T.Optional[int]:
+    """
+    Peak resident set size of this process or its children, in bytes
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def _snapshot() -> dict:
+    times = os.times()
+    (read_bytes, write_bytes) = _io_counters()
+    return {
+        'wall': time.perf_counter(),
+        'cpu': time.process_time(),
+        'child_cpu': times.children_user + times.children_system,
+        'max_rss': _max_rss( resource.RUSAGE_SELF ) if resource else None,
+        'child_max_rss': _max_rss( resource.RUSAGE_CHILDREN ) if resource else None,
+        'read_bytes': read_bytes,
+        'write_bytes': write_bytes,
+    }
+
+def _difference(end, start):
+    if end is None or start is None:
+        return None
+    return end - start
+
+########################
+# COLLECTORS
+########################
+
+class Collector:
+    '''
+    Base class for objects that are notified about stages. Subclasses
+    override the hooks they need.
+    '''
+
+    def stage_started(self, name: str, depth: int):
+        pass
+
+    def stage_finished(self, metrics: StageMetrics):
+        pass
+
+class MetricsCollector(Collector):
+    '''
+    Collects the StageMetrics for every stage, in the order they finish
+    '''
+
+    def __init__(self):
+        self.stages: T.List[StageMetrics] = []
+        self._lock = threading.Lock()
+
+    def stage_finished(self, metrics: StageMetrics):
+        with self._lock:
+            self.stages.append(metrics)
+
+    def totals(self) -> T.Dict[str, dict]:
+        """
+        Total wall and CPU time for each stage name, over every time it ran
+        """
+        totals = {}
+        for s in self.stages:
+            total = totals.setdefault( s['name'], {
+                'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'child_cpu_time': 0.0
+            })
+            total['count'] += 1
+            for key in [ 'wall_time', 'cpu_time', 'child_cpu_time' ]:
+                total[key] += s[key]
+        return totals
+
+    def write(self, path: Path, **extra):
+        """
+        Write the collected metrics to a JSON file. Any 'extra' keyword
+        arguments are included at the top level.
+        """
+        with open(path, 'w') as f:
+            json.dump(
+                { **extra, 'stages': self.stages, 'totals': self.totals() },
+                f, indent=4
+            )
+
+class StageTable(Collector):
+    '''
+    Prints a row to a stream (stderr, by default) as each stage finishes
+    '''
+
+    COLUMNS = "{:<28} {:>10} {:>10} {:>10} {:>10} {:>10}"
+
+    def __init__(self, stream: T.TextIO=None):
+        self.stream = stream
+        self._printed_header = False
+        self._lock = threading.Lock()
+
+    def _print(self, line):
+        print( line, file=self.stream or sys.stderr, flush=True )
+
+    def stage_finished(self, metrics: StageMetrics):
+        def mb(value):
+            return '-' if value is None else f"{value / (1024*1024):.1f}"
+
+        with self._lock:
+            if not self._printed_header:
+                self._print( self.COLUMNS.format(
+                    'stage', 'wall (s)', 'cpu (s)', 'rss (MB)', 'read (MB)', 'write (MB)'
+                ))
+                self._printed_header = True
+
+            self._print( self.COLUMNS.format(
+                '  ' * metrics['depth'] + metrics['name'],
+                f"{metrics['wall_time']:.3f}",
+                f"{metrics['cpu_time'] + metrics['child_cpu_time']:.3f}",
+                mb(metrics['max_rss']),
+                mb(metrics['read_bytes']),
+                mb(metrics['write_bytes'])
+            ))
+
+_collectors: T.List[Collector] = []
+_collectors_lock = threading.Lock()
+_local = threading.local()
+_epoch = None
+
+def active() -> bool:
+    """
+    Whether any collectors are active (i.e. whether stages are being measured)
+    """
+    return len(_collectors) > 0
+
+def add_collector(collector: Collector):
+    with _collectors_lock:
+        _collectors.append(collector)
+
+def remove_collector(collector: Collector):
+    with _collectors_lock:
+        if collector in _collectors:
+            _collectors.remove(collector)
+
+@contextmanager
+def collecting(collector: Collector):
+    """
+    Activate the given collector for the duration of a block
+    """
+    add_collector(collector)
+    try:
+        yield collector
+    finally:
+        remove_collector(collector)
+
+########################
+# STAGES
+########################
+
+@contextmanager
+def stage(name: str) -> T.Iterator[dict]:
+    """
+    Measure a block of code as a named stage. Stages can be nested.
+    Yields a dict, which the stage can fill with any extra information
+    to record (it's included in the StageMetrics as 'info').
+
+    Can also be used as a decorator: @stage('out.structure')
+    """
+    global _epoch
+    info = {}
+    if not _collectors:
+        yield info
+        return
+
+    collectors = list(_collectors)
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    depth = len(stack)
+
+    for c in collectors:
+        c.stage_started(name, depth)
+
+    stack.append(name)
+    start = _snapshot()
+    if _epoch is None:
+        _epoch = start['wall']
+    try:
+        yield info
+    finally:
+        end = _snapshot()
+        stack.pop()
+
+        metrics = StageMetrics(
+            name=name,
+            parent=parent,
+            depth=depth,
+            start=start['wall'] - _epoch,
+            wall_time=end['wall'] - start['wall'],
+            cpu_time=end['cpu'] - start['cpu'],
+            child_cpu_time=end['child_cpu'] - start['child_cpu'],
+            max_rss=end['max_rss'],
+            rss_growth=_difference(end['max_rss'], start['max_rss']),
+            child_max_rss=end['child_max_rss'],
+            read_bytes=_difference(end['read_bytes'], start['read_bytes']),
+            write_bytes=_difference(end['write_bytes'], start['write_bytes']),
+            info=info
+        )
+        for c in collectors:
+            c.stage_finished(metrics)
@@ -2,68 +2,430 @@
 Module for writing output files
 """
 
-import csv
+import json
+import struct
+import typing as T
+import zipfile
+from collections.abc import Mapping
 
 from pathlib import Path
-from .types import LAMMPSTimestep, ContactRecords, ContactSet
+import numpy as np
 
-def write_structure(path: Path, data: LAMMPSTimestep):
+from .types import (
+    LAMMPSTimestep, LAMMPSTimeseries, CompactTimestep, AnyTimestep, timestep_columns,
+    ContactRecords, ContactSet, Settings
+)
+from .contactmap import pack_pairs, unpack_pairs
+from .formats import STRUCTURE_FORMATS, CONTACT_FORMATS, TEXT_COMPRESSIONS
+from .metrics import stage
+from .textio import TEXT_THREADS, TextWriter, text_compression, open_text, write_rows
+
+########################
+# FORMATS
+########################
+
+def structure_format(path: Path, format: str=None) -> str:
     """
-    Write out a csv file with structure data
-    from the given LAMMPS output
+    Determine the structure format to use for the given path. If format
+    is None, it's inferred from the path's extension (defaulting to csv).
     """
-    with open(path, 'w') as f:
-        writer = csv.writer(f)
-        writer.writerow(['id','x','y','z'])
+    if format is not None:
+        if format not in STRUCTURE_FORMATS:
+            raise ValueError(
+                f"Unknown structure format '{format}'. "
+                f"Available formats are: {list(STRUCTURE_FORMATS.keys())}"
+            )
+        return format
 
-        for row in data:
-            writer.writerow(row[:4])
+    for (name, ext) in STRUCTURE_FORMATS.items():
+        if _uncompressed_path(path).suffix == ext:
+            return name
+    return 'csv'
 
-def write_contact_records(path: Path, contacts: ContactRecords):
+def _sorted_by_id(data: AnyTimestep) -> AnyTimestep:
     """
-    Write out a tsv file wiht contact map data
+    Return the given timestep with its rows sorted by atom id. A
+    CompactTimestep that's already sorted is returned as it is (so its
+    columns are still views).
     """
-    max_value = max( contacts[:,2] )
+    ids = timestep_columns(data)[0]
+    if isinstance(data, CompactTimestep):
+        if np.all( ids[1:] > ids[:-1] ):
+            return data
+        return data.take( np.argsort(ids, kind='stable') )
+    return data[ np.argsort(ids, kind='stable') ]
 
-    with open(path, 'w') as f:
-        writer = csv.writer(f, delimiter='\t')
-        seen = set()
+def _check_sequential_ids(ids: np.ndarray, format: str):
+    """
+    Check that (sorted) bead ids are 1 to n, since the 'npy' and 'raw'
+    formats only store coordinates and their ids are assumed to be 1 to n
+    when they're read back
+    """
+    if not np.array_equal( ids, np.arange(1, len(ids)+1) ):
+        raise ValueError(
+            f"The '{format}' format doesn't store bead ids, so they must be 1 to {len(ids)}. "
+            "Use the 'csv' or 'npz' format to keep other ids"
+        )
+
+########################
+# TEXT OUTPUT
+########################
+
+def _text_compression(path: Path, compression: str, is_text: bool) -> str:
+    """
+    The compression for an output file (see text_compression), checking
+    that it's only used for text formats
+    """
+    compression = text_compression(path, compression)
+    if compression != 'none' and not is_text:
+        raise ValueError(f"Only text (csv and tsv) files can be compressed, not '{path}'")
+    return compression
+
+def _uncompressed_path(path: Path) -> Path:
+    """
+    The given path without a compression extension (see TEXT_COMPRESSIONS)
+    """
+    path = Path(path)
+    if text_compression(path) != 'none':
+        return path.with_suffix('')
+    return path
+
+########################
+# STRUCTURES
+########################
+
+@stage('out.structure')
+def write_structure(
+    path: Path, data: AnyTimestep, format: str=None,
+    compression: str=None, threads: int=TEXT_THREADS
+):
+    """
+    Write out a file with structure data from the given LAMMPS output
+    (a LAMMPSTimestep or CompactTimestep). The format is selected with
+    'format' or inferred from the file extension (see STRUCTURE_FORMATS).
+    Beads are written in order of id (LAMMPS run on several processes
+    doesn't dump them in order), and csv files can be compressed
+    (see TextWriter).
+    """
+    format = structure_format(path, format)
+    compression = _text_compression(path, compression, format == 'csv')
+
+    data = _sorted_by_id(data)
+    (ids, coords, _) = timestep_columns(data)
+
+    if format == 'csv':
+        with TextWriter(path, compression, threads) as f:
+            f.write('id,x,y,z\n')
+            # Ids are written as integers, whatever the type of the data
+            ids = np.asarray(ids, dtype=np.int64)
+            if isinstance(data, CompactTimestep):
+                # float32 coordinates are written with the dump's precision
+                write_rows(f, '%d,%.5f,%.5f,%.5f', ids, *coords.T)
+            else:
+                write_rows(f, '%d,%r,%r,%r', ids, *coords.T)
+        return
+
+    # (Doesn't copy sorted CompactTimestep coordinates)
+    coords = np.ascontiguousarray( coords, dtype=np.float32 )
+    if format in ('npy', 'raw'):
+        _check_sequential_ids(ids, format)
+
+    if format == 'npy':
+        np.save(path, coords)
+    elif format == 'raw':
+        coords.tofile(path)
+    elif format == 'npz':
+        np.savez_compressed(
+            path,
+            ids=np.asarray(ids, dtype=np.int32),
+            coords=coords
+        )
+
+def read_structure(path: Path, format: str=None) -> np.ndarray:
+    """
+    Read a structure file written by write_structure. Returns an array
+    with the same columns as the csv format: id, x, y, z. (The 'npy' and
+    'raw' formats don't store ids, which are always 1 to n.)
+    """
+    format = structure_format(path, format)
+
+    if format == 'csv':
+        with open_text(path) as f:
+            return np.loadtxt(f, delimiter=',', skiprows=1, ndmin=2)
+
+    if format == 'npz':
+        with np.load(path) as archive:
+            ids = archive['ids']
+            coords = archive['coords']
+    else:
+        if format == 'npy':
+            coords = np.load(path, mmap_mode='r')
+        else:
+            coords = np.memmap(path, dtype=np.float32, mode='r').reshape(-1, 3)
+        ids = np.arange(1, len(coords)+1)
+
+    return np.column_stack( (ids, coords) ).astype(np.float64)
+
+#
+# Size of the header written at the start of a .npy trajectory. The header
+# is padded to this size so it can be rewritten in place with the number
+# of frames once they've all been written (see the .npy format
+# specification in numpy.lib.format)
+#
+_NPY_HEADER_SIZE = 128
+
+def _npy_header(shape: T.Tuple[int, ...]) -> bytes:
+    """
+    A version 1.0 .npy header for a float32 array of the given shape,
+    padded to _NPY_HEADER_SIZE bytes
+    """
+    magic = np.lib.format.magic(1, 0)
+    text = repr({ 'descr': '<f4', 'fortran_order': False, 'shape': tuple(shape) })
+    text = text.ljust( _NPY_HEADER_SIZE - len(magic) - 2 - 1 ) + '\n'
+    return magic + struct.pack('<H', len(text)) + text.encode('latin1')
+
+def _write_npy_frames(
+    f: T.BinaryIO, frames: T.Iterable[T.Tuple[int, AnyTimestep]], format: str
+) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    Write the coordinates of each frame (sorted by bead id) to a seekable
+    file as a (frames, beads, 3) float32 .npy array, one frame at a time.
+    Returns the (timesteps, ids) of the frames.
+    """
+    start = f.tell()
+    f.write( bytes(_NPY_HEADER_SIZE) )
+
+    timesteps: T.List[int] = []
+    first_ids = None
+    for (timestep, data) in frames:
+        (ids, coords, _) = timestep_columns( _sorted_by_id(data) )
+        if first_ids is None:
+            first_ids = np.asarray(ids)
+            if format == 'npy':
+                _check_sequential_ids(first_ids, format)
+        elif not np.array_equal(ids, first_ids):
+            raise ValueError(f"Timestep {timestep} has different beads from the first timestep")
+        f.write( np.ascontiguousarray(coords, dtype='<f4').tobytes() )
+        timesteps.append(timestep)
+
+    if first_ids is None:
+        raise ValueError("No timesteps to write")
+
+    end = f.tell()
+    f.seek(start)
+    f.write( _npy_header( (len(timesteps), len(first_ids), 3) ) )
+    f.seek(end)
+    return ( np.array(timesteps, dtype=np.int64), first_ids )
+
+@stage('out.trajectory')
+def write_trajectory(
+    path: Path,
+    data: T.Union[LAMMPSTimeseries, T.Iterable[T.Tuple[int, AnyTimestep]]],
+    format: str=None
+):
+    """
+    Write out the timesteps of some LAMMPS output as a single
+    (frames, beads, 3) float32 array of coordinates (with beads sorted
+    by id). Supports the 'npy' and 'npz' formats.
+
+    'data' is either a LAMMPSTimeseries (written in order of timestep) or
+    an iterable of (timestep, data) pairs (e.g. from iter_dumpfile, written
+    in the order they're given). Frames are written one at a time, so an
+    iterable never needs to be in memory all at once. Every frame must
+    have the same beads.
+
+    The 'npz' format also stores the 'timesteps' and 'ids' arrays. Like
+    write_structure, 'npy' doesn't store ids, so they must be 1 to n.
+    """
+    format = structure_format(path, format)
+    if format not in ('npy', 'npz'):
+        raise ValueError(f"Trajectories can't be written in the '{format}' format")
+
+    if isinstance(data, Mapping):
+        frames = ( (t, data[t]) for t in sorted(data.keys()) )
+    else:
+        frames = iter(data)
+
+    if format == 'npy':
+        try:
+            with open(path, 'wb') as f:
+                _write_npy_frames(f, frames, format)
+        except BaseException:
+            Path(path).unlink(missing_ok=True)
+            raise
+        return
+
+    # The coordinates are written to a temporary file first, since they
+    # can't be streamed into the archive before their shape is known
+    coords_path = Path(path).with_name(Path(path).name + '.partial')
+    try:
+        with open(coords_path, 'wb') as f:
+            (timesteps, ids) = _write_npy_frames(f, frames, format)
+
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for (name, array) in [
+                ( 'timesteps', timesteps ), ( 'ids', np.asarray(ids, dtype=np.int32) )
+            ]:
+                with archive.open(f'{name}.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, array)
+            archive.write(coords_path, 'coords.npy')
+    finally:
+        coords_path.unlink(missing_ok=True)
+
+def is_trajectory(path: Path, format: str=None) -> bool:
+    """
+    Whether the given 'npy' or 'npz' file holds a trajectory (written by
+    write_trajectory) rather than a single structure
+    """
+    format = structure_format(path, format)
+    if format == 'npz':
+        with np.load(path) as archive:
+            return 'timesteps' in archive.files
+    if format == 'npy':
+        return np.load(path, mmap_mode='r').ndim == 3
+    return False
+
+def iter_trajectory(path: Path, format: str=None) -> T.Iterator[T.Tuple[int, np.ndarray]]:
+    """
+    Read a trajectory written by write_trajectory one frame at a time,
+    yielding (timestep, data) pairs where 'data' has the same columns as
+    read_structure (id, x, y, z). A 'npy' trajectory doesn't store
+    timesteps or ids, so its frames are numbered from 0 and its ids are
+    1 to n.
+    """
+    format = structure_format(path, format)
+    if format == 'npz':
+        with np.load(path) as archive:
+            timesteps = archive['timesteps']
+            ids = archive['ids']
+            coords = archive['coords']
+    elif format == 'npy':
+        coords = np.load(path, mmap_mode='r')
+        timesteps = np.arange( len(coords) )
+        ids = np.arange( 1, coords.shape[1]+1 )
+    else:
+        raise ValueError(f"Trajectories can't be read from the '{format}' format")
+
+    if coords.ndim != 3:
+        raise ValueError(f"'{path}' isn't a trajectory file")
+    for (i, timestep) in enumerate(timesteps):
+        yield ( int(timestep), np.column_stack( (ids, coords[i]) ).astype(np.float64) )
+
+########################
+# CONTACT MAPS
+########################
+
+def contact_format(path: Path, format: str=None) -> str:
+    """
+    Determine the contact map format to use for the given path. If format
+    is None, it's inferred from the path's extension (defaulting to tsv).
+    """
+    if format is not None:
+        if format not in CONTACT_FORMATS:
+            raise ValueError(
+                f"Unknown contact map format '{format}'. "
+                f"Available formats are: {list(CONTACT_FORMATS.keys())}"
+            )
+        return format
+
+    return 'npz' if _uncompressed_path(path).suffix == CONTACT_FORMATS['npz'] else 'tsv'
+
+def _symmetrize(x: np.ndarray, y: np.ndarray, values: np.ndarray=None, diagonal=None):
+    """
+    Include both "sides" of a contact map (and optionally the diagonal, using
+    the value 'diagonal' for each bead that appears in the map) and remove
+    duplicate pairs. Where a pair appears more than once (in either order),
+    the value of the first record it appears in is kept, with the diagonal
+    taking precedence.
+
+    Returns (x, y, values) arrays, sorted by x then y.
+    """
+    # Each record's two sides are interleaved, so the first occurrence
+    # of a pair follows the order of the records
+    keys = [ np.column_stack( (pack_pairs(x, y), pack_pairs(y, x)) ).ravel() ]
+    vals = [ None if values is None else np.repeat(values, 2) ]
+
+    if diagonal is not None:
+        beads = np.unique( np.concatenate((x, y)) )
+        keys.insert( 0, pack_pairs(beads, beads) )
+        vals.insert( 0, np.full(len(beads), diagonal) )
+
+    keys = np.concatenate(keys)
+    (keys, first) = np.unique(keys, return_index=True)
+    (x, y) = unpack_pairs(keys)
+
+    if values is not None:
+        values = np.concatenate(vals)[first]
+    return ( x, y, values )
+
+def _write_sparse(path: Path, x: np.ndarray, y: np.ndarray, values: np.ndarray):
+    from scipy.sparse import coo_matrix, save_npz
+
+    n = int( max(x.max(), y.max()) ) if len(x) else 0
+    matrix = coo_matrix( (values, (x-1, y-1)), shape=(n, n) )
+    save_npz(path, matrix.tocsr())
+
+@stage('out.contacts')
+def write_contact_records(
+    path: Path, contacts: ContactRecords, format: str=None,
+    compression: str=None, threads: int=TEXT_THREADS
+):
+    """
+    Write out a tsv file wiht contact map data.
+    Both "sides" of the contact map are included, and each bead's contact
+    with itself is given the maximum value in the records. The format can
+    be selected with 'format' or inferred from the file extension
+    (see CONTACT_FORMATS). tsv files can be compressed (see TextWriter).
+    """
+    format = contact_format(path, format)
+    compression = _text_compression(path, compression, format == 'tsv')
+    max_value = contacts[:,2].max()
+
+    (x, y, values) = _symmetrize(
+        contacts[:,0].astype(np.int64), contacts[:,1].astype(np.int64),
+        contacts[:,2], diagonal=max_value
+    )
+
+    if format == 'npz':
+        _write_sparse(path, x, y, values)
+        return
+
+    with TextWriter(path, compression, threads) as f:
+        write_rows(f, '%d\t%d\t%r', x, y, values)
+
+@stage('out.contacts')
+def write_contact_set(
+    path: Path, contacts: ContactSet, format: str=None,
+    compression: str=None, threads: int=TEXT_THREADS
+):
+    """
+    Write out a tsv file with contact record coordinates.
+    Both "sides" of the contact map are included. The format can be
+    selected with 'format' or inferred from the file extension
+    (see CONTACT_FORMATS). tsv files can be compressed (see TextWriter).
+    """
+    format = contact_format(path, format)
+    compression = _text_compression(path, compression, format == 'tsv')
+    contacts = np.asarray(contacts, dtype=np.int64).reshape( (-1, 2) )
+
+    (x, y, _) = _symmetrize( contacts[:,0], contacts[:,1] )
 
-        # Write out a contact record if that pair of coordinates
-        # hasn't been seen before
-        def write_new_row(coords, value):
-            if coords not in seen:
-                writer.writerow([coords[0], coords[1], value])
-                seen.add(coords)
+    if format == 'npz':
+        _write_sparse(path, x, y, np.ones(len(x), dtype=np.int8))
+        return
 
-        for row in contacts:
-            x = int(row[0])
-            y = int(row[1])
+    with TextWriter(path, compression, threads) as f:
+        write_rows(f, '%d\t%d', x, y)
 
-            # Use the maximum value for where each value contacts itself
-            write_new_row( (x,x), max_value )
-            write_new_row( (y,y), max_value )
-            # Include both "sides" of the contact map
-            write_new_row( (x, y), row[2] )
-            write_new_row( (y, x), row[2] )
+########################
+# SETTINGS
+########################
 
-def write_contact_set(path: Path, contacts: ContactSet):
+@stage('out.settings')
+def write_settings(path: Path, settings: Settings):
     """
-    Write out a tsv file with contact record coordinates
+    Write out a json file with the settings used for a run (including
+    the seed, so the run can be reproduced)
     """
     with open(path, 'w') as f:
-        writer = csv.writer(f, delimiter='\t')
-        seen = set()
-
-        # Write out a contact record if that pair of coordinates
-        # hasn't been seen before
-        def write_new_row(coords):
-            if coords not in seen:
-                writer.writerow([coords[0], coords[1]])
-                seen.add(coords)
-
-        for row in contacts:
-            x = row[0]
-            y = row[1]
-            write_new_row( (x,y) )
-            write_new_row( (y,x) )
+        json.dump(settings, f, indent=4, default=str)
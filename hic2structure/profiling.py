@@ -0,0 +1,140 @@
+"""
+Module for profiling the stages of the pipeline.
+
+A Profiler is a metrics Collector that runs cProfile and tracemalloc over
+each stage (see the metrics module) and saves the results to a directory:
+
+    with profiled( Path('out/profile') ):
+        run_lammps(...)
+
+For every stage that runs, this writes:
+    NN-name.prof        cProfile stats (open with pstats or snakeviz)
+    NN-name.tracemalloc A tracemalloc snapshot (tracemalloc.Snapshot.load)
+    NN-name.txt         A summary of the slowest functions and largest allocations
+
+where NN counts the stages in the order they started. Nested stages are
+included in their parent's profile, rather than profiled separately.
+"""
+
+import cProfile
+import io
+import logging
+import pstats
+import re
+import threading
+import tracemalloc
+import typing as T
+from contextlib import contextmanager
+from pathlib import Path
+
+from .metrics import Collector, StageMetrics, collecting
+
+log = logging.getLogger(__name__)
+
+#
+# Number of functions and allocation sites listed in each summary
+#
+SUMMARY_LINES = 25
+
+class Profiler(Collector):
+    '''
+    Profiles stages with cProfile (and tracemalloc, if 'memory' is True),
+    writing the results to 'dir'. If 'stages' is given, only stages with
+    those names are profiled.
+    '''
+
+    def __init__(self, dir: Path, stages: T.Iterable[str]=None, memory: bool=True):
+        self.dir = Path(dir)
+        self.stages = None if stages is None else set(stages)
+        self.memory = memory
+        self.count = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _wanted(self, name: str) -> bool:
+        return self.stages is None or name in self.stages
+
+    def stage_started(self, name: str, depth: int):
+        # Only profile the outermost wanted stage in each thread
+        if not self._wanted(name) or getattr(self._local, 'current', None):
+            return
+
+        with self._lock:
+            self.count += 1
+            index = self.count
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running (e.g. in another thread)
+            log.info(f"Couldn't profile stage '{name}': another profiler is active")
+            return
+
+        started_tracing = False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+
+        self._local.current = ( name, index, profile, started_tracing )
+
+    def stage_finished(self, metrics: StageMetrics):
+        current = getattr(self._local, 'current', None)
+        if current is None or current[0] != metrics['name']:
+            return
+        (name, index, profile, started_tracing) = current
+        profile.disable()
+        self._local.current = None
+
+        snapshot = None
+        peak = None
+        if self.memory and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+
+        self.dir.mkdir(parents=True, exist_ok=True)
+        stem = self.dir / f"{index:02d}-{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}"
+
+        profile.dump_stats( f"{stem}.prof" )
+        if snapshot is not None:
+            snapshot.dump( f"{stem}.tracemalloc" )
+
+        with open(f"{stem}.txt", 'w') as f:
+            f.write( summarize(name, profile, snapshot, peak) )
+
+def summarize(
+    name: str, profile: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot=None, peak: int=None
+) -> str:
+    """
+    Summarize a stage's profile: the functions with the most cumulative
+    time and (with a snapshot) the lines with the largest allocations.
+    'peak' is the most memory traced at once during the stage, in bytes.
+    """
+    out = io.StringIO()
+    out.write(f"Stage: {name}\n\n")
+
+    stats = pstats.Stats(profile, stream=out)
+    stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+
+    if peak is not None:
+        out.write(f"Peak traced memory: {peak / (1024*1024):.2f} MB\n\n")
+    if snapshot is not None:
+        out.write("Largest allocations still held at the end of the stage:\n")
+        for stat in snapshot.statistics('lineno')[:SUMMARY_LINES]:
+            out.write(f"    {stat}\n")
+
+    return out.getvalue()
+
+@contextmanager
+def profiled(dir: Path, stages: T.Iterable[str]=None, memory: bool=True) -> T.Iterator[Profiler]:
+    """
+    Profile every stage (or just the named 'stages') run in a block,
+    writing the results to 'dir' (see Profiler)
+    """
+    with collecting( Profiler(dir, stages, memory) ) as profiler:
+        yield profiler
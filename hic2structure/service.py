@@ -0,0 +1,441 @@
+"""
+Module for serving structures over HTTP.
+
+A StructureService keeps opened Hi-C files, extracted contact records and
+finished structures in memory (in LRU caches), so repeated requests for
+the same file don't re-read its metadata or re-extract its records.
+Simulations are queued onto a bounded pool of workers.
+
+The server is a minimal HTTP/1.1 implementation on asyncio, so it doesn't
+need any extra dependencies. It's meant to run locally (e.g. behind a web
+viewer), not to be exposed publicly. Endpoints (all responses are JSON):
+
+    GET  /files
+        The .hic files in the data directory
+    GET  /metadata?file=NAME
+        The file's metadata (see HICMetadata.to_dict)
+    GET  /contacts?file=NAME&chromosome=X[&resolution=...&count_threshold=...
+                  &normalization=...&matrix_type=...]
+        Contact records, as a list of [x, y, count] rows
+    POST /structures
+        Start a simulation. The body is a JSON object with 'file' and
+        'chromosome', and optionally 'resolution', 'count_threshold',
+        'normalization', 'matrix_type', 'bond_coeff', 'bond_bins',
+        'bond_mapping', 'timesteps' and 'seed', and the contact limits
+        'min_separation', 'stratum_quantile', 'max_degree' and
+        'max_contacts' (see select_contacts). The limits can also be given
+        to /contacts. Returns the job, with its 'id'.
+        If the same simulation was already run, the job is already done.
+    GET  /structures/ID
+        The job's status ('queued', 'running', 'done' or 'failed') and,
+        once it's done, the 'structure' as a list of [id, x, y, z] rows
+
+Files are named relative to the data directory, and paths outside of it
+are rejected.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import typing as T
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+from .types import Settings, ContactRecords, LAMMPSTimestep
+from .hic import HIC, HICError
+from .lammps import run_lammps
+from .contactmap import ContactMap
+from .contacts import SELECTION_SETTINGS
+
+log = logging.getLogger(__name__)
+
+#
+# Defaults for settings left out of a request
+#
+DEFAULT_SETTINGS = {
+    'resolution': 200000,
+    'count_threshold': 2.0,
+    'normalization': 'KR',
+    'matrix_type': 'observed',
+    'bond_coeff': 55,
+    'bond_bins': 0,
+    'bond_mapping': 'log',
+    'timesteps': 1000000,
+}
+
+#
+# Optional settings that can be given in a request, and their types
+#
+SELECTION_KINDS = {
+    'min_separation': int,
+    'stratum_quantile': float,
+    'max_degree': int,
+    'max_contacts': int,
+}
+
+# Largest request body accepted, in bytes
+MAX_BODY = 1 << 20
+
+class ServiceError(Exception):
+    '''
+    An error to report to the client, with an HTTP status code
+    '''
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class _LRU:
+    """
+    A thread-safe mapping that holds at most 'size' items, discarding
+    the least recently used one first
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+class StructureService:
+    """
+    Serves contact records and simulated structures for the Hi-C files
+    in 'data_dir'. At most 'workers' simulations run at once, and at most
+    'max_queue' can be waiting for a worker.
+
+    If no seed is given in a request, 'default_seed' is used, so the same
+    request gives (and can reuse) the same structure. If 'result_cache' is
+    given (a cache.ResultCache), structures are also cached on disk.
+    Other options are passed to run_lammps.
+    """
+
+    def __init__(
+        self, data_dir: Path, lammps_exec: str='lmp',
+        workers: int=1, max_queue: int=64,
+        hic_cache: int=16, records_cache: int=64, structure_cache: int=256,
+        default_seed: int=0, result_cache=None, **options
+    ):
+        self.data_dir = Path(data_dir).resolve()
+        self.lammps_exec = lammps_exec
+        self.max_queue = max_queue
+        self.default_seed = default_seed
+        self.result_cache = result_cache
+        self.options = options
+
+        self.hics = _LRU(hic_cache)
+        self.records = _LRU(records_cache)
+        self.results = _LRU(structure_cache) # Finished jobs, by id
+        self.active: T.Dict[str, dict] = {}  # Queued and running jobs, by id
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    ########################
+    # DATA
+    ########################
+
+    def _resolve(self, file: str) -> Path:
+        """
+        Resolve a file name relative to the data directory
+        """
+        if not file:
+            raise ServiceError(400, "No file given")
+        path = (self.data_dir / file).resolve()
+        if not path.is_relative_to(self.data_dir):
+            raise ServiceError(403, f"'{file}' is outside of the data directory")
+        if not path.is_file():
+            raise ServiceError(404, f"File '{file}' does not exist")
+        return path
+
+    def files(self) -> T.List[str]:
+        """
+        The Hi-C files in the data directory (and its subdirectories)
+        """
+        return sorted(
+            str(p.relative_to(self.data_dir)) for p in self.data_dir.rglob('*.hic')
+        )
+
+    def hic(self, file: str) -> HIC:
+        """
+        Open a Hi-C file (or get it from the cache)
+        """
+        path = self._resolve(file)
+        hic = self.hics.get(path)
+        if hic is None:
+            try:
+                hic = HIC(path)
+            except HICError as e:
+                raise ServiceError(400, str(e))
+            self.hics.put(path, hic)
+        return hic
+
+    def contact_records(self, file: str, settings: Settings) -> ContactRecords:
+        """
+        Extract contact records from a Hi-C file (or get them from the cache)
+        """
+        hic = self.hic(file)
+        key = (
+            hic.path, settings['chromosome'], settings['resolution'], settings['count_threshold'],
+            settings['normalization'], settings['matrix_type'],
+            *( settings.get(name) for name in SELECTION_SETTINGS )
+        )
+        records = self.records.get(key)
+        if records is None:
+            try:
+                records = hic.get_contact_records(settings)
+            except (HICError, ValueError, RuntimeError) as e:
+                raise ServiceError(400, str(e))
+            self.records.put(key, records)
+        return records
+
+    def settings(self, request: dict) -> T.Tuple[str, Settings]:
+        """
+        Get the file name and Settings from a request, filling in defaults
+        """
+        try:
+            settings = Settings(
+                chromosome=str(request['chromosome']),
+                resolution=int( request.get('resolution', DEFAULT_SETTINGS['resolution']) ),
+                count_threshold=float( request.get('count_threshold', DEFAULT_SETTINGS['count_threshold']) ),
+                normalization=str( request.get('normalization', DEFAULT_SETTINGS['normalization']) ),
+                matrix_type=str( request.get('matrix_type', DEFAULT_SETTINGS['matrix_type']) ),
+                distance_threshold=0,
+                bond_coeff=int( request.get('bond_coeff', DEFAULT_SETTINGS['bond_coeff']) ),
+                bond_bins=int( request.get('bond_bins', DEFAULT_SETTINGS['bond_bins']) ),
+                bond_mapping=str( request.get('bond_mapping', DEFAULT_SETTINGS['bond_mapping']) ),
+                timesteps=int( request.get('timesteps', DEFAULT_SETTINGS['timesteps']) ),
+                seed=int( request.get('seed', self.default_seed) )
+            )
+            # Optional limits on the contacts used (see select_contacts)
+            for (name, kind) in SELECTION_KINDS.items():
+                if request.get(name) is not None:
+                    settings[name] = kind(request[name])
+        except KeyError as e:
+            raise ServiceError(400, f"Missing {e}")
+        except (TypeError, ValueError) as e:
+            raise ServiceError(400, f"Invalid setting: {e}")
+        return ( str(request.get('file', '')), settings )
+
+    ########################
+    # SIMULATIONS
+    ########################
+
+    def _job_id(self, file: str, settings: Settings) -> str:
+        path = self._resolve(file)
+        return hashlib.sha256(
+            json.dumps( [str(path), settings], sort_keys=True ).encode('utf-8')
+        ).hexdigest()[:16]
+
+    def _simulate(self, job: dict) -> LAMMPSTimestep:
+        """
+        Run a simulation for a job (in a worker thread)
+        """
+        job['status'] = 'running'
+        records = ContactMap.from_records( self.contact_records(job['file'], job['settings']) )
+        if self.result_cache is not None:
+            from .cache import run_lammps_cached
+            (data, _) = run_lammps_cached(
+                self.result_cache, records, job['settings'], self.lammps_exec, **self.options
+            )
+        else:
+            data = run_lammps(records, job['settings'], self.lammps_exec, **self.options)
+        return data[ sorted(data.keys())[-1] ]
+
+    def submit(self, request: dict) -> dict:
+        """
+        Queue a simulation (unless the same one is already queued, running
+        or done). Returns the job.
+        """
+        (file, settings) = self.settings(request)
+        id = self._job_id(file, settings)
+
+        job = self.active.get(id) or self.results.get(id)
+        if job is not None and job['status'] != 'failed':
+            return job
+        if len(self.active) >= self.max_queue:
+            raise ServiceError(503, "Too many simulations are queued. Try again later.")
+
+        job = { 'id': id, 'file': file, 'settings': settings, 'status': 'queued', 'error': '' }
+        self.active[id] = job
+        future = asyncio.get_running_loop().run_in_executor(self.pool, self._simulate, job)
+        future.add_done_callback( lambda f: self._finished(job, f) )
+        return job
+
+    def _finished(self, job: dict, future: asyncio.Future):
+        try:
+            job['structure'] = future.result()
+            job['status'] = 'done'
+        except ServiceError as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        except Exception as e:
+            # Anything else (usually a LAMMPSError). The job is reported as
+            # failed, rather than being left queued forever
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            log.info(f"Simulation {job['id']} failed: {e}")
+        self.active.pop(job['id'], None)
+        self.results.put(job['id'], job)
+
+    @staticmethod
+    def describe(job: dict) -> dict:
+        """
+        A job, as returned to clients
+        """
+        description = {
+            'id': job['id'],
+            'file': job['file'],
+            'settings': job['settings'],
+            'status': job['status'],
+            'error': job['error'],
+        }
+        if job['status'] == 'done':
+            data = job['structure']
+            data = data[ data[:,0].argsort() ]
+            description['structure'] = [
+                [ int(row[0]), float(row[1]), float(row[2]), float(row[3]) ]
+                for row in data
+            ]
+        return description
+
+    ########################
+    # REQUESTS
+    ########################
+
+    async def handle(self, method: str, target: str, body: bytes) -> T.Tuple[int, T.Any]:
+        """
+        Handle a request, returning a (status, JSON payload) tuple
+        """
+        url = urlsplit(target)
+        query = { k: v[-1] for (k, v) in parse_qs(url.query).items() }
+        parts = [ p for p in url.path.split('/') if p ]
+        loop = asyncio.get_running_loop()
+
+        try:
+            if method == 'GET' and parts == ['files']:
+                files = await loop.run_in_executor( None, self.files )
+                return ( 200, { 'files': files } )
+
+            if method == 'GET' and parts == ['metadata']:
+                hic = await loop.run_in_executor( None, self.hic, query.get('file', '') )
+                return ( 200, hic.metadata.to_dict() )
+
+            if method == 'GET' and parts == ['contacts']:
+                (file, settings) = self.settings(query)
+                records = await loop.run_in_executor( None, self.contact_records, file, settings )
+                return ( 200, {
+                    'file': file,
+                    'settings': settings,
+                    'records': [ [int(x), int(y), float(c)] for (x, y, c) in records ]
+                })
+
+            if method == 'POST' and parts == ['structures']:
+                try:
+                    request = json.loads(body or b'{}')
+                except ValueError:
+                    raise ServiceError(400, "Request body must be a JSON object")
+                if not isinstance(request, dict):
+                    raise ServiceError(400, "Request body must be a JSON object")
+                job = self.submit(request)
+                return ( 200 if job['status'] == 'done' else 202, self.describe(job) )
+
+            if method == 'GET' and len(parts) == 2 and parts[0] == 'structures':
+                job = self.active.get(parts[1]) or self.results.get(parts[1])
+                if job is None:
+                    raise ServiceError(404, f"No simulation with id '{parts[1]}'")
+                return ( 200, self.describe(job) )
+
+            raise ServiceError(404, f"No such endpoint: {method} {url.path}")
+        except ServiceError as e:
+            return ( e.status, { 'error': str(e) } )
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Handle a single HTTP connection (one request per connection)
+        """
+        try:
+            try:
+                request_line = (await reader.readline()).decode('latin-1').split()
+                if len(request_line) != 3:
+                    raise ServiceError(400, "Malformed request")
+                (method, target, _) = request_line
+
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    (name, _, value) = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int( headers.get('content-length', 0) )
+                if length > MAX_BODY:
+                    raise ServiceError(413, "Request body is too large")
+                body = await reader.readexactly(length) if length else b''
+                (status, payload) = await self.handle(method.upper(), target, body)
+            except ServiceError as e:
+                (status, payload) = ( e.status, { 'error': str(e) } )
+            except (ValueError, asyncio.IncompleteReadError):
+                (status, payload) = ( 400, { 'error': "Malformed request" } )
+            except Exception as e:
+                log.exception(f"Error handling request: {e}")
+                (status, payload) = ( 500, { 'error': "Internal error" } )
+
+            content = json.dumps(payload).encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + content
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str='127.0.0.1', port: int=8000):
+        """
+        Serve requests until cancelled
+        """
+        server = await asyncio.start_server(self._connection, host, port)
+        log.info(f"Serving {self.data_dir} on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+_REASONS = {
+    200: 'OK', 202: 'Accepted', 400: 'Bad Request', 403: 'Forbidden',
+    404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error',
+    503: 'Service Unavailable'
+}
+
+def run_service(data_dir: Path, host: str='127.0.0.1', port: int=8000, **options):
+    """
+    Run a StructureService until interrupted. Options are passed
+    to StructureService.
+    """
+    service = StructureService(data_dir, **options)
+    try:
+        asyncio.run( service.serve(host, port) )
+    finally:
+        service.close()
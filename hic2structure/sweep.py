@@ -0,0 +1,201 @@
+"""
+Module for running parameter sweeps.
+
+A sweep runs a simulation for every point in a grid of Settings. Work is
+shared between the points wherever possible: contact records are read from
+the Hi-C file once for each chromosome/resolution (and filtered for each
+count threshold in memory, with every normalization computed from the same
+decoded records) and every simulation on the same chromosome starts from
+the same initial conformation.
+"""
+
+import csv
+import itertools
+import time
+import typing as T
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .types import Settings, ContactRecords
+from .hic import HIC, HICError
+from .lammps import LAMMPSError, run_lammps, initial_conformation, seed_streams
+from .contactmap import ContactMap
+from .contacts import (
+    contact_records_to_set, filter_contact_records, select_contacts,
+    find_contacts, compare_contacts
+)
+from .out import write_structure
+
+class SweepResult(T.TypedDict):
+    '''
+    The result of a single point in a sweep
+    '''
+    point: int
+    chromosome: str
+    resolution: int
+    count_threshold: float
+    normalization: str
+    matrix_type: str
+    bond_coeff: int
+    bond_bins: int
+    timesteps: int
+    seed: T.Optional[int]
+    contacts: int
+    status: str # 'ok' or 'failed'
+    error: str
+    wall_time: float
+    precision: float
+    recall: float
+    f1: float
+    scc: float
+
+#
+# Columns of the sweep results table, in order
+#
+RESULT_COLUMNS = list(SweepResult.__annotations__.keys())
+
+def settings_grid(base: Settings, **axes: T.Iterable) -> T.List[Settings]:
+    """
+    Create a grid of Settings from every combination of the values given
+    for each setting. Settings without values are taken from 'base'.
+
+    For example:
+        settings_grid(base, count_threshold=[1.0, 2.0], bond_coeff=[55, 70])
+    """
+    names = list(axes.keys())
+    grid = []
+    for values in itertools.product( *(axes[name] for name in names) ):
+        settings = dict(base)
+        settings.update( zip(names, values) )
+        grid.append( Settings(**settings) )
+    return grid
+
+def _run_point(
+    point: int, settings: Settings,
+    records: ContactRecords, coords: np.ndarray,
+    outdir: Path, lammps_exec: str, fene_retries: int=0
+) -> SweepResult:
+    """
+    Run the simulation for a single point in the sweep
+    """
+    result = SweepResult(
+        point=point,
+        chromosome=settings['chromosome'],
+        resolution=settings['resolution'],
+        count_threshold=settings['count_threshold'],
+        normalization=settings.get('normalization', 'KR'),
+        matrix_type=settings.get('matrix_type', 'observed'),
+        bond_coeff=settings['bond_coeff'],
+        bond_bins=settings.get('bond_bins') or 0,
+        timesteps=settings['timesteps'],
+        seed=settings.get('seed'),
+        contacts=len(records),
+        status='failed', error='', wall_time=0.0,
+        precision=np.nan, recall=np.nan, f1=np.nan, scc=np.nan
+    )
+
+    start = time.perf_counter()
+    try:
+        if len(records) == 0:
+            raise LAMMPSError("No contact records above the count threshold")
+
+        contacts = ContactMap.from_records(records)
+        pointdir = outdir/f'point_{point:03d}'
+        pointdir.mkdir(parents=True, exist_ok=True)
+
+        data = run_lammps(
+            contacts, settings, lammps_exec,
+            copy_log_to=pointdir/'sim.log',
+            initial_coords=coords, fene_retries=fene_retries
+        )
+        last_timestep = data[ sorted(data.keys())[-1] ]
+        write_structure( pointdir/'structure.csv', last_timestep )
+
+        scores = compare_contacts(
+            find_contacts(last_timestep, settings), records,
+            num_beads=contacts.num_beads
+        )
+        for key in [ 'precision', 'recall', 'f1', 'scc' ]:
+            result[key] = scores[key]
+        result['status'] = 'ok'
+    except (HICError, LAMMPSError, OSError, ValueError, RuntimeError) as e:
+        result['error'] = str(e)
+
+    result['wall_time'] = time.perf_counter() - start
+    return result
+
+def run_sweep(
+    hic: HIC, grid: T.List[Settings], outdir: Path,
+    lammps_exec: str='lmp', workers: int=1,
+    callback: T.Callable[[SweepResult], None]=None,
+    fene_retries: int=0
+) -> T.List[SweepResult]:
+    """
+    Run a simulation for every Settings in 'grid', using a pool of 'workers'
+    simulations at once. The structure and log for each point are written to
+    a 'point_NNN' directory inside 'outdir'. If set, 'callback' is called with
+    each result as it finishes. 'fene_retries' is passed on to run_lammps.
+
+    Returns a list of results, in the same order as the grid.
+    """
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    # Read records once per chromosome/resolution/normalization/type,
+    # with the lowest threshold used (and no selection, which is applied
+    # to each point after its threshold), and share an initial conformation
+    # between every point using them (seeded by the first point's seed)
+    def group(settings: Settings) -> tuple:
+        return (
+            settings['chromosome'], settings['resolution'],
+            settings.get('normalization', 'KR'), settings.get('matrix_type', 'observed')
+        )
+
+    groups = {}
+    for settings in grid:
+        key = group(settings)
+        (threshold, seed) = groups.get( key, (np.inf, settings.get('seed')) )
+        groups[key] = ( min(threshold, settings['count_threshold']), seed )
+
+    shared = {}
+    for ( key, (threshold, seed) ) in groups.items():
+        (chromosome, resolution, normalization, matrix_type) = key
+        records = hic.get_contact_records({
+            'chromosome': chromosome,
+            'resolution': resolution,
+            'count_threshold': threshold,
+            'distance_threshold': 0,
+            'normalization': normalization,
+            'matrix_type': matrix_type
+        })
+        num_beads = ContactMap.from_set( contact_records_to_set(records) ).num_beads
+        coords = initial_conformation( num_beads, seed_streams(seed)[0] )
+        shared[key] = ( records, coords )
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for (point, settings) in enumerate(grid):
+            (records, coords) = shared[ group(settings) ]
+            records = select_contacts(
+                filter_contact_records(records, settings['count_threshold']), settings
+            )
+            future = pool.submit(
+                _run_point, point, settings, records, coords, outdir, lammps_exec,
+                fene_retries
+            )
+            if callback is not None:
+                future.add_done_callback( lambda f: callback(f.result()) )
+            futures.append(future)
+
+        return [ f.result() for f in futures ]
+
+def write_sweep_results(path: Path, results: T.List[SweepResult]):
+    """
+    Write out a csv file with a row for each result in a sweep
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
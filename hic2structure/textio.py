@@ -0,0 +1,168 @@
+"""
+Module for writing (and reading back) large, optionally compressed
+text files. These are shared by the output and simulation modules.
+"""
+
+import functools
+import gzip
+import os
+import queue
+import threading
+import typing as T
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pathlib import Path
+
+from .formats import TEXT_COMPRESSIONS
+
+#
+# Amount of text (in characters) TextWriter collects into each block
+# before compressing and writing it
+#
+TEXT_BLOCK_SIZE = 1024 * 1024
+
+#
+# Default number of threads compressing the blocks of a text file
+#
+TEXT_THREADS = min( 4, os.cpu_count() or 1 )
+
+def text_compression(path: Path, compression: str=None) -> str:
+    """
+    Determine the compression to use for a text file. If compression is
+    None, it's inferred from the path's extension (see TEXT_COMPRESSIONS)
+    """
+    if compression is not None:
+        if compression not in TEXT_COMPRESSIONS:
+            raise ValueError(
+                f"Unknown compression '{compression}'. "
+                f"Available compressions are: {list(TEXT_COMPRESSIONS.keys())}"
+            )
+        return compression
+
+    for (name, ext) in TEXT_COMPRESSIONS.items():
+        if ext and Path(path).suffix == ext:
+            return name
+    return 'none'
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression needs the 'zstandard' package") from None
+    return zstandard
+
+def _compressor(compression: str, level: int=None) -> T.Optional[T.Callable[[bytes], bytes]]:
+    """
+    A function that compresses a block of a text file on its own (so
+    compressed blocks can simply be concatenated), or None for 'none'
+    """
+    if compression == 'gzip':
+        return functools.partial( gzip.compress, compresslevel=6 if level is None else level, mtime=0 )
+    if compression == 'zstd':
+        zstandard = _zstandard()
+        level = 3 if level is None else level
+        # A compressor can't be shared between threads
+        return lambda block: zstandard.ZstdCompressor(level=level).compress(block)
+    return None
+
+def open_text(path: Path, compression: str=None) -> T.TextIO:
+    """
+    Open a (possibly compressed) text file for reading
+    """
+    compression = text_compression(path, compression)
+    if compression == 'gzip':
+        return gzip.open(path, 'rt')
+    if compression == 'zstd':
+        return _zstandard().open(path, 'rt')
+    return open(path, 'r')
+
+class TextWriter:
+    """
+    Writes a text file in large blocks, optionally compressed (with
+    'compression', or inferred from the path, see TEXT_COMPRESSIONS).
+
+    Text is collected until there's a block of it (see TEXT_BLOCK_SIZE).
+    Each block is compressed by a pool of 'threads' threads, and a
+    background thread writes the results to the file in order, so the
+    caller can format the next block while earlier ones are compressed and
+    written. At most two blocks per thread are waiting at once.
+    """
+
+    def __init__(
+        self, path: Path, compression: str=None, threads: int=TEXT_THREADS,
+        level: int=None, block_size: int=TEXT_BLOCK_SIZE
+    ):
+        self.path = Path(path)
+        self.compression = text_compression(path, compression)
+        self.block_size = block_size
+
+        self._compress = _compressor(self.compression, level)
+        threads = max(threads, 1)
+        self._pool = ThreadPoolExecutor(threads) if self._compress else None
+        self._queue: queue.Queue = queue.Queue( maxsize=2*threads )
+        self._buffer: T.List[str] = []
+        self._buffered = 0
+        self._error: T.Optional[BaseException] = None
+
+        self._file = open(self.path, 'wb')
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _drain(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            if self._error is not None:
+                continue # Keep draining so the writer doesn't block
+            try:
+                self._file.write( block.result() if isinstance(block, Future) else block )
+            except BaseException as e:
+                self._error = e
+
+    def _flush(self):
+        if self._error is not None:
+            raise self._error
+        if not self._buffer:
+            return
+
+        block = ''.join(self._buffer).encode('utf-8')
+        self._buffer = []
+        self._buffered = 0
+        self._queue.put( self._pool.submit(self._compress, block) if self._pool else block )
+
+    def write(self, text: str):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.block_size:
+            self._flush()
+
+    def close(self):
+        try:
+            self._flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._file.close()
+
+        if self._error is not None:
+            raise self._error
+
+def write_rows(f, fmt: str, *columns, chunk_size: int=65536):
+    """
+    Write the given columns to a text file (or TextWriter), 'chunk_size'
+    rows at a time. Each row is formatted with 'fmt' (which shouldn't
+    include a newline)
+    """
+    for start in range(0, len(columns[0]), chunk_size):
+        chunk = [ c[start:start+chunk_size].tolist() for c in columns ]
+        f.write( '\n'.join( fmt % row for row in zip(*chunk) ) )
+        f.write( '\n' )
@@ -0,0 +1,308 @@
+"""
+Module for compact, compressed trajectory files.
+
+A trajectory file stores a series of LAMMPS timesteps much more compactly
+than a LAMMPS dump. Frames are grouped into chunks which are compressed
+independently, and an index at the end of the file records where each
+chunk (and each timestep) is, so any frame can be read back without
+decoding the rest of the file.
+
+Layout:
+    8 bytes  Magic string (b'H2STRAJ1')
+    8 bytes  Offset of the index (little-endian uint64)
+    ...      Compressed blobs (atom IDs, then one blob per chunk)
+    ...      Index (JSON)
+
+Coordinates can be stored as float32 or quantized to int16 (scaled
+to the range of coordinates in each chunk). With delta encoding, each
+frame in a chunk is stored as the difference from the previous frame,
+which usually compresses much better. Deltas are taken on the integer
+representation, so they're lossless.
+"""
+
+import bz2
+import json
+import lzma
+import struct
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+
+from .types import LAMMPSTimestep, CompactTimestep, AnyTimestep
+from .formats import PRECISIONS
+
+MAGIC = b'H2STRAJ1'
+VERSION = 1
+
+#
+# Available compression methods, mapped to (compress, decompress) functions
+#
+COMPRESSIONS = {
+    'zlib': ( lambda b: zlib.compress(b, 6),  zlib.decompress ),
+    'lzma': ( lzma.compress,                  lzma.decompress ),
+    'bz2':  ( bz2.compress,                   bz2.decompress  ),
+    'none': ( bytes,                          bytes           ),
+}
+
+# Offset that shifts quantized values into the int16 range
+_QUANT_OFFSET = 32767
+_QUANT_STEPS  = 65534
+
+class TrajectoryError(Exception):
+    pass
+
+########################
+# ENCODING
+########################
+
+def _delta_encode(ints: np.ndarray) -> np.ndarray:
+    """
+    Replace each frame (after the first) with its difference from the
+    previous frame. Integer overflow wraps around, which the decoding
+    undoes exactly.
+    """
+    deltas = ints.copy()
+    deltas[1:] -= ints[:-1]
+    return deltas
+
+def _delta_decode(deltas: np.ndarray) -> np.ndarray:
+    return np.cumsum(deltas, axis=0, dtype=deltas.dtype)
+
+def _encode_coords(coords: np.ndarray, precision: str):
+    """
+    Convert a (frames, beads, 3) array of coordinates into an integer array,
+    returning the array along with the origin and scale used for quantizing
+    (which are None for float32)
+    """
+    if precision == 'float32':
+        return ( coords.astype(np.float32).view(np.int32), None, None )
+
+    origin = float(coords.min())
+    span = float(coords.max()) - origin
+    scale = span / _QUANT_STEPS if span > 0 else 1.0
+    quantized = np.rint( (coords - origin) / scale ) - _QUANT_OFFSET
+    return ( quantized.astype(np.int16), origin, scale )
+
+def _decode_coords(ints: np.ndarray, precision: str, origin, scale) -> np.ndarray:
+    if precision == 'float32':
+        return ints.view(np.float32)
+    return (ints.astype(np.float64) + _QUANT_OFFSET) * scale + origin
+
+########################
+# WRITING
+########################
+
+class TrajectoryWriter:
+    """
+    Writes LAMMPS timesteps into a trajectory file, one frame at a time.
+    Use as a context manager, or call close() when finished.
+    """
+
+    def __init__(
+        self, path: Path,
+        precision: str='float32', delta: bool=False,
+        compression: str='zlib', frames_per_chunk: int=16
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision '{precision}'. "
+                f"Available precisions are: {PRECISIONS}"
+            )
+        if compression not in COMPRESSIONS:
+            raise ValueError(
+                f"Unknown compression '{compression}'. "
+                f"Available compressions are: {list(COMPRESSIONS.keys())}"
+            )
+        if frames_per_chunk < 1:
+            raise ValueError("frames_per_chunk must be at least 1")
+
+        self.path = Path(path)
+        self.precision = precision
+        self.delta = delta
+        self.compression = compression
+        self.frames_per_chunk = frames_per_chunk
+
+        self._compress = COMPRESSIONS[compression][0]
+        self._ids = None
+        self._pending = []
+        self._frames = []
+        self._chunks = []
+        self._ids_blob = None
+
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self._file.write(struct.pack('<Q', 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_blob(self, data: bytes) -> dict:
+        blob = self._compress(data)
+        offset = self._file.tell()
+        self._file.write(blob)
+        return { 'offset': offset, 'length': len(blob) }
+
+    def append(self, timestep: int, data: AnyTimestep):
+        """
+        Add a frame to the trajectory. Every frame must have the same set
+        of atom IDs.
+        """
+        if isinstance(data, CompactTimestep):
+            data = data.to_timestep()
+        data = data[ np.argsort(data[:,0], kind='stable') ]
+        ids = data[:,0].astype(np.int32)
+
+        if self._ids is None:
+            self._ids = ids
+            self._ids_blob = self._write_blob(ids.tobytes())
+        elif not np.array_equal(ids, self._ids):
+            raise TrajectoryError(
+                f"Atoms in timestep {timestep} don't match the rest of the trajectory"
+            )
+
+        self._frames.append({
+            'timestep': int(timestep),
+            'chunk': len(self._chunks),
+            'position': len(self._pending)
+        })
+        self._pending.append(data)
+        if len(self._pending) >= self.frames_per_chunk:
+            self._flush_chunk()
+
+    def _flush_chunk(self):
+        if not self._pending:
+            return
+
+        frames = np.stack(self._pending)
+        coords, origin, scale = _encode_coords(frames[:,:,1:4], self.precision)
+        images = frames[:,:,4:7].astype(np.int16)
+        if self.delta:
+            coords = _delta_encode(coords)
+            images = _delta_encode(images)
+
+        chunk = self._write_blob( coords.tobytes() + images.tobytes() )
+        chunk.update({ 'frames': len(self._pending), 'origin': origin, 'scale': scale })
+        self._chunks.append(chunk)
+        self._pending = []
+
+    def close(self):
+        """
+        Flush any remaining frames and write out the index
+        """
+        if self._file.closed:
+            return
+        self._flush_chunk()
+
+        index = {
+            'version': VERSION,
+            'precision': self.precision,
+            'delta': self.delta,
+            'compression': self.compression,
+            'num_atoms': 0 if self._ids is None else len(self._ids),
+            'ids': self._ids_blob,
+            'frames': self._frames,
+            'chunks': self._chunks,
+        }
+        index_offset = self._file.tell()
+        self._file.write( json.dumps(index).encode('utf-8') )
+        self._file.seek(len(MAGIC))
+        self._file.write( struct.pack('<Q', index_offset) )
+        self._file.close()
+
+########################
+# READING
+########################
+
+class TrajectoryReader(Mapping):
+    """
+    Reads frames from a trajectory file. This is a mapping from integer
+    timesteps to LAMMPSTimesteps (like a LAMMPSTimeseries) but frames are
+    only decoded when they are accessed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise TrajectoryError(f"'{path}' is not a trajectory file")
+        (index_offset,) = struct.unpack('<Q', self._file.read(8))
+        if index_offset == 0:
+            self._file.close()
+            raise TrajectoryError(f"'{path}' is incomplete (it was never closed)")
+
+        self._file.seek(index_offset)
+        self.index = json.loads( self._file.read().decode('utf-8') )
+        if self.index['version'] != VERSION:
+            self._file.close()
+            raise TrajectoryError(
+                f"Unsupported trajectory version: {self.index['version']}"
+            )
+
+        self.precision = self.index['precision']
+        self._decompress = COMPRESSIONS[ self.index['compression'] ][1]
+        self._frames = { f['timestep']: f for f in self.index['frames'] }
+        self._cached_chunk = ( None, None )
+
+        if self.index['ids'] is not None:
+            self.ids = np.frombuffer(self._read_blob(self.index['ids']), dtype=np.int32)
+        else:
+            self.ids = np.zeros(0, dtype=np.int32)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _read_blob(self, blob: dict) -> bytes:
+        self._file.seek(blob['offset'])
+        return self._decompress( self._file.read(blob['length']) )
+
+    def _read_chunk(self, number: int) -> np.ndarray:
+        """
+        Decode a chunk into an array of LAMMPSTimestep rows, indexed by
+        (frame, atom, column). The most recently read chunk is cached.
+        """
+        if self._cached_chunk[0] == number:
+            return self._cached_chunk[1]
+
+        chunk = self.index['chunks'][number]
+        raw = self._read_blob(chunk)
+        shape = ( chunk['frames'], len(self.ids), 3 )
+        coord_type = np.int32 if self.precision == 'float32' else np.int16
+        split = int(np.prod(shape)) * np.dtype(coord_type).itemsize
+
+        coords = np.frombuffer(raw[:split], dtype=coord_type).reshape(shape)
+        images = np.frombuffer(raw[split:], dtype=np.int16).reshape(shape)
+        if self.index['delta']:
+            coords = _delta_decode(coords)
+            images = _delta_decode(images)
+
+        frames = np.empty( (shape[0], shape[1], 7) )
+        frames[:,:,0] = self.ids
+        frames[:,:,1:4] = _decode_coords(coords, self.precision, chunk['origin'], chunk['scale'])
+        frames[:,:,4:7] = images
+
+        self._cached_chunk = ( number, frames )
+        return frames
+
+    def __getitem__(self, timestep: int) -> LAMMPSTimestep:
+        frame = self._frames[timestep]
+        chunk = self._read_chunk(frame['chunk'])
+        return LAMMPSTimestep( chunk[ frame['position'] ].copy() )
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
@@ -36,12 +36,97 @@ ContactSet = T.NewType('ContactSet', npt.NDArray[np.int64])
 #
 LAMMPSTimestep = T.NewType('LAMMPSTimestep', npt.NDArray[np.float64])
 
+class CompactTimestep(T.NamedTuple):
+    '''
+    A LAMMPSTimestep stored column by column, with compact types: int32 ids,
+    float32 (n, 3) coordinates and int16 (n, 3) image flags, which is 22
+    bytes per bead rather than 56. The columns are usually read-only views
+    of a memory-mapped file (see lammps.CompactDump).
+
+    Functions that only need the columns of a timestep (find_contacts,
+    write_structure, unwrap_coordinates, ...) accept either kind of
+    timestep, through timestep_columns.
+    '''
+    ids: npt.NDArray[np.int32]
+    coords: npt.NDArray[np.float32]
+    images: npt.NDArray[np.int16]
+
+    @property
+    def num_beads(self) -> int:
+        return len(self.ids)
+
+    def take(self, indices: np.ndarray) -> 'CompactTimestep':
+        '''
+        The rows at the given indices (a copy)
+        '''
+        return CompactTimestep( self.ids[indices], self.coords[indices], self.images[indices] )
+
+    def to_timestep(self) -> LAMMPSTimestep:
+        '''
+        Convert to a (float64, 7-column) LAMMPSTimestep
+        '''
+        data = np.empty( (len(self.ids), 7) )
+        data[:,0] = self.ids
+        data[:,1:4] = self.coords
+        data[:,4:7] = self.images
+        return LAMMPSTimestep(data)
+
+AnyTimestep = T.Union[LAMMPSTimestep, CompactTimestep]
+
+def timestep_columns(data: AnyTimestep) -> T.Tuple[np.ndarray, np.ndarray, T.Optional[np.ndarray]]:
+    '''
+    The (ids, coords, images) columns of a LAMMPSTimestep or CompactTimestep,
+    as views (without copying). images is None for arrays with only the
+    id, x, y, z columns (such as from out.read_structure).
+    '''
+    if isinstance(data, CompactTimestep):
+        return ( data.ids, data.coords, data.images )
+    images = data[:,4:7] if data.shape[1] >= 7 else None
+    return ( data[:,0], data[:,1:4], images )
+
 #
 # Represents a series of LAMMPSTimesteps, mapping integer
 # timesteps to LAMMPSTimestep values
 #
 LAMMPSTimeseries = Mapping[int, LAMMPSTimestep]
 
+########################
+# RESULT TYPES
+########################
+
+class ContactComparison(T.TypedDict):
+    '''
+    Scores comparing a simulated contact map to an experimental one.
+
+    The correlations are "distance-stratified": they're computed separately
+    for each genomic separation (i.e. each diagonal of the contact map) and
+    'separations' lists the separation for each entry of 'pearson' and
+    'spearman'. A correlation is NaN when either map is constant
+    along that diagonal.
+    '''
+    precision: float
+    recall: float
+    f1: float
+    separations: npt.NDArray[np.int64]
+    pearson: npt.NDArray[np.float64]
+    spearman: npt.NDArray[np.float64]
+    scc: float
+
+class StructureStatistics(T.TypedDict):
+    '''
+    Statistics over the frames of a simulation (see the analytics module).
+    'timesteps' and 'radius_of_gyration' have an entry per frame and
+    'end_to_end' has a row per frame, with an entry per chain.
+    'mean_distance' has an entry for each of 'separations' (in beads) and
+    'msd' has an entry per bead (in order of id).
+    '''
+    timesteps: npt.NDArray[np.int64]
+    radius_of_gyration: npt.NDArray[np.float64]
+    end_to_end: npt.NDArray[np.float64]
+    separations: npt.NDArray[np.int64]
+    mean_distance: npt.NDArray[np.float64]
+    msd: npt.NDArray[np.float64]
+
 ########################
 # SETTINGS TYPES
 ########################
@@ -55,6 +140,21 @@ class ContactRecordSettings(T.TypedDict):
     count_threshold: float
     distance_threshold: float
     resolution: int
+    # Normalization and type of the values read (see NORMALIZATIONS and
+    # MATRIX_TYPES in the formats module). These default to 'KR' and
+    # 'observed' when left out.
+    normalization: str
+    matrix_type: str
+    # Optional limits on which records are kept, applied after the count
+    # threshold (see select_contacts in the contacts module)
+    min_separation: T.Optional[int]
+    stratum_quantile: T.Optional[float]
+    max_degree: T.Optional[int]
+    max_contacts: T.Optional[int]
+    # Chromosomes for a whole-genome simulation, with a chain for each
+    # (see get_genome_contact_records). None (or leaving it out)
+    # simulates 'chromosome' on its own.
+    chromosomes: T.Optional[T.List[str]]
 
 class LAMMPSSettings(T.TypedDict):
     '''
@@ -63,6 +163,15 @@ class LAMMPSSettings(T.TypedDict):
     '''
     bond_coeff: int
     timesteps: int
+    # Seed for the initial conformation and the LAMMPS thermostat.
+    # None (or leaving it out) gives a different run every time.
+    seed: T.Optional[int]
+    # Number of contact bond types, with contacts binned by their counts
+    # and stronger contacts given stiffer bonds (see contact_bond_types).
+    # 0 or 1 (or leaving it out) gives every contact the same bond.
+    bond_bins: int
+    # How counts are binned (see BOND_MAPPINGS). Defaults to 'log'.
+    bond_mapping: str
 
 class Settings(ContactRecordSettings, LAMMPSSettings):
     '''
@@ -6,4 +6,9 @@ setuptools.setup(
     description="4D Genome Toolkit.",
     url="https://github.com/4DGB/3DStructure",
     packages=[ "hic2structure" ],
+    entry_points={
+        "console_scripts": [
+            "hic2structure = hic2structure.__main__:main",
+        ],
+    },
 )
@@ -0,0 +1,199 @@
+import struct
+import zlib
+from pathlib import Path
+import typing as T
+
+import numpy as np
+import pytest
+
+"""
+Fixtures for the tests, including a writer for small Hi-C files
+"""
+
+########################
+# HI-C FILES
+########################
+
+def _cstr(s: str) -> bytes:
+    return s.encode('utf-8') + b'\0'
+
+def _block(records: np.ndarray) -> bytes:
+    """
+    Encode a block of (binX, binY, counts) records, as a list of rows
+    (the layout hic-straw reads for version 8 files), compressed
+    """
+    data = struct.pack('<i', len(records))
+    data += struct.pack('<ii', 0, 0) # x and y offsets
+    data += struct.pack('<b', 1) # Counts are floats (0 would mean shorts)
+    data += struct.pack('<b', 1) # Block type: list of rows
+
+    rows = np.unique(records[:,1])
+    data += struct.pack('<h', len(rows))
+    for y in rows:
+        row = records[ records[:,1] == y ]
+        data += struct.pack('<hh', int(y), len(row))
+        for x, _, counts in row:
+            data += struct.pack('<hf', int(x), counts)
+
+    return zlib.compress(data)
+
+def write_hic(
+    path: Path,
+    chromosomes: T.Dict[str, int],
+    resolution: int,
+    matrices: T.Dict[T.Tuple[int,int], np.ndarray],
+    vectors: T.Dict[T.Tuple[str,int], np.ndarray],
+    expected: T.Dict[str, np.ndarray],
+    factors: T.Dict[int, float]
+):
+    """
+    Write a version 8 Hi-C file, with a single resolution.
+
+    'matrices' holds (binX, binY, counts) records, keyed by the pair of
+    chromosome indices (in the order of 'chromosomes'). Each is written
+    as a single block. 'vectors' holds normalization vectors keyed by
+    (normalization, chromosome index), and 'expected' holds expected
+    values keyed by normalization ('NONE' for the unnormalized ones), with
+    the normalization factors in 'factors' applying to all of them.
+    """
+    header = b'HIC\0' + struct.pack('<i', 8)
+    rest = _cstr('test')
+    rest += struct.pack('<i', 0) # Attributes
+    rest += struct.pack('<i', len(chromosomes))
+    for name, length in chromosomes.items():
+        rest += _cstr(name) + struct.pack('<i', length)
+    rest += struct.pack('<ii', 1, resolution)
+    rest += struct.pack('<i', 0) # Fragment resolutions
+
+    body = bytearray( header + struct.pack('<q', 0) + rest )
+
+    # Contact matrices, each with a single zoom level and block
+    index = []
+    for (c1, c2), records in matrices.items():
+        block = _block(records)
+        block_pos = len(body)
+        body += block
+
+        nbins = max( chromosomes[name] for name in chromosomes ) // resolution + 1
+        matrix_pos = len(body)
+        body += struct.pack('<iii', c1, c2, 1)
+        body += _cstr('BP') + struct.pack('<i', 0)
+        body += struct.pack('<ffff', records[:,2].sum(), len(records), 0, 0)
+        body += struct.pack('<iii', resolution, nbins, 1)
+        body += struct.pack('<i', 1) + struct.pack('<iqi', 0, block_pos, len(block))
+        index.append( (f"{c1}_{c2}", matrix_pos, len(body) - matrix_pos) )
+
+    # Normalization vectors
+    norm_index = []
+    for (norm, c), vector in vectors.items():
+        pos = len(body)
+        body += struct.pack('<i', len(vector)) + struct.pack(f"<{len(vector)}d", *vector)
+        norm_index.append( (norm, c, pos, len(body) - pos) )
+
+    def pack_expected(values):
+        data = struct.pack('<i', len(values)) + struct.pack(f"<{len(values)}d", *values)
+        data += struct.pack('<i', len(factors))
+        for c, factor in factors.items():
+            data += struct.pack('<id', c, factor)
+        return data
+
+    footer = struct.pack('<i', len(index))
+    for key, pos, size in index:
+        footer += _cstr(key) + struct.pack('<qi', pos, size)
+
+    footer += struct.pack('<i', 1 if 'NONE' in expected else 0)
+    if 'NONE' in expected:
+        footer += _cstr('BP') + struct.pack('<i', resolution) + pack_expected(expected['NONE'])
+
+    normalized = { norm: values for norm, values in expected.items() if norm != 'NONE' }
+    footer += struct.pack('<i', len(normalized))
+    for norm, values in normalized.items():
+        footer += _cstr(norm) + _cstr('BP') + struct.pack('<i', resolution) + pack_expected(values)
+
+    footer += struct.pack('<i', len(norm_index))
+    for norm, c, pos, size in norm_index:
+        footer += _cstr(norm) + struct.pack('<i', c) + _cstr('BP')
+        footer += struct.pack('<iqi', resolution, pos, size)
+
+    master_index = len(body)
+    body += struct.pack('<i', len(footer)) + footer
+    body[8:16] = struct.pack('<q', master_index)
+
+    path.write_bytes(body)
+
+RESOLUTION = 100000
+CHROMOSOMES = { 'All': 35, 'chr1': 2_000_000, 'chr2': 1_450_000 }
+
+@pytest.fixture(scope='session')
+def hic_file(tmp_path_factory) -> Path:
+    """
+    A small Hi-C file with two chromosomes, with KR and VC normalization
+    vectors and expected values, and contacts within and between them
+    """
+    rng = np.random.default_rng(7)
+    bins = { c: CHROMOSOMES[name] // RESOLUTION + 1 for c, name in enumerate(CHROMOSOMES) }
+
+    def random_records(c1, c2):
+        x, y = np.meshgrid( np.arange(bins[c1]), np.arange(bins[c2]), indexing='ij' )
+        cells = np.column_stack( (x.ravel(), y.ravel()) )
+        if c1 == c2:
+            cells = cells[ cells[:,0] <= cells[:,1] ]
+        cells = cells[ rng.random(len(cells)) < 0.6 ]
+        counts = rng.integers(1, 200, size=len(cells)).astype(np.float64)
+        return np.column_stack( (cells, counts) )
+
+    matrices = { (1,1): random_records(1,1), (1,2): random_records(1,2), (2,2): random_records(2,2) }
+
+    vectors = {}
+    for norm in ('KR', 'VC'):
+        for c in (1, 2):
+            vector = rng.uniform(0.3, 3.0, size=bins[c])
+            # Some bins are left out of the normalization, as in real files
+            vector[ rng.choice(bins[c], 2, replace=False) ] = np.nan
+            vectors[(norm, c)] = vector
+
+    # Shorter than the chromosomes, so the last value
+    # stands in for the larger distances
+    expected = {
+        norm: np.sort( rng.uniform(1.0, 100.0, size=12) )[::-1]
+        for norm in ('NONE', 'KR', 'VC')
+    }
+
+    path = tmp_path_factory.mktemp('hic') / 'test.hic'
+    write_hic(path, CHROMOSOMES, RESOLUTION, matrices, vectors, expected, { 1: 1.5, 2: 0.8 })
+    return path
+
+########################
+# STRUCTURES
+########################
+
+def make_timestep(num_beads: int, seed: int, ids: np.ndarray=None) -> np.ndarray:
+    """
+    A LAMMPSTimestep (id, x, y, z, ix, iy, iz) with random coordinates
+    (with the dump's 5 decimal places) and image flags. Rows are shuffled,
+    as in the dump of a run on several processes
+    """
+    rng = np.random.default_rng(seed)
+    if ids is None:
+        ids = np.arange(1, num_beads+1)
+    data = np.empty( (num_beads, 7) )
+    data[:,0] = rng.permutation(ids)
+    data[:,1:4] = np.round( rng.uniform(-200, 200, size=(num_beads, 3)), 5 )
+    data[:,4:7] = rng.integers(-2, 3, size=(num_beads, 3))
+    return data
+
+def sorted_by_id(data: np.ndarray) -> np.ndarray:
+    return data[ np.argsort(data[:,0]) ]
+
+def write_dump(path: Path, frames: T.Dict[int, np.ndarray]):
+    """
+    Write LAMMPSTimesteps as a LAMMPS dump, as written by the input deck
+    (see lammps.write_inputfile)
+    """
+    with open(path, 'w') as f:
+        for (timestep, data) in frames.items():
+            f.write(f'ITEM: TIMESTEP\n{timestep}\nITEM: NUMBER OF ATOMS\n{len(data)}\n')
+            f.write('ITEM: BOX BOUNDS pp pp pp\n' + '-200.0 200.0\n' * 3)
+            f.write('ITEM: ATOMS id x y z ix iy iz\n')
+            for row in data:
+                f.write('%d %.5f %.5f %.5f %d %d %d\n' % tuple(row))
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from hic2structure.analytics import (
+    StructureAnalytics, AnalyticsError, analyze_file, end_to_end_distance
+)
+from hic2structure.lammps import box_dimensions
+
+from conftest import write_dump
+
+"""
+Tests for structure analytics
+"""
+
+LENGTHS = [ 60, 25, 40 ]
+
+@pytest.fixture
+def chains() -> np.ndarray:
+    """
+    Unwrapped coordinates for three frames of three chains (random walks),
+    a long way apart, so pairs between chains would be far longer than
+    any pair within one
+    """
+    rng = np.random.default_rng(13)
+    n = sum(LENGTHS)
+    frames = []
+    for _ in range(3):
+        coords = np.concatenate([
+            np.cumsum( rng.normal(size=(length, 3)), axis=0 ) + 1000 * chain
+            for (chain, length) in enumerate(LENGTHS)
+        ])
+        frames.append(coords)
+    return np.stack(frames)
+
+def timestep(coords: np.ndarray, seed: int) -> np.ndarray:
+    """
+    A LAMMPSTimestep for unwrapped coordinates: wrapped into the
+    simulation box with image flags, with its rows shuffled
+    """
+    box = box_dimensions( len(coords) )
+    images = np.floor( (coords + box / 2) / box )
+    data = np.column_stack( (np.arange(1, len(coords)+1), coords - images * box, images) )
+    return np.random.default_rng(seed).permutation(data)
+
+def chain_slices():
+    ends = np.cumsum(LENGTHS)
+    return [ slice(end - length, end) for (end, length) in zip(ends, LENGTHS) ]
+
+def test_per_chain_statistics(chains):
+    analytics = StructureAnalytics(samples=None, lengths=LENGTHS)
+    for (i, coords) in enumerate(chains):
+        analytics.add( timestep(coords, seed=i) )
+    stats = analytics.results()
+
+    end_to_end = [
+        [ np.linalg.norm(coords[c][-1] - coords[c][0]) for c in chain_slices() ]
+        for coords in chains
+    ]
+    np.testing.assert_allclose(stats['end_to_end'], end_to_end, atol=1e-6)
+
+    # The default separations cover the longest chain
+    assert stats['separations'][0] == 1 and stats['separations'][-1] == max(LENGTHS) - 1
+    for (s, mean) in zip(stats['separations'], stats['mean_distance']):
+        distances = [
+            np.linalg.norm(coords[c][s:] - coords[c][:-s], axis=1)
+            for coords in chains for c in chain_slices() if len(coords[c]) > s
+        ]
+        assert mean == pytest.approx( np.concatenate(distances).mean() )
+
+    # The radius of gyration and MSD are of the whole structure
+    assert stats['radius_of_gyration'] == pytest.approx([
+        np.sqrt( np.mean(np.sum( (coords - coords.mean(axis=0))**2, axis=1 )) ) for coords in chains
+    ])
+    np.testing.assert_allclose(
+        stats['msd'], np.mean( np.sum( (chains[1:] - chains[0])**2, axis=2 ), axis=0 ), atol=1e-6
+    )
+
+def test_sampled_pairs_stay_on_their_chains(chains):
+    """
+    Pairs are strided (across all of the chains) at each separation, but
+    none of them span two chains
+    """
+    analytics = StructureAnalytics(samples=7, lengths=LENGTHS)
+    analytics.add( timestep(chains[0], seed=0) )
+    stats = analytics.results()
+    assert np.all( stats['mean_distance'] < 500 )
+
+def test_single_chain(chains):
+    coords = chains[0][:LENGTHS[0]]
+    stats = StructureAnalytics().add_all([ (0, timestep(coords, seed=0)) ]).results()
+    assert stats['end_to_end'].shape == (1, 1)
+    assert stats['end_to_end'][0, 0] == pytest.approx( np.linalg.norm(coords[-1] - coords[0]), abs=1e-6 )
+
+def test_chain_lengths_must_match(chains):
+    with pytest.raises(AnalyticsError):
+        StructureAnalytics(lengths=[60, 25]).add( timestep(chains[0], seed=0) )
+    with pytest.raises(AnalyticsError):
+        end_to_end_distance(chains[0], [60, 0, 65])
+    # Separations must fit in the longest chain
+    with pytest.raises(AnalyticsError):
+        StructureAnalytics(separations=[1, 60], lengths=LENGTHS).add( timestep(chains[0], seed=0) )
+
+def test_analyze_file(tmp_path, chains):
+    write_dump( tmp_path/'sim.dump', { 1000 * i: timestep(coords, seed=i) for (i, coords) in enumerate(chains) } )
+    stats = analyze_file(tmp_path/'sim.dump', samples=None, lengths=LENGTHS)
+
+    analytics = StructureAnalytics(samples=None, lengths=LENGTHS)
+    for (i, coords) in enumerate(chains):
+        analytics.add( timestep(coords, seed=i) )
+    expected = analytics.results()
+
+    np.testing.assert_array_equal(stats['timesteps'], [0, 1000, 2000])
+    # (The dump has 5 decimal places)
+    for name in [ 'end_to_end', 'mean_distance', 'radius_of_gyration' ]:
+        np.testing.assert_allclose(stats[name], expected[name], atol=1e-4)
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from hic2structure import batch
+from hic2structure.batch import (
+    BatchDatabase, read_manifest, expand_jobs, run_batch, DONE, FAILED, RUNNING
+)
+from hic2structure.lammps import LAMMPSError
+
+from conftest import RESOLUTION, make_timestep
+
+"""
+Tests for batches of simulations
+"""
+
+pytest.importorskip('hicstraw')
+
+DEFAULTS = {
+    'chromosome': '', 'resolution': RESOLUTION, 'count_threshold': 0,
+    'normalization': 'NONE', 'matrix_type': 'observed', 'distance_threshold': 0,
+    'bond_coeff': 55, 'timesteps': 1000, 'seed': None
+}
+
+@pytest.fixture
+def runs(monkeypatch):
+    """
+    Replaces run_lammps with a fake that records the settings of each
+    run, and fails for chr2
+    """
+    runs = []
+    def run_lammps(records, settings, lammps_exec, copy_log_to=None, **options):
+        runs.append(settings)
+        if settings['chromosome'] == 'chr2':
+            raise LAMMPSError("Bad FENE bond")
+        return { 1000: make_timestep(records.num_beads, seed=settings['seed'] % 1000) }
+    monkeypatch.setattr(batch, 'run_lammps', run_lammps)
+    return runs
+
+def manifest_jobs(tmp_path, hic_file):
+    """
+    Jobs from a manifest without seeds (so each expansion gives the
+    replicas new random seeds)
+    """
+    manifest = tmp_path/'manifest.csv'
+    manifest.write_text(f'file,chromosome,replicas\n{hic_file},chr1,2\n{hic_file},chr2,\n')
+    return expand_jobs( read_manifest(manifest, DEFAULTS) )
+
+def statuses(outdir, ids) -> dict:
+    db = BatchDatabase(outdir/'batch.db')
+    try:
+        return { id: db.status(id) for id in ids }
+    finally:
+        db.close()
+
+def test_resume(tmp_path, hic_file, runs):
+    outdir = tmp_path/'out'
+    jobs = manifest_jobs(tmp_path, hic_file)
+    assert len(jobs) == 3
+
+    results = run_batch(jobs, outdir)
+    assert sorted( r['status'] for r in results ) == [ DONE, DONE, FAILED ]
+    assert len(runs) == 3
+    (first, second, failed) = [ j['id'] for j in jobs ]
+    assert (outdir/'jobs'/first/'structure.csv').exists()
+    assert (outdir/'jobs'/first/'settings.json').exists()
+    seed = next( s['seed'] for (s, j) in zip(runs, jobs) if j['id'] == second )
+
+    # An interrupted job is left running
+    db = BatchDatabase(outdir/'batch.db')
+    db.set_running(second)
+    db.close()
+    assert statuses(outdir, [second]) == { second: RUNNING }
+
+    # Only the interrupted job runs again (with the seed it was first given)
+    runs.clear()
+    results = run_batch(manifest_jobs(tmp_path, hic_file), outdir)
+    assert [ r['id'] for r in results ] == [ second ]
+    assert [ s['seed'] for s in runs ] == [ seed ]
+    assert statuses(outdir, [first, second, failed]) == { first: DONE, second: DONE, failed: FAILED }
+
+    # Failed jobs are only run again when asked
+    runs.clear()
+    assert run_batch(manifest_jobs(tmp_path, hic_file), outdir) == []
+    results = run_batch(manifest_jobs(tmp_path, hic_file), outdir, retry_failed=True)
+    assert [ r['id'] for r in results ] == [ failed ]
+    assert [ s['chromosome'] for s in runs ] == [ 'chr2' ]
+
+def test_job_ids_are_stable(tmp_path, hic_file):
+    ids = [ j['id'] for j in manifest_jobs(tmp_path, hic_file) ]
+    assert ids == [ j['id'] for j in manifest_jobs(tmp_path, hic_file) ]
+    assert len(set(ids)) == 3
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+import pytest
+
+from hic2structure import cache
+from hic2structure.cache import ResultCache, cache_key, run_lammps_cached
+
+from conftest import make_timestep
+
+"""
+Tests for the cache of simulation results
+"""
+
+SETTINGS = { 'bond_coeff': 55, 'timesteps': 1000, 'seed': 1 }
+
+@pytest.fixture
+def contacts():
+    return np.array([ [1, 5], [2, 9], [3, 7], [4, 10] ])
+
+def put(results: ResultCache, key: str, tmp_path, seed: int=0):
+    log = tmp_path/f'{key}.log'
+    log.write_text(f'log for {key}\n')
+    results.put(key, 1000, make_timestep(100, seed=seed), log)
+
+########################
+# KEYS
+########################
+
+def test_key_ignores_record_order(contacts):
+    key = cache_key(contacts, SETTINGS, 'LAMMPS')
+    assert cache_key(contacts[::-1, ::-1], SETTINGS, 'LAMMPS') == key
+    assert cache_key(contacts, { **SETTINGS, 'seed': 2 }, 'LAMMPS') != key
+    assert cache_key(contacts, SETTINGS, 'LAMMPS', pre_relax=True) != key
+    assert cache_key(contacts, SETTINGS, 'other LAMMPS') != key
+    # A cancellation event doesn't change the result
+    assert cache_key(contacts, SETTINGS, 'LAMMPS', cancel=object()) == key
+
+def test_key_needs_a_seed(contacts):
+    with pytest.raises(ValueError):
+        cache_key(contacts, { **SETTINGS, 'seed': None }, 'LAMMPS')
+
+########################
+# ENTRIES
+########################
+
+def test_miss(tmp_path):
+    assert ResultCache(tmp_path/'cache').get('missing') is None
+
+def test_hit(tmp_path):
+    results = ResultCache(tmp_path/'cache')
+    put(results, 'a', tmp_path)
+
+    (timestep, data, log) = results.get('a')
+    assert timestep == 1000
+    np.testing.assert_array_equal(data, make_timestep(100, seed=0))
+    assert log.read_text() == 'log for a\n'
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    results = ResultCache(tmp_path/'cache')
+    put(results, 'a', tmp_path)
+    size = results.entries()[0][1]
+    results.max_bytes = int(2.5 * size)
+
+    put(results, 'b', tmp_path)
+    # 'a' was added first, but is used after 'b'
+    os.utime(tmp_path/'cache'/'a'/'meta.json', (1000, 1000))
+    os.utime(tmp_path/'cache'/'b'/'meta.json', (2000, 2000))
+    assert results.get('a') is not None
+
+    put(results, 'c', tmp_path)
+    assert results.get('b') is None
+    assert results.get('a') is not None and results.get('c') is not None
+    assert sum( size for (_, size, _) in results.entries() ) <= results.max_bytes
+
+########################
+# CACHED RUNS
+########################
+
+def test_run_lammps_cached(tmp_path, contacts, monkeypatch):
+    runs = []
+    def run_lammps(records, settings, lammps_exec, copy_log_to, **options):
+        runs.append(settings)
+        if copy_log_to is not None:
+            copy_log_to.write_text('LAMMPS log\n')
+        return { 0: make_timestep(10, seed=0), 1000: make_timestep(10, seed=1) }
+    monkeypatch.setattr(cache, 'run_lammps', run_lammps)
+
+    results = ResultCache(tmp_path/'cache')
+    lmp = str(tmp_path/'lmp') # (Doesn't exist, so its version is 'unknown')
+    (data, hit) = run_lammps_cached(results, contacts, SETTINGS, lmp)
+    assert not hit and list(data) == [0, 1000]
+
+    (data, hit) = run_lammps_cached(results, contacts, SETTINGS, lmp, copy_log_to=tmp_path/'copy.log')
+    assert hit and len(runs) == 1
+    # Only the final timestep is cached
+    assert list(data) == [1000]
+    np.testing.assert_array_equal(data[1000], make_timestep(10, seed=1))
+    assert (tmp_path/'copy.log').read_text() == 'LAMMPS log\n'
+
+    # Runs without a seed aren't cached
+    run_lammps_cached(results, contacts, { **SETTINGS, 'seed': None }, lmp)
+    run_lammps_cached(results, contacts, { **SETTINGS, 'seed': None }, lmp)
+    assert len(runs) == 3
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from hic2structure.contactmap import ContactMap
+
+"""
+Tests for sparse contact maps
+"""
+
+def random_map(seed: int, num_beads: int=40, size: int=150, counts: bool=True) -> ContactMap:
+    """
+    A contact map with pairs in both orders and repeated pairs
+    """
+    rng = np.random.default_rng(seed)
+    (x, y) = rng.integers(1, num_beads+1, size=(2, size))
+    return ContactMap( x, y, rng.integers(1, 50, size=size) if counts else None, num_beads=num_beads )
+
+def as_dict(cmap: ContactMap) -> dict:
+    """
+    Each (unordered) contact with its summed counts, computed pair by pair
+    """
+    counts = np.ones(len(cmap)) if cmap.counts is None else cmap.counts
+    contacts = {}
+    for (x, y, c) in zip(cmap.x, cmap.y, counts):
+        key = ( min(x, y), max(x, y) )
+        contacts[key] = contacts.get(key, 0) + float(c)
+    return contacts
+
+@pytest.fixture
+def maps():
+    return ( random_map(1), random_map(2, num_beads=50) )
+
+def test_intersection(maps):
+    (a, b) = maps
+    (ours, theirs) = ( as_dict(a), as_dict(b) )
+    result = a & b
+    assert as_dict(result) == { k: v for (k, v) in ours.items() if k in theirs }
+    assert result.num_beads == 50
+
+def test_difference(maps):
+    (a, b) = maps
+    (ours, theirs) = ( as_dict(a), as_dict(b) )
+    result = a - b
+    assert as_dict(result) == { k: v for (k, v) in ours.items() if k not in theirs }
+    assert result.num_beads == 40
+
+def test_union(maps):
+    (a, b) = maps
+    result = a | b
+    # Where a contact is in both, this map's counts are used
+    assert as_dict(result) == { **as_dict(b), **as_dict(a) }
+    assert result.num_beads == 50
+    # The result is sorted, with each contact once
+    assert np.all( np.diff(result.keys) > 0 ) and len(result) == len(result.keys)
+
+def test_binary_maps():
+    (a, b) = ( random_map(3, counts=False), random_map(4, counts=False) )
+    (ours, theirs) = ( set(as_dict(a)), set(as_dict(b)) )
+    assert set(as_dict(a & b)) == ours & theirs
+    assert set(as_dict(a - b)) == ours - theirs
+    assert set(as_dict(a | b)) == ours | theirs
+    assert (a | b).counts is None
+
+def test_union_with_binary_map(maps):
+    binary = random_map(3, counts=False)
+    result = maps[0] | binary
+    # Contacts only in the binary map are counted once
+    assert as_dict(result) == { **{ k: 1.0 for k in as_dict(binary) }, **as_dict(maps[0]) }
+
+def test_degree_and_symmetric(maps):
+    cmap = maps[0]
+    contacts = as_dict(cmap)
+    degree = np.zeros(cmap.num_beads, dtype=np.int32)
+    for (x, y) in contacts:
+        degree[x-1] += 1
+        if x != y:
+            degree[y-1] += 1
+    np.testing.assert_array_equal(cmap.degree, degree)
+
+    symmetric = cmap.symmetric.toarray()
+    np.testing.assert_array_equal(symmetric, symmetric.T)
+    for ((x, y), counts) in contacts.items():
+        assert symmetric[x-1, y-1] == counts
+
+def test_records_round_trip(maps):
+    records = maps[0].to_records()
+    cmap = ContactMap.from_records(records)
+    np.testing.assert_array_equal(cmap.to_records(), records)
+    np.testing.assert_array_equal(ContactMap.from_set(cmap.to_set()).to_set(), cmap.to_set())
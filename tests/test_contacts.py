@@ -0,0 +1,160 @@
+import numpy as np
+import pytest
+
+from hic2structure.contacts import compare_contacts, select_contacts
+
+"""
+Tests for selecting and comparing contacts
+"""
+
+stats = pytest.importorskip('scipy.stats')
+
+########################
+# SELECTION
+########################
+
+@pytest.fixture
+def records():
+    """
+    Upper-triangular records, with tied counts
+    """
+    rng = np.random.default_rng(9)
+    x = rng.integers(1, 30, size=300)
+    y = x + rng.integers(1, 8, size=300)
+    counts = rng.integers(1, 10, size=300)
+    return np.column_stack( (x, y, counts) ).astype(np.float64)
+
+def select(records, **settings):
+    return select_contacts(records, settings)
+
+def test_no_selection(records):
+    np.testing.assert_array_equal(select(records), records)
+
+def test_min_separation(records):
+    expected = [ r for r in records if r[1] - r[0] >= 3 ]
+    np.testing.assert_array_equal(select(records, min_separation=3), expected)
+
+@pytest.mark.parametrize('quantile', [ 0.0, 0.3, 0.5, 1.0 ])
+def test_stratum_quantile(records, quantile):
+    separation = records[:,1] - records[:,0]
+    cuts = {
+        s: np.quantile(records[separation == s, 2], quantile, method='lower')
+        for s in np.unique(separation)
+    }
+    expected = [ r for (r, s) in zip(records, separation) if r[2] >= cuts[s] ]
+    np.testing.assert_array_equal(select(records, stratum_quantile=quantile), expected)
+
+def test_stratum_quantile_range(records):
+    with pytest.raises(ValueError):
+        select(records, stratum_quantile=1.5)
+
+@pytest.mark.parametrize('max_degree', [ 0, 1, 3, 10 ])
+def test_max_degree(records, max_degree):
+    # Distinct counts, so each bead's strongest contacts are well-defined
+    records = records.copy()
+    records[:,2] = np.random.default_rng(10).permutation(len(records))
+
+    strongest = {}
+    for (i, (x, y, c)) in enumerate(records):
+        for bead in (x, y):
+            strongest.setdefault(bead, []).append( (-c, i) )
+    kept = {
+        bead: { i for (_, i) in sorted(contacts)[:max_degree] }
+        for (bead, contacts) in strongest.items()
+    }
+    expected = [ r for (i, r) in enumerate(records) if i in kept[r[0]] and i in kept[r[1]] ]
+
+    selected = select(records, max_degree=max_degree)
+    np.testing.assert_array_equal(selected, np.reshape(expected, (-1, 3)))
+    degree = np.bincount( selected[:,:2].astype(np.int64).ravel() )
+    assert degree.max(initial=0) <= max_degree
+
+@pytest.mark.parametrize('max_contacts', [ 0, 1, 50, 299, 300, 1000 ])
+def test_max_contacts(records, max_contacts):
+    # Ties go to the earlier records
+    best = sorted( range(len(records)), key=lambda i: (-records[i,2], i) )[:max_contacts]
+    expected = records[ np.sort(best).astype(np.int64) ]
+    np.testing.assert_array_equal(select(records, max_contacts=max_contacts), expected)
+
+def test_limits_are_applied_in_order(records):
+    settings = { 'min_separation': 2, 'stratum_quantile': 0.5, 'max_degree': 4, 'max_contacts': 40 }
+    expected = records
+    for name in [ 'min_separation', 'stratum_quantile', 'max_degree', 'max_contacts' ]:
+        expected = select(expected, **{ name: settings[name] })
+    np.testing.assert_array_equal(select_contacts(records, settings), expected)
+    assert len(expected) == 40
+
+########################
+# COMPARISON
+########################
+
+NUM_BEADS = 25
+
+@pytest.fixture
+def maps():
+    """
+    A simulated contact set and experimental records, with pairs in both
+    orders, repeated pairs, self-contacts and tied counts
+    """
+    rng = np.random.default_rng(8)
+    simulated = rng.integers(1, NUM_BEADS+1, size=(120, 2))
+    pairs = rng.integers(1, NUM_BEADS+1, size=(200, 2))
+    counts = rng.integers(1, 6, size=(200, 1)).astype(np.float64)
+    return ( simulated, np.hstack( (pairs, counts) ) )
+
+def dense(pairs: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    A symmetric dense map, summing the values of repeated pairs
+    """
+    matrix = np.zeros( (NUM_BEADS, NUM_BEADS) )
+    for ((x, y), v) in zip(pairs.astype(np.int64), values):
+        if x != y:
+            matrix[x-1, y-1] += v
+            matrix[y-1, x-1] += v
+    return matrix
+
+def correlation(function, a: np.ndarray, b: np.ndarray) -> float:
+    if len(a) < 2 or np.ptp(a) == 0 or np.ptp(b) == 0:
+        return np.nan
+    return function(a, b)[0]
+
+def test_compare_contacts_matches_scipy(maps):
+    (simulated, experimental) = maps
+    result = compare_contacts(simulated, experimental, num_beads=NUM_BEADS)
+
+    sim = dense(simulated, np.ones(len(simulated)))
+    exp = dense(experimental[:,:2], experimental[:,2])
+    separations = np.arange(1, NUM_BEADS)
+    np.testing.assert_array_equal(result['separations'], separations)
+
+    diagonals = [ ( np.diagonal(sim, s), np.diagonal(exp, s) ) for s in separations ]
+    pearson = [ correlation(stats.pearsonr, a, b) for (a, b) in diagonals ]
+    spearman = [ correlation(stats.spearmanr, a, b) for (a, b) in diagonals ]
+    np.testing.assert_allclose(result['pearson'], pearson, rtol=1e-9, atol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(result['spearman'], spearman, rtol=1e-9, atol=1e-12, equal_nan=True)
+    assert np.isfinite(pearson).sum() > NUM_BEADS // 2
+
+    # HiCRep's stratum-adjusted correlation: each stratum is weighted by its
+    # size and the spread of its ranks, normalized by the size
+    weights = np.array([
+        len(a) * np.sqrt( np.var(stats.rankdata(a) / len(a)) * np.var(stats.rankdata(b) / len(b)) )
+        for (a, b) in diagonals
+    ])
+    valid = np.isfinite(pearson) & (weights > 0)
+    scc = np.sum( (weights * pearson)[valid] ) / np.sum( weights[valid] )
+    assert result['scc'] == pytest.approx(scc, rel=1e-9)
+
+    # Precision and recall count each off-diagonal pair once
+    sim_pairs = { (min(x, y), max(x, y)) for (x, y) in simulated if x != y }
+    exp_pairs = { (min(x, y), max(x, y)) for (x, y, _) in experimental.astype(np.int64) if x != y }
+    matches = len(sim_pairs & exp_pairs)
+    assert result['precision'] == pytest.approx( matches / len(sim_pairs) )
+    assert result['recall'] == pytest.approx( matches / len(exp_pairs) )
+
+def test_max_separation(maps):
+    (simulated, experimental) = maps
+    full = compare_contacts(simulated, experimental, num_beads=NUM_BEADS)
+    limited = compare_contacts(simulated, experimental, max_separation=5, num_beads=NUM_BEADS)
+    np.testing.assert_array_equal(limited['separations'], np.arange(1, 6))
+    np.testing.assert_array_equal(limited['pearson'], full['pearson'][:5])
+    np.testing.assert_array_equal(limited['spearman'], full['spearman'][:5])
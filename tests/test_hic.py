@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from hic2structure.hic import HIC, records_to_table
+
+from conftest import RESOLUTION
+
+"""
+Tests for reading contact records from Hi-C files
+"""
+
+hicstraw = pytest.importorskip('hicstraw')
+
+def straw_table(path, chr: str, norm: str, matrix_type: str, chr2: str=None) -> np.ndarray:
+    """
+    The records hic-straw itself reads, as a table sorted by bin
+    """
+    records = hicstraw.straw(matrix_type, norm, str(path), chr, chr2 or chr, 'BP', RESOLUTION)
+    return sort_table( records_to_table(records, RESOLUTION) )
+
+def sort_table(table: np.ndarray) -> np.ndarray:
+    return table[ np.lexsort( (table[:,1], table[:,0]) ) ]
+
+@pytest.mark.parametrize('chr', [ 'chr1', 'chr2' ])
+@pytest.mark.parametrize('matrix_type', [ 'observed', 'oe' ])
+@pytest.mark.parametrize('norm', [ 'NONE', 'KR', 'VC' ])
+def test_table_matches_straw(hic_file, chr, norm, matrix_type):
+    table = sort_table( HIC(hic_file)._table(chr, RESOLUTION, norm, matrix_type) )
+    expected = straw_table(hic_file, chr, norm, matrix_type)
+
+    assert len(expected) > 0
+    np.testing.assert_array_equal(table[:,:2], expected[:,:2])
+    np.testing.assert_allclose(table[:,2], expected[:,2], rtol=1e-6)
+
+@pytest.mark.parametrize('norm', [ 'NONE', 'KR', 'VC' ])
+def test_interchromosomal_table_matches_straw(hic_file, norm):
+    table = sort_table( HIC(hic_file)._table('chr1', RESOLUTION, norm, 'observed', 'chr2') )
+    expected = straw_table(hic_file, 'chr1', norm, 'observed', 'chr2')
+
+    assert len(expected) > 0
+    np.testing.assert_array_equal(table[:,:2], expected[:,:2])
+    np.testing.assert_allclose(table[:,2], expected[:,2], rtol=1e-6)
+
+def test_table_is_computed_from_observed(hic_file):
+    """
+    Only the observed, unnormalized records are decoded. The other
+    tables are kept, and computed from them
+    """
+    hic = HIC(hic_file)
+    hic._table('chr1', RESOLUTION, 'KR', 'oe')
+    assert set( hic._tables.keys() ) == {
+        ('observed', 'NONE', 'chr1', 'chr1', RESOLUTION),
+        ('oe', 'KR', 'chr1', 'chr1', RESOLUTION)
+    }
+
+def test_genome_records_stay_on_their_chains(hic_file):
+    """
+    chr1's length is a multiple of the resolution, so the file has a bin
+    starting at its end. Its records would land on chr2's first bead
+    """
+    hic = HIC(hic_file)
+    assert np.any( hic._table('chr1', RESOLUTION, 'NONE', 'observed')[:,1] == 21 )
+
+    settings = { 'chromosomes': ['chr1', 'chr2'], 'resolution': RESOLUTION,
+                 'count_threshold': 0, 'normalization': 'NONE', 'matrix_type': 'observed' }
+    (records, chromosomes, lengths) = hic.get_genome_contact_records(settings)
+    assert chromosomes == ['chr1', 'chr2']
+    assert lengths == [20, 15]
+
+    offsets = [ 0, lengths[0] ]
+    expected = set()
+    for (i, j) in [ (0, 0), (0, 1), (1, 1) ]:
+        for (x, y, _) in hic._table(chromosomes[i], RESOLUTION, 'NONE', 'observed', chromosomes[j]):
+            (bead1, bead2) = ( x + offsets[i], y + offsets[j] )
+            if x <= lengths[i] and y <= lengths[j] and bead1 != bead2:
+                expected.add( (bead1, bead2) )
+
+    assert { (x, y) for (x, y, _) in records } == expected
+    assert records[:,:2].max() <= sum(lengths)
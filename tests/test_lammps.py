@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pytest
+
+from hic2structure.lammps import (
+    LAMMPSError, CompactDump, iter_dumpfile, read_dumpfile, convert_dumpfile, write_compact_dump
+)
+from hic2structure.trajectory import TrajectoryReader
+
+from conftest import make_timestep, sorted_by_id, write_dump
+
+"""
+Tests for reading and converting LAMMPS dumps
+"""
+
+########################
+# DUMPS
+########################
+
+@pytest.fixture
+def frames():
+    return { timestep: make_timestep(25, seed=timestep) for timestep in (0, 1000, 2000) }
+
+@pytest.fixture
+def dump(tmp_path, frames):
+    path = tmp_path/'sim.dump'
+    write_dump(path, frames)
+    return path
+
+def assert_frames_equal(actual: dict, expected: dict):
+    assert list(actual) == list(expected)
+    for timestep in expected:
+        np.testing.assert_allclose(actual[timestep], expected[timestep], rtol=0, atol=1e-9)
+
+def test_read_dumpfile(dump, frames):
+    assert_frames_equal(read_dumpfile(dump), frames)
+
+def test_truncated_dump(dump):
+    text = dump.read_text()
+    dump.write_text( text[:len(text) - 40] )
+    with pytest.raises(LAMMPSError):
+        list( iter_dumpfile(dump) )
+
+########################
+# COMPACT DUMPS
+########################
+
+def test_compact_dump_matches_read_dumpfile(dump, frames):
+    full = read_dumpfile(dump)
+    compact = read_dumpfile(dump, compact=True)
+    assert isinstance(compact, CompactDump)
+    assert list(compact) == list(full)
+    np.testing.assert_array_equal(compact.timesteps, list(full))
+
+    for (timestep, data) in full.items():
+        # Atoms are sorted by id, with float32 coordinates and int16 images
+        expected = sorted_by_id(data)
+        expected[:,1:4] = expected[:,1:4].astype(np.float32)
+        np.testing.assert_array_equal(compact[timestep].to_timestep(), expected)
+        assert compact[timestep].coords.dtype == np.float32
+
+def test_compact_dump_is_reused(dump, tmp_path):
+    compact_path = tmp_path/'sim.compact'
+    read_dumpfile(dump, compact=compact_path)
+    # A compact file newer than the dump is reused
+    os.utime(compact_path, (2e9, 2e9))
+    stamp = compact_path.stat().st_mtime_ns
+    read_dumpfile(dump, compact=compact_path)
+    assert compact_path.stat().st_mtime_ns == stamp
+
+    # but not if the dump is newer
+    os.utime(compact_path, (1e9, 1e9))
+    read_dumpfile(dump, compact=compact_path)
+    assert compact_path.stat().st_mtime > 1e9
+
+def test_compact_dump_needs_the_same_atoms(tmp_path, frames):
+    frames[3000] = make_timestep(24, seed=3)
+    write_dump(tmp_path/'sim.dump', frames)
+    with pytest.raises(LAMMPSError):
+        write_compact_dump(tmp_path/'sim.dump', tmp_path/'sim.h2c')
+    assert not (tmp_path/'sim.h2c').exists()
+
+def test_empty_compact_dump(tmp_path):
+    (tmp_path/'sim.dump').write_text('')
+    assert len( read_dumpfile(tmp_path/'sim.dump', compact=True) ) == 0
+
+########################
+# TRAJECTORIES
+########################
+
+def test_convert_dumpfile(dump, tmp_path):
+    full = read_dumpfile(dump)
+    assert_frames_equal( convert_dumpfile(dump, tmp_path/'all.h2t', keep_frames=True), full )
+
+    last = convert_dumpfile(dump, tmp_path/'last.h2t', keep_last=True)
+    assert_frames_equal( last, { 2000: full[2000] } )
+    assert convert_dumpfile(dump, tmp_path/'none.h2t') == {}
+
+    for path in [ 'all.h2t', 'last.h2t', 'none.h2t' ]:
+        with TrajectoryReader(tmp_path/path) as reader:
+            assert list(reader) == list(full)
+            for (timestep, data) in full.items():
+                expected = sorted_by_id(data)
+                expected[:,1:4] = expected[:,1:4].astype(np.float32)
+                np.testing.assert_array_equal(reader[timestep], expected)
@@ -0,0 +1,183 @@
+import csv
+
+import numpy as np
+import pytest
+
+from hic2structure.contactmap import pack_pairs, unpack_pairs
+from hic2structure.formats import STRUCTURE_FORMATS
+from hic2structure.out import (
+    structure_format, write_structure, read_structure,
+    write_trajectory, is_trajectory, iter_trajectory,
+    write_contact_records, write_contact_set
+)
+
+from conftest import make_timestep, sorted_by_id
+
+"""
+Tests for writing and reading structure, trajectory and contact map files
+"""
+
+def float32(values: np.ndarray) -> np.ndarray:
+    return values.astype(np.float32).astype(np.float64)
+
+########################
+# STRUCTURES
+########################
+
+@pytest.mark.parametrize('format', list(STRUCTURE_FORMATS))
+def test_structure_round_trip(tmp_path, format):
+    data = make_timestep(50, seed=1)
+    path = tmp_path/f'structure{STRUCTURE_FORMATS[format]}'
+    write_structure(path, data)
+    assert structure_format(path) == format
+
+    structure = read_structure(path)
+    expected = sorted_by_id(data)[:,:4]
+    # Binary formats store float32 coordinates
+    if format != 'csv':
+        expected[:,1:] = float32(expected[:,1:])
+    np.testing.assert_array_equal(structure, expected)
+
+def test_csv_ids_are_integers(tmp_path):
+    path = tmp_path/'structure.csv'
+    write_structure(path, make_timestep(3, seed=1))
+    assert [ line.split(',')[0] for line in path.read_text().splitlines() ] == [ 'id', '1', '2', '3' ]
+
+def test_npz_structure_keeps_ids(tmp_path):
+    data = make_timestep(20, seed=2, ids=np.arange(2, 42, 2))
+    write_structure(tmp_path/'structure.npz', data)
+    np.testing.assert_array_equal(
+        read_structure(tmp_path/'structure.npz')[:,0], np.arange(2, 42, 2)
+    )
+
+@pytest.mark.parametrize('format', [ 'npy', 'raw' ])
+def test_formats_without_ids_need_sequential_ids(tmp_path, format):
+    data = make_timestep(20, seed=2, ids=np.arange(2, 42, 2))
+    with pytest.raises(ValueError):
+        write_structure(tmp_path/f'structure{STRUCTURE_FORMATS[format]}', data)
+
+########################
+# TRAJECTORIES
+########################
+
+@pytest.fixture
+def frames():
+    return { timestep: make_timestep(30, seed=timestep) for timestep in (0, 1000, 2000) }
+
+@pytest.mark.parametrize('format', [ 'npy', 'npz' ])
+@pytest.mark.parametrize('as_iterable', [ False, True ])
+def test_trajectory_round_trip(tmp_path, frames, format, as_iterable):
+    path = tmp_path/f'trajectory.{format}'
+    # Frames are streamed from an iterable, in the order they're given
+    write_trajectory(path, iter(frames.items()) if as_iterable else frames)
+    assert is_trajectory(path)
+
+    read = list( iter_trajectory(path) )
+    # npy trajectories don't store timesteps, so frames are numbered from 0
+    timesteps = list(frames) if format == 'npz' else [0, 1, 2]
+    assert [ t for (t, _) in read ] == timesteps
+    for ((_, structure), data) in zip(read, frames.values()):
+        expected = sorted_by_id(data)[:,:4]
+        expected[:,1:] = float32(expected[:,1:])
+        np.testing.assert_array_equal(structure, expected)
+
+@pytest.mark.parametrize('format', [ 'npy', 'npz' ])
+def test_structure_is_not_a_trajectory(tmp_path, format):
+    path = tmp_path/f'structure.{format}'
+    write_structure(path, make_timestep(10, seed=3))
+    assert not is_trajectory(path)
+
+def test_trajectory_frames_must_have_the_same_beads(tmp_path, frames):
+    frames[3000] = make_timestep(31, seed=3)
+    path = tmp_path/'trajectory.npy'
+    with pytest.raises(ValueError):
+        write_trajectory(path, frames)
+    assert not path.exists()
+
+########################
+# CONTACT MAPS
+########################
+
+def baseline_write_contact_records(path, contacts):
+    """
+    write_contact_records as it was before it was vectorized, which the
+    new output must match (apart from the order of the rows)
+    """
+    max_value = max( contacts[:,2] )
+
+    with open(path, 'w') as f:
+        writer = csv.writer(f, delimiter='\t')
+        seen = set()
+
+        def write_new_row(coords, value):
+            if coords not in seen:
+                writer.writerow([coords[0], coords[1], value])
+                seen.add(coords)
+
+        for row in contacts:
+            x = int(row[0])
+            y = int(row[1])
+            write_new_row( (x,x), max_value )
+            write_new_row( (y,y), max_value )
+            write_new_row( (x, y), row[2] )
+            write_new_row( (y, x), row[2] )
+
+def baseline_write_contact_set(path, contacts):
+    with open(path, 'w') as f:
+        writer = csv.writer(f, delimiter='\t')
+        seen = set()
+
+        def write_new_row(coords):
+            if coords not in seen:
+                writer.writerow([coords[0], coords[1]])
+                seen.add(coords)
+
+        for row in contacts:
+            write_new_row( (row[0], row[1]) )
+            write_new_row( (row[1], row[0]) )
+
+@pytest.fixture
+def records():
+    """
+    Contact records with repeated pairs (in both orders, with different
+    values) and a self-contact
+    """
+    rng = np.random.default_rng(5)
+    pairs = rng.integers(1, 30, size=(200, 2))
+    pairs = np.concatenate( (pairs, pairs[:20, ::-1], [[7, 7]]) )
+    counts = np.round( rng.uniform(0, 100, size=len(pairs)), 3 )
+    return np.column_stack( (pairs, counts) ).astype(np.float64)
+
+def test_contact_records_match_baseline(tmp_path, records):
+    write_contact_records(tmp_path/'new.tsv', records)
+    baseline_write_contact_records(tmp_path/'baseline.tsv', records)
+
+    new = (tmp_path/'new.tsv').read_text().splitlines()
+    assert new == sorted( new, key=lambda line: tuple(map(int, line.split('\t')[:2])) )
+    assert sorted(new) == sorted( (tmp_path/'baseline.tsv').read_text().splitlines() )
+
+def test_contact_set_matches_baseline(tmp_path, records):
+    contacts = records[:,:2].astype(np.int64)
+    write_contact_set(tmp_path/'new.tsv', contacts)
+    baseline_write_contact_set(tmp_path/'baseline.tsv', contacts)
+    assert sorted( (tmp_path/'new.tsv').read_text().splitlines() ) \
+        == sorted( (tmp_path/'baseline.tsv').read_text().splitlines() )
+
+def test_sparse_contact_records(tmp_path, records):
+    scipy_sparse = pytest.importorskip('scipy.sparse')
+    write_contact_records(tmp_path/'new.tsv', records)
+    write_contact_records(tmp_path/'new.npz', records)
+
+    matrix = scipy_sparse.load_npz(tmp_path/'new.npz').tocoo()
+    rows = { (x, y): c for (x, y, c) in np.loadtxt(tmp_path/'new.tsv', ndmin=2) }
+    assert { (x+1, y+1): c for (x, y, c) in zip(matrix.row, matrix.col, matrix.data) } == rows
+
+def test_pack_pairs_sorts_by_x_then_y():
+    rng = np.random.default_rng(6)
+    (x, y) = rng.integers(0, 2**31, size=(2, 100))
+    keys = pack_pairs(x, y)
+    order = np.argsort(keys)
+    np.testing.assert_array_equal( order, np.lexsort((y, x)) )
+    (x2, y2) = unpack_pairs(keys)
+    np.testing.assert_array_equal(x2, x)
+    np.testing.assert_array_equal(y2, y)
@@ -0,0 +1,66 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from hic2structure.out import write_structure, read_structure
+from hic2structure.textio import TextWriter, open_text, text_compression, write_rows
+
+from conftest import make_timestep, sorted_by_id
+
+"""
+Tests for writing and reading compressed text files
+"""
+
+def lines(count: int) -> str:
+    return ''.join( f'{i}\t{i * 0.5!r}\tline {i}\n' for i in range(count) )
+
+@pytest.mark.parametrize('threads', [ 1, 3 ])
+def test_gzip_round_trip(tmp_path, threads):
+    text = lines(5000)
+    path = tmp_path/'out.tsv.gz'
+    # Small blocks, so the file is many gzip members compressed in parallel
+    with TextWriter(path, threads=threads, block_size=4096) as f:
+        for line in text.splitlines(keepends=True):
+            f.write(line)
+
+    assert text_compression(path) == 'gzip'
+    with open_text(path) as f:
+        assert f.read() == text
+    # Any gzip reader can read the concatenated members
+    assert gzip.decompress( path.read_bytes() ).decode('utf-8') == text
+
+def test_uncompressed(tmp_path):
+    text = lines(100)
+    with TextWriter(tmp_path/'out.tsv', block_size=100) as f:
+        f.write(text)
+    assert (tmp_path/'out.tsv').read_text() == text
+
+def test_zstd_round_trip(tmp_path):
+    pytest.importorskip('zstandard')
+    text = lines(2000)
+    with TextWriter(tmp_path/'out.tsv.zst', threads=2, block_size=4096) as f:
+        f.write(text)
+    with open_text(tmp_path/'out.tsv.zst') as f:
+        assert f.read() == text
+
+def test_explicit_compression(tmp_path):
+    with TextWriter(tmp_path/'out.tsv', compression='gzip') as f:
+        f.write('a\tb\n')
+    with open_text(tmp_path/'out.tsv', compression='gzip') as f:
+        assert f.read() == 'a\tb\n'
+    with pytest.raises(ValueError):
+        TextWriter(tmp_path/'out.tsv', compression='lz4')
+
+def test_write_rows(tmp_path):
+    rng = np.random.default_rng(11)
+    (ids, values) = ( np.arange(1000), rng.normal(size=1000) )
+    with TextWriter(tmp_path/'rows.tsv.gz', block_size=1000) as f:
+        write_rows(f, '%d\t%r', ids, values, chunk_size=64)
+    with open_text(tmp_path/'rows.tsv.gz') as f:
+        assert f.read() == ''.join( f'{i}\t{v!r}\n' for (i, v) in zip(ids.tolist(), values.tolist()) )
+
+def test_compressed_structure(tmp_path):
+    data = make_timestep(200, seed=12)
+    write_structure(tmp_path/'structure.csv.gz', data)
+    np.testing.assert_array_equal( read_structure(tmp_path/'structure.csv.gz'), sorted_by_id(data)[:,:4] )
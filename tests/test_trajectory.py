@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from hic2structure.trajectory import (
+    TrajectoryWriter, TrajectoryReader, TrajectoryError, COMPRESSIONS, _QUANT_STEPS
+)
+from hic2structure.types import CompactTimestep
+
+from conftest import make_timestep, sorted_by_id
+
+"""
+Tests for compact trajectory files
+"""
+
+@pytest.fixture
+def frames():
+    """
+    Seven frames of a moving structure (so there's a partial chunk with
+    three frames per chunk), with image flags changing between frames
+    """
+    rng = np.random.default_rng(4)
+    data = make_timestep(40, seed=4)
+    frames = {}
+    for timestep in range(0, 7000, 1000):
+        data = data.copy()
+        data[:,1:4] = np.round( data[:,1:4] + rng.normal(size=(40, 3)), 5 )
+        data[:,4:7] += rng.integers(-1, 2, size=(40, 3))
+        frames[timestep] = rng.permutation(data)
+    return frames
+
+def write(path, frames, **options):
+    with TrajectoryWriter(path, frames_per_chunk=3, **options) as writer:
+        for (timestep, data) in frames.items():
+            writer.append(timestep, data)
+
+@pytest.mark.parametrize('delta', [ False, True ])
+@pytest.mark.parametrize('compression', list(COMPRESSIONS))
+def test_float32_round_trip(tmp_path, frames, delta, compression):
+    write(tmp_path/'trajectory.h2t', frames, delta=delta, compression=compression)
+
+    with TrajectoryReader(tmp_path/'trajectory.h2t') as reader:
+        assert list(reader) == list(frames)
+        # Frames can be read in any order
+        for timestep in reversed(list(frames)):
+            expected = sorted_by_id(frames[timestep])
+            expected[:,1:4] = expected[:,1:4].astype(np.float32)
+            np.testing.assert_array_equal(reader[timestep], expected)
+
+@pytest.mark.parametrize('delta', [ False, True ])
+def test_int16_round_trip(tmp_path, frames, delta):
+    """
+    int16 coordinates are within half a quantization step (the range of
+    a chunk's coordinates over _QUANT_STEPS) of the originals. Ids and
+    image flags are exact
+    """
+    write(tmp_path/'trajectory.h2t', frames, precision='int16', delta=delta)
+
+    span = np.ptp( np.stack(list(frames.values()))[:,:,1:4] )
+    tolerance = span / _QUANT_STEPS / 2 * (1 + 1e-9)
+    with TrajectoryReader(tmp_path/'trajectory.h2t') as reader:
+        assert len(reader) == len(frames)
+        for (timestep, data) in frames.items():
+            expected = sorted_by_id(data)
+            np.testing.assert_array_equal(reader[timestep][:,[0,4,5,6]], expected[:,[0,4,5,6]])
+            assert np.abs(reader[timestep][:,1:4] - expected[:,1:4]).max() <= tolerance
+
+def test_compact_timesteps(tmp_path, frames):
+    compact = {
+        timestep: CompactTimestep(
+            data[:,0].astype(np.int32), data[:,1:4].astype(np.float32), data[:,4:7].astype(np.int16)
+        )
+        for (timestep, data) in frames.items()
+    }
+    write(tmp_path/'compact.h2t', compact)
+    write(tmp_path/'full.h2t', frames)
+    with TrajectoryReader(tmp_path/'compact.h2t') as compact, TrajectoryReader(tmp_path/'full.h2t') as full:
+        for timestep in frames:
+            np.testing.assert_array_equal(compact[timestep], full[timestep])
+
+def test_frames_must_have_the_same_atoms(tmp_path, frames):
+    with TrajectoryWriter(tmp_path/'trajectory.h2t') as writer:
+        writer.append(0, frames[0])
+        with pytest.raises(TrajectoryError):
+            writer.append(1000, frames[1000][1:])
+
+def test_unclosed_file_is_rejected(tmp_path, frames):
+    writer = TrajectoryWriter(tmp_path/'trajectory.h2t')
+    writer.append(0, frames[0])
+    writer._file.flush()
+    with pytest.raises(TrajectoryError):
+        TrajectoryReader(tmp_path/'trajectory.h2t')
+    writer.close()
+
+def test_other_files_are_rejected(tmp_path):
+    (tmp_path/'structure.csv').write_text('id,x,y,z\n')
+    with pytest.raises(TrajectoryError):
+        TrajectoryReader(tmp_path/'structure.csv')